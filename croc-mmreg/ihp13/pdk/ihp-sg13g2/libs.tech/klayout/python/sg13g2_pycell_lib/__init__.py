@@ -38,7 +38,9 @@ import re
 import importlib
 import importlib.util
 import pathlib
-import tempfile
+import hashlib
+import json
+import marshal
 import traceback
 
 moduleNames = [
@@ -120,6 +122,114 @@ def getProcessNames():
     return processNames
 
 
+def getCacheDir():
+    cacheDir = os.getenv('IHP_PYCELL_LIB_CACHE')
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'sg13g2_pycell_lib')
+    return cacheDir
+
+
+def writeCacheFile(path, data):
+    # written to a temporary file first, concurrent KLayout starts never read partial files
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    with open(tmpPath, 'wb') as file:
+        file.write(data)
+    os.replace(tmpPath, path)
+
+
+def getDefines(source):
+    defines = []
+    for line in source.splitlines():
+        match = re.match(r'^#ifdef\s+\w+', line)
+        if match:
+            splittedLine = line.split()
+            for i, define in enumerate(splittedLine):
+                if i % 2 == 1:
+                    if define not in defines:
+                        defines.append(define)
+
+    return defines
+
+
+class ModuleCache:
+    """
+    Persistent cache of the preprocessed and byte-compiled PyCell modules.
+
+    The index keeps the size, modification time, hash and #ifdef names of each
+    module source, so a source is only read again if it changed. Code objects
+    are stored per source hash and set of defines.
+    """
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.indexPath = os.path.join(cacheDir, f"index.{sys.implementation.cache_tag}.json")
+        self.changed = False
+
+        try:
+            with open(self.indexPath, 'r') as file:
+                self.index = json.load(file)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def getSourceInfo(self, moduleName, modulePath):
+        stat = os.stat(modulePath)
+        info = self.index.get(moduleName)
+        if info is not None and info['size'] == stat.st_size and info['mtime'] == stat.st_mtime_ns:
+            return info
+
+        with open(modulePath, 'rb') as file:
+            source = file.read()
+
+        info = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': hashlib.sha256(source).hexdigest()[:16],
+            'defines': getDefines(source.decode('utf-8'))
+        }
+        self.index[moduleName] = info
+        self.changed = True
+        return info
+
+    def getCodePath(self, moduleName, info, definesSet):
+        definesHash = hashlib.sha256(','.join(sorted(definesSet)).encode()).hexdigest()[:8]
+        return os.path.join(self.cacheDir, f"{moduleName}-{info['hash']}-{definesHash}.pyc")
+
+    def loadCode(self, codePath):
+        try:
+            with open(codePath, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        if data[:len(importlib.util.MAGIC_NUMBER)] != importlib.util.MAGIC_NUMBER:
+            return None
+
+        return marshal.loads(data[len(importlib.util.MAGIC_NUMBER):])
+
+    def saveCode(self, moduleName, info, codePath, code):
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            writeCacheFile(codePath, importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+
+            # code of older versions of the source is removed
+            for fileName in os.listdir(self.cacheDir):
+                if fileName.startswith(f"{moduleName}-") and fileName.endswith('.pyc') \
+                        and not fileName.startswith(f"{moduleName}-{info['hash']}-"):
+                    os.remove(os.path.join(self.cacheDir, fileName))
+        except OSError as error:
+            print(f'Cannot write PyCell cache: {error}')
+
+    def save(self):
+        if not self.changed:
+            return
+
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            writeCacheFile(self.indexPath, json.dumps(self.index, indent=1, sort_keys=True).encode())
+        except OSError as error:
+            print(f'Cannot write PyCell cache: {error}')
+
+
 """
 Support for 'conditional compilation' in a C-style manner of PyCell code:
 
@@ -141,6 +251,10 @@ is set.
 The list of names which are used in an #ifdef-statement and are considered as 'defined' will be dumped
 if the environment variable 'IHP_PYCELL_LIB_PRINT_DEFINES_SET' is set.
 
+The preprocessed and byte-compiled modules are cached in '~/.cache/sg13g2_pycell_lib', another
+directory can be set with the environment variable 'IHP_PYCELL_LIB_CACHE'. The cache is not used
+if the environment variable 'IHP_PYCELL_LIB_NO_CACHE' is set.
+
 """
 class PyCellLib(pya.Library):
     def __init__(self):
@@ -148,9 +262,10 @@ class PyCellLib(pya.Library):
 
         tech = Tech.get('SG13_dev')
 
-        processNames = getProcessNames()
-
+        # the process chain is only needed to resolve #ifdef names
+        processNames = None
         if os.getenv('IHP_PYCELL_LIB_PRINT_PROCESS_TREE') is not None:
+            processNames = getProcessNames()
             processChain = ''
             isFirst = True
             for processName in reversed(processNames):
@@ -163,31 +278,30 @@ class PyCellLib(pya.Library):
         module = importlib.import_module(f"{__name__}.ihp.pypreprocessor")
         preProcessor = getattr(module, "preprocessor")
 
+        cache = None
+        if os.getenv('IHP_PYCELL_LIB_NO_CACHE') is None:
+            cache = ModuleCache(getCacheDir())
+
+        envs = []
+        for env in os.environ:
+            envs.append(env.lower())
+
         definesSetToPrint = []
 
         for moduleName in moduleNames:
-            defines = []
             definesSet = []
 
             modulePath = os.path.join(os.path.dirname(__file__), 'ihp', f"{moduleName}.py")
-            moduleFile = io.open(modulePath, 'r', encoding=sys.stdin.encoding)
 
-            try:
-                for line in moduleFile:
-                    match = re.match(r'^#ifdef\s+\w+', line)
-                    if match:
-                        splittedLine = line.split()
-                        for i, define in enumerate(splittedLine):
-                            if i % 2 == 1:
-                                if define not in defines:
-                                    defines.append(define)
-
-            finally:
-                moduleFile.close()
-
-            envs = []
-            for env in os.environ:
-                envs.append(env.lower())
+            if cache is not None:
+                info = cache.getSourceInfo(moduleName, modulePath)
+                defines = info['defines']
+            else:
+                with io.open(modulePath, 'r', encoding='utf-8') as moduleFile:
+                    defines = getDefines(moduleFile.read())
+
+            if len(defines) > 0 and processNames is None:
+                processNames = getProcessNames()
 
             for define in defines:
                 locDefine = define.lower()
@@ -201,35 +315,45 @@ class PyCellLib(pya.Library):
             for defineSet in definesSet:
                 definesSetToPrint.append(defineSet)
 
-            modulePreProcPath = None
+            code = None
+            if cache is not None:
+                codePath = cache.getCodePath(moduleName, info, definesSet)
+                code = cache.loadCode(codePath)
 
-            if len(defines) > 0:
-                modulePreProcPath = os.path.join(tempfile.gettempdir(), f"{moduleName}_pre.py")
-
-                pyPreProcessor = preProcessor(modulePath, modulePreProcPath, definesSet, removeMeta=False, resume=True, run=False)
-                pyPreProcessor.parse()
+            if code is None:
+                if len(defines) > 0:
+                    pyPreProcessor = preProcessor(modulePath, None, definesSet, removeMeta=False, resume=True, run=False)
+                    pyPreProcessor.parse()
+                    source = pyPreProcessor.get_output()
+                else:
+                    with io.open(modulePath, 'r', encoding='utf-8') as moduleFile:
+                        source = moduleFile.read()
 
-                spec = importlib.util.spec_from_file_location(f"{__name__}.ihp.{moduleName}", modulePreProcPath)
-                module = importlib.util.module_from_spec(spec)
-                sys.modules[moduleName] = module
+                # compiled with the path of the original source for tracebacks
+                code = compile(source, modulePath, 'exec')
+                if cache is not None:
+                    cache.saveCode(moduleName, info, codePath, code)
 
-                try:
-                    spec.loader.exec_module(module)
-                except:
-                    trace = traceback.format_exc().splitlines()
-                    for line in trace:
-                        print(line.replace(modulePreProcPath, modulePath))
+            spec = importlib.util.spec_from_file_location(f"{__name__}.ihp.{moduleName}", modulePath)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
 
-                    sys.exit(1)
+            try:
+                exec(code, module.__dict__)
+            except:
+                trace = traceback.format_exc().splitlines()
+                for line in trace:
+                    print(line)
 
-                os.remove(modulePreProcPath)
-            else:
-                module = importlib.import_module(f"{__name__}.ihp." + moduleName)
+                sys.exit(1)
 
             match = re.fullmatch(r'^(\S+)_code$', moduleName)
             if match:
                 func = getattr(module, f"{match.group(1)}")
-                self.layout().register_pcell(match.group(1), PCellWrapper(func(), tech, modulePreProcPath, modulePath))
+                self.layout().register_pcell(match.group(1), PCellWrapper(func(), tech))
+
+        if cache is not None:
+            cache.save()
 
         if os.getenv('IHP_PYCELL_LIB_PRINT_DEFINES_SET') is not None:
             print(f"Current defines set: {definesSetToPrint}")
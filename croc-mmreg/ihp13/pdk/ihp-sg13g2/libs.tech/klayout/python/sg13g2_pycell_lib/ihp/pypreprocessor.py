@@ -294,8 +294,15 @@ class preprocessor:
                         print('Block:', item, ' is in condition: ', cond)
         self.post_process()
 
+    # post-processed code of the last parse
+    def get_output(self):
+        return self.__outputBuffer
+
     # post-processor
     def post_process(self):
+        # no output file: the code is only kept in memory (get_output)
+        if self.output is None:
+            return
         try:
             # set file name
             if self.output == '':
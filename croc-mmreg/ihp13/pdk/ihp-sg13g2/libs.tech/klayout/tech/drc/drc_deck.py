@@ -0,0 +1,421 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Rule groups of the SG13G2 DRC decks.
+
+The DRC decks check each rule in a block of the form
+
+    -> do
+        <check>
+    end.().output("<rule>", "<description>")
+
+The category of a rule is the part of its name before the first dot, e.g.
+`M1` for `M1.b`. A group deck is a copy of the deck that only keeps the blocks
+of the selected rules. Layer derivations (single line assignments after
+the run mode statement) not used by any kept code are removed as well. Each
+kept rule writes its violation count and run time as JSON lines.
+"""
+
+import os
+import re
+import json
+import xml.etree.ElementTree as ET
+
+CACHE_DIR_ENV = "SG13G2_DRC_CACHE"
+
+RULE_BLOCK_START = re.compile(r"^\s*-> .*\bdo\s*$")
+RULE_BLOCK_END = re.compile(r"^\s*end\.\(\)")
+RULE_NAME = re.compile(r"\.output\(\"([^\"]+)\"")
+
+# Run mode statement of the decks, layer derivations follow it
+RUN_MODE_STATEMENT = re.compile(r"^deep\s*$", re.MULTILINE)
+
+# Layer derivation, one statement on one line
+LAYER_ASSIGNMENT = re.compile(r"^([A-Za-z_]\w*) = (.*)$")
+
+# Line endings that continue a statement on the next line
+CONTINUATION_ENDINGS = (",", "(", "[", "{", "\\", "+", "-", "*", "/", "&", "|", "=", ".", " do", "?", ":")
+
+IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+# Operations whose distance argument is the interaction distance of a rule
+DISTANCE_OPERATION = re.compile(
+    r"\b\w*(?:space|separation|enclosed|enclosing|overlap|sized|enlarge_inside|extended)"
+    r"\([^()]*?(\d+(?:\.\d+)?)\.um\b"
+)
+
+# Density checks are evaluated on the full chip
+DENSITY_CHECK = re.compile(r"\bext_with_density\(")
+
+# Violation count message of the DRCLayer#output override of the decks
+RULE_REPORT = re.compile(r"^(\s*)puts\(\"Rule %s: %d error\(s\)\" % \[args\[0\], count\]\)\s*$", re.MULTILINE)
+
+RULE_STATS_PRELUDE = """# Rule statistics, generated by run_drc.py
+require 'json'
+$drc_rule_start = Time.now
+$drc_rule_stats = $rule_stats ? File.open($rule_stats, 'w') : nil
+"""
+
+RULE_STATS_RECORD = """{indent}if $drc_rule_stats
+{indent}    stats = {{ 'rule' => args[0], 'count' => count, 'time' => Time.now - $drc_rule_start }}
+{indent}    $drc_rule_stats.puts(stats.to_json)
+{indent}    $drc_rule_stats.flush
+{indent}end
+{indent}$drc_rule_start = Time.now"""
+
+
+def get_cache_dir(sub_dir: str = ""):
+    """
+    Get the local cache directory for SG13G2 DRC and create it if needed.
+
+    Parameters
+    ----------
+    sub_dir : str
+        Sub directory inside the cache directory.
+
+    Returns
+    -------
+    string
+        Path of the cache directory.
+    """
+    base_dir = os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.path.expanduser("~"), ".cache", "sg13g2_drc"
+    )
+    cache_dir = os.path.join(base_dir, sub_dir) if sub_dir else base_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def read_deck(deck_path: str):
+    """
+    Read the DSL code of a DRC deck, from the text of a .lydrc macro or a plain .drc file.
+
+    Returns
+    -------
+    string
+        Code of the deck.
+    """
+    if deck_path.endswith(".lydrc"):
+        return ET.parse(deck_path).getroot().findtext("text")
+
+    with open(deck_path, "r") as f:
+        return f.read()
+
+
+def get_rule_category(rule_name: str):
+    """Category of a rule, e.g. M1 for M1.b."""
+    return rule_name.split(".")[0]
+
+
+def split_rule_blocks(code: str):
+    """
+    Split the deck code into rule blocks and other code.
+
+    Parameters
+    ----------
+    code : str
+        Code of the deck.
+
+    Returns
+    -------
+    List of tuple
+        (lines, rule names) for each part of the deck in order. The rule names
+        are empty for code outside of rule blocks.
+    """
+    parts = []
+    lines = []
+    in_block = False
+
+    for line in code.split("\n"):
+        if not in_block and RULE_BLOCK_START.match(line):
+            if lines:
+                parts.append((lines, []))
+            lines = []
+            in_block = True
+
+        lines.append(line)
+
+        if in_block and RULE_BLOCK_END.match(line):
+            parts.append((lines, RULE_NAME.findall("\n".join(lines))))
+            lines = []
+            in_block = False
+
+    if in_block:
+        raise ValueError(f"Rule block not closed: {lines[0].strip()}")
+    if lines:
+        parts.append((lines, []))
+
+    return parts
+
+
+def get_rule_categories(code: str):
+    """
+    Get the rule categories of a deck.
+
+    Returns
+    -------
+    dict
+        Rule names per category, in deck order.
+    """
+    categories = dict()
+    for _, rules in split_rule_blocks(code):
+        for rule in rules:
+            categories.setdefault(get_rule_category(rule), []).append(rule)
+
+    return categories
+
+
+def get_density_rules(code: str):
+    """
+    Get the rules with density checks, they are not local to a region of the layout.
+    """
+    rules = []
+    for lines, block_rules in split_rule_blocks(code):
+        if block_rules and DENSITY_CHECK.search("\n".join(lines)):
+            rules.extend(block_rules)
+
+    return rules
+
+
+def get_interaction_distance(code: str):
+    """
+    Get the maximum interaction distance of the deck, the largest distance of
+    any space, separation, enclosure, overlap or sizing operation.
+
+    Returns
+    -------
+    float
+        Distance in um.
+    """
+    distances = [float(d) for d in DISTANCE_OPERATION.findall(code)]
+    return max(distances) if distances else 0.0
+
+
+def is_single_line_statement(line: str, next_line: str):
+    """Check if a statement at column 0 doesn't continue on the next line."""
+    if line.split(" #")[0].rstrip().endswith(CONTINUATION_ENDINGS):
+        return False
+
+    return not next_line.startswith((" ", "\t", ".", ")", "]", "}"))
+
+
+def prune_layer_derivations(lines: list, start: int):
+    """
+    Remove layer derivations that are not used by any other code.
+
+    Parameters
+    ----------
+    lines : list of str
+        Lines of the deck.
+    start : int
+        Index of the first line that may be removed.
+
+    Returns
+    -------
+    List of str
+        Lines without unused derivations.
+    """
+    derivations = dict()
+    for i in range(start, len(lines)):
+        match = LAYER_ASSIGNMENT.match(lines[i])
+        next_line = lines[i + 1] if i + 1 < len(lines) else ""
+        if match and is_single_line_statement(lines[i], next_line):
+            derivations.setdefault(match.group(1), []).append(i)
+
+    # Names assigned more than once are kept, the order of assignments matters
+    derivations = {k: v[0] for k, v in derivations.items() if len(v) == 1}
+    derived_lines = {i: name for name, i in derivations.items()}
+
+    uses = dict()
+    for i, line in enumerate(lines):
+        code = line[line.index(" = ") + 3:] if i in derived_lines else line
+        for name in set(IDENTIFIER.findall(code)):
+            if name in derivations:
+                uses.setdefault(name, set()).add(i)
+
+    removed = set()
+    changed = True
+    while changed:
+        changed = False
+        for name, i in derivations.items():
+            if i not in removed and not uses.get(name, set()) - removed:
+                removed.add(i)
+                changed = True
+
+    return [line for i, line in enumerate(lines) if i not in removed]
+
+
+def build_group_deck(code: str, rules: list, run_mode_code: str = "deep"):
+    """
+    Build a deck that only checks some rules.
+
+    Parameters
+    ----------
+    code : str
+        Code of the full deck.
+    rules : list of str
+        Names of the rules to keep.
+    run_mode_code : str
+        Statements that replace the run mode statement of the deck, e.g. threads and tiles.
+
+    Returns
+    -------
+    string
+        Code of the group deck. It writes the violation count and run time of
+        each rule to the file given by the switch rule_stats.
+    """
+    if not RULE_REPORT.search(code) or not RUN_MODE_STATEMENT.search(code):
+        raise ValueError("Deck has no rule report or run mode statement to instrument")
+
+    rules = set(rules)
+    lines = []
+    for part_lines, block_rules in split_rule_blocks(code):
+        if block_rules and not rules.intersection(block_rules):
+            continue
+        if block_rules:
+            lines.append("$drc_rule_start = Time.now")
+        lines.extend(part_lines)
+
+    code = "\n".join(lines)
+    code = RULE_REPORT.sub(lambda m: m.group(0) + "\n" + RULE_STATS_RECORD.format(indent=m.group(1)), code, count=1)
+    code = RUN_MODE_STATEMENT.sub(lambda m: run_mode_code, code, count=1)
+
+    lines = code.split("\n")
+    start = lines.index(run_mode_code.split("\n")[-1]) + 1
+    return RULE_STATS_PRELUDE + "\n".join(prune_layer_derivations(lines, start))
+
+
+def write_group_deck(deck_path: str, rules: list, output_path: str, run_mode_code: str = "deep"):
+    """
+    Write a group deck as plain .drc file.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the full deck.
+    rules : list of str
+        Names of the rules to keep.
+    output_path : str
+        Path of the generated deck.
+    run_mode_code : str
+        Statements that replace the run mode statement of the deck.
+    """
+    with open(output_path, "w") as f:
+        f.write(build_group_deck(read_deck(deck_path), rules, run_mode_code))
+
+
+def read_rule_stats(stats_path: str):
+    """
+    Read the rule statistics written by a group deck.
+
+    Returns
+    -------
+    List of dict
+        Rule name, violation count and run time in seconds of each checked rule.
+    """
+    stats = []
+    if not os.path.isfile(stats_path):
+        return stats
+
+    with open(stats_path, "r") as f:
+        for line in f:
+            if line.strip():
+                stats.append(json.loads(line))
+
+    return stats
+
+
+def get_rule_times_path(deck_name: str):
+    """
+    Get the path of the measured rule run times of a deck.
+    """
+    return os.path.join(get_cache_dir("rule_times"), f"{deck_name}.json")
+
+
+def load_rule_times(deck_name: str):
+    """
+    Load the run times of the rules measured in previous runs.
+
+    Returns
+    -------
+    dict
+        Run time in seconds per rule name.
+    """
+    try:
+        with open(get_rule_times_path(deck_name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_rule_times(deck_name: str, stats: list):
+    """
+    Save the run times of the checked rules for balancing the next runs.
+
+    Parameters
+    ----------
+    deck_name : str
+        Name of the deck, e.g. sg13g2_maximal.
+    stats : list of dict
+        Rule statistics from read_rule_stats.
+    """
+    times = load_rule_times(deck_name)
+    times.update({s["rule"]: round(s["time"], 3) for s in stats})
+
+    tmp_path = f"{get_rule_times_path(deck_name)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(times, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, get_rule_times_path(deck_name))
+
+
+def split_categories(categories: dict, num_groups: int, rule_times: dict = None):
+    """
+    Split rule categories into groups of about the same run time. Categories
+    are assigned longest first to the group with the lowest total. Rules
+    without measured time count as the mean of the measured rules.
+
+    Parameters
+    ----------
+    categories : dict
+        Rule names per category from get_rule_categories.
+    num_groups : int
+        Number of groups.
+    rule_times : dict, optional
+        Measured run time per rule name from load_rule_times.
+
+    Returns
+    -------
+    List of list
+        Categories of each group, without empty groups.
+    """
+    rule_times = rule_times or dict()
+    known = [t for t in rule_times.values() if t is not None]
+    default_time = sum(known) / len(known) if known else 1.0
+
+    weights = {
+        category: sum(rule_times.get(r, default_time) for r in rules)
+        for category, rules in categories.items()
+    }
+
+    groups = [[] for _ in range(max(1, min(num_groups, len(categories))))]
+    totals = [0.0] * len(groups)
+    for category in sorted(weights, key=lambda c: -weights[c]):
+        i = totals.index(min(totals))
+        groups[i].append(category)
+        totals[i] += weights[category]
+
+    return [g for g in groups if g]
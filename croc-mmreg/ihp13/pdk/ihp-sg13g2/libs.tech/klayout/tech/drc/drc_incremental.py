@@ -0,0 +1,355 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Region-incremental DRC for SG13G2.
+
+The layout of the last incremental run and its flat report are kept for each
+layout, deck and set of switches. The next run compares the new layout with
+it layer by layer (XOR). The changed region is grown by the interaction
+distance of the deck to the result region, in which all markers are
+recomputed. The layout is clipped to the result region grown once more, so
+clipping doesn't create markers inside the result region. Density rules are
+not local and are checked on the full layout.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import klayout.db
+import drc_report
+from drc_deck import get_cache_dir
+
+STATE_FILE = "state.json"
+
+# Switches that don't change the results of a run
+RUN_SWITCHES = ["in_gds", "report_file", "rule_stats", "log_file"]
+
+
+def get_deck_hash(deck_path: str):
+    """SHA256 hash of the deck file."""
+    with open(deck_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_state_dir(layout_path: str, deck_path: str, sws: dict):
+    """
+    Get the directory with the state of the last incremental run of a layout.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout.
+    deck_path : str
+        Path of the DRC deck.
+    sws : dict
+        Switches of the run.
+
+    Returns
+    -------
+    string
+        Path of the state directory.
+    """
+    key = {
+        "layout": os.path.abspath(layout_path),
+        "deck": os.path.basename(deck_path),
+        "switches": {k: v for k, v in sorted(sws.items()) if k not in RUN_SWITCHES},
+    }
+    key_hash = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    return get_cache_dir(os.path.join("incremental", key_hash))
+
+
+def load_state(state_dir: str, deck_hash: str):
+    """
+    Load the state of the last incremental run.
+
+    Returns
+    -------
+    dict or None
+        Paths of the checked layout and its report, None if there is no
+        usable state or the deck changed since.
+    """
+    try:
+        with open(os.path.join(state_dir, STATE_FILE), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if state.get("deck_hash") != deck_hash:
+        return None
+
+    state["layout"] = os.path.join(state_dir, state["layout"])
+    state["report"] = os.path.join(state_dir, state["report"])
+    if not os.path.isfile(state["layout"]) or not os.path.isfile(state["report"]):
+        return None
+
+    return state
+
+
+def save_state(state_dir: str, deck_hash: str, layout_path: str, report_path: str):
+    """
+    Keep a checked layout and its report for the next incremental run.
+
+    Parameters
+    ----------
+    state_dir : str
+        State directory from get_state_dir.
+    deck_hash : str
+        Hash of the deck used for the run.
+    layout_path : str
+        Path of the checked layout.
+    report_path : str
+        Path of the flat report of the layout.
+    """
+    layout_name = "layout" + os.path.splitext(layout_path)[1]
+    shutil.copyfile(layout_path, os.path.join(state_dir, layout_name))
+    shutil.copyfile(report_path, os.path.join(state_dir, "report.lyrdb"))
+
+    tmp_path = os.path.join(state_dir, f"{STATE_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"deck_hash": deck_hash, "layout": layout_name, "report": "report.lyrdb"}, f)
+    os.replace(tmp_path, os.path.join(state_dir, STATE_FILE))
+
+
+def read_layout(layout_path: str, topcell: str = None):
+    """
+    Read a layout and get its top cell.
+
+    Returns
+    -------
+    tuple
+        Layout and top cell, the top cell is None if it's not found or not unique.
+    """
+    layout = klayout.db.Layout()
+    layout.read(layout_path)
+
+    if topcell:
+        return layout, layout.cell(topcell)
+
+    top_cells = layout.top_cells()
+    return layout, top_cells[0] if len(top_cells) == 1 else None
+
+
+def get_text_markers(cell, layer_index: int):
+    """Texts of a layer as strings with position, for comparing labels."""
+    return {str(t) for t in klayout.db.Texts(cell.begin_shapes_rec(layer_index)).each()}
+
+
+def get_changed_region(old_layout_path: str, new_layout_path: str, topcell: str = None):
+    """
+    Get the region where two versions of a layout differ on any layer.
+
+    Parameters
+    ----------
+    old_layout_path : str
+        Path of the previously checked layout.
+    new_layout_path : str
+        Path of the new layout.
+    topcell : str, optional
+        Name of the top cell, default is the top cell of the layout.
+
+    Returns
+    -------
+    Region or None
+        Changed region in database units of the new layout, None if the
+        layouts can't be compared (different top cell or database unit).
+    """
+    old_layout, old_top = read_layout(old_layout_path, topcell)
+    new_layout, new_top = read_layout(new_layout_path, topcell)
+    if old_top is None or new_top is None or old_top.name != new_top.name or old_layout.dbu != new_layout.dbu:
+        return None
+
+    layers = {(i.layer, i.datatype) for i in old_layout.layer_infos()}
+    layers |= {(i.layer, i.datatype) for i in new_layout.layer_infos()}
+
+    dss = klayout.db.DeepShapeStore()
+    changed = klayout.db.Region()
+    for layer, datatype in sorted(layers):
+        old_index = old_layout.find_layer(layer, datatype)
+        new_index = new_layout.find_layer(layer, datatype)
+        old_region = klayout.db.Region()
+        if old_index is not None:
+            old_region = klayout.db.Region(old_top.begin_shapes_rec(old_index), dss)
+        new_region = klayout.db.Region()
+        if new_index is not None:
+            new_region = klayout.db.Region(new_top.begin_shapes_rec(new_index), dss)
+        changed.insert((old_region ^ new_region).flatten())
+
+        old_texts = set() if old_index is None else get_text_markers(old_top, old_index)
+        new_texts = set() if new_index is None else get_text_markers(new_top, new_index)
+        for text in old_texts ^ new_texts:
+            position = klayout.db.Text.from_s(text).position()
+            changed.insert(klayout.db.Box(position, position).enlarged(1, 1))
+
+    return changed.merged()
+
+
+def merge_boxes(boxes: list):
+    """
+    Merge overlapping boxes into their bounding boxes until no boxes overlap.
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box.overlaps(other):
+                    result[i] = other + box
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+
+    return boxes
+
+
+def get_check_windows(changed, halo_dbu: int):
+    """
+    Get the result region and the check windows for a changed region.
+
+    Parameters
+    ----------
+    changed : Region
+        Changed region from get_changed_region.
+    halo_dbu : int
+        Interaction distance in database units.
+
+    Returns
+    -------
+    tuple
+        Result region (changes grown by the halo) and list of check windows
+        (boxes covering the result region grown by the halo).
+    """
+    result_region = changed.sized(halo_dbu).merged()
+    windows = [p.bbox() for p in result_region.sized(halo_dbu).merged().each()]
+    return result_region, merge_boxes(windows)
+
+
+def write_window_layout(layout_path: str, topcell: str, windows: list, output_path: str):
+    """
+    Write the content of a layout inside the check windows to a new layout
+    with a top cell of the same name. Coordinates are kept.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout.
+    topcell : str
+        Name of the top cell, default is the top cell of the layout.
+    windows : list of Box
+        Check windows in database units.
+    output_path : str
+        Path of the window layout.
+    """
+    layout, top = read_layout(layout_path, topcell)
+    target = klayout.db.Layout()
+    target.dbu = layout.dbu
+    for layer_index in layout.layer_indexes():
+        target.insert_layer_at(layer_index, layout.get_info(layer_index))
+
+    clip_cells = layout.multi_clip_into(top.cell_index(), target, windows)
+    for i, cell_index in enumerate(clip_cells):
+        target.cell(cell_index).name = f"{top.name}$WINDOW{i}"
+
+    window_top = target.create_cell(top.name)
+    for cell_index in clip_cells:
+        window_top.insert(klayout.db.CellInstArray(cell_index, klayout.db.Trans()))
+
+    target.write(output_path)
+
+
+def merge_incremental_report(
+    prior_path: str,
+    window_path: str,
+    result_region,
+    dbu: float,
+    output_path: str,
+    density_path: str = None,
+    density_rules: list = None,
+):
+    """
+    Merge the results of an incremental run into the report of the previous run.
+
+    Markers touching the result region are taken from the window run, all
+    others from the previous report. Density rules are taken from the full
+    layout density run if there is one.
+
+    Parameters
+    ----------
+    prior_path : str
+        Flat report of the previous run.
+    window_path : str
+        Report of the window run.
+    result_region : Region
+        Result region from get_check_windows.
+    dbu : float
+        Database unit of the layout.
+    output_path : str
+        Path of the merged report.
+    density_path : str, optional
+        Report of the density rules on the full layout.
+    density_rules : list of str, optional
+        Names of the density rules.
+    """
+    replaced = set(density_rules or []) if density_path else set()
+
+    def touches(geometries):
+        for geometry in geometries:
+            box = geometry.bbox().to_itype(dbu).enlarged(1, 1)
+            if not result_region.interacting(klayout.db.Region(box)).is_empty():
+                return True
+        return False
+
+    prior = drc_report.load_report(prior_path)
+    merged = drc_report.create_report(prior)
+    drc_report.add_flat_items(
+        prior, merged, lambda category, geometries: category not in replaced and not touches(geometries)
+    )
+    drc_report.add_flat_items(
+        drc_report.load_report(window_path), merged,
+        lambda category, geometries: category not in replaced and touches(geometries),
+    )
+    if density_path:
+        drc_report.add_flat_items(drc_report.load_report(density_path), merged)
+
+    merged.save(output_path)
+
+
+def compare_reports(report_path: str, reference_path: str):
+    """
+    Compare the markers of two reports.
+
+    Returns
+    -------
+    dict
+        Number of markers only in the report ("extra") and only in the
+        reference ("missing") per category name, only for categories with differences.
+    """
+    signatures = drc_report.get_item_signatures(report_path)
+    reference = drc_report.get_item_signatures(reference_path)
+
+    differences = dict()
+    for key in set(signatures) | set(reference):
+        delta = signatures.get(key, 0) - reference.get(key, 0)
+        if delta != 0:
+            counts = differences.setdefault(key[0], {"extra": 0, "missing": 0})
+            counts["extra" if delta > 0 else "missing"] += abs(delta)
+
+    return differences
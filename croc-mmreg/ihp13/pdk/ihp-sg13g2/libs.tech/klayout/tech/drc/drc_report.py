@@ -0,0 +1,209 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""DRC report database helpers.
+
+Reports of deep mode runs keep markers in the cells where they were found.
+Flattened reports have all markers in the top cell, so markers of
+different runs can be compared and combined by their location.
+"""
+
+import klayout.db
+import klayout.rdb
+
+# Marker geometry types of report item values
+GEOMETRY_TYPES = [
+    ("is_polygon", "polygon"),
+    ("is_box", "box"),
+    ("is_edge", "edge"),
+    ("is_edge_pair", "edge_pair"),
+    ("is_path", "path"),
+    ("is_text", "text"),
+]
+
+
+def load_report(report_path: str):
+    """Load a report database."""
+    report = klayout.rdb.ReportDatabase("DRC")
+    report.load(report_path)
+    return report
+
+
+def get_value_geometry(value):
+    """
+    Get the marker geometry of a report item value.
+
+    Returns
+    -------
+    DPolygon, DBox, DEdge, DEdgePair, DPath, DText or None
+        Geometry in um, None for values without geometry (strings, floats).
+    """
+    for check, getter in GEOMETRY_TYPES:
+        if getattr(value, check)():
+            return getattr(value, getter)()
+
+    return None
+
+
+def get_top_transformations(report, cell_id: int):
+    """
+    Get all transformations of a report cell into the top cell.
+
+    Returns
+    -------
+    List of DCplxTrans
+        One transformation for each placement, identity for the top cell.
+    """
+    references = list(report.cell_by_id(cell_id).each_reference())
+    if not references:
+        return [klayout.db.DCplxTrans()]
+
+    transformations = []
+    for reference in references:
+        for parent_trans in get_top_transformations(report, reference.parent_cell_id):
+            transformations.append(parent_trans * reference.trans)
+
+    return transformations
+
+
+def copy_item(item, target, cell_id: int, category_id: int, trans=None):
+    """
+    Copy a report item, optionally with transformed marker geometry.
+    """
+    new_item = target.create_item(cell_id, category_id)
+    for value in item.each_value():
+        geometry = get_value_geometry(value)
+        if geometry is not None and trans is not None:
+            value = klayout.rdb.RdbItemValue(geometry.transformed(trans))
+        new_item.add_value(value)
+
+
+def get_target_category(target, category):
+    """
+    Get the category with the name of a category from another report, create it if needed.
+    """
+    target_category = target.category_by_path(category.path())
+    if target_category is None:
+        target_category = target.create_category(category.name())
+        target_category.description = category.description
+
+    return target_category
+
+
+def create_report(template):
+    """
+    Create an empty report with the description, top cell and categories of a template report.
+    """
+    report = klayout.rdb.ReportDatabase(template.name())
+    report.description = template.description
+    report.top_cell_name = template.top_cell_name
+    report.generator = template.generator
+    report.original_file = template.original_file
+    report.create_cell(template.top_cell_name)
+    for category in template.each_category():
+        get_target_category(report, category)
+
+    return report
+
+
+def get_top_cell_id(report):
+    """Id of the top cell of a report, it's created if needed."""
+    cell = report.cell_by_qname(report.top_cell_name)
+    if cell is None:
+        cell = report.create_cell(report.top_cell_name)
+
+    return cell.rdb_id()
+
+
+def add_flat_items(source, target, keep=None):
+    """
+    Add the items of a report to the top cell of another report.
+
+    Parameters
+    ----------
+    source : ReportDatabase
+        Report with the items to add.
+    target : ReportDatabase
+        Report the items are added to.
+    keep : function, optional
+        keep(category name, list of geometries) selects the items to add.
+    """
+    top_cell_id = get_top_cell_id(target)
+    transformations = dict()
+
+    for item in source.each_item():
+        category = source.category_by_id(item.category_id())
+        if item.cell_id() not in transformations:
+            transformations[item.cell_id()] = get_top_transformations(source, item.cell_id())
+
+        for trans in transformations[item.cell_id()]:
+            if keep is not None:
+                geometries = [get_value_geometry(v) for v in item.each_value()]
+                geometries = [g.transformed(trans) for g in geometries if g is not None]
+                if not keep(category.name(), geometries):
+                    continue
+            copy_item(item, target, top_cell_id, get_target_category(target, category).rdb_id(), trans)
+
+
+def merge_reports(report_paths: list, output_path: str):
+    """
+    Merge report databases of the same layout into a flat report.
+
+    Parameters
+    ----------
+    report_paths : list of str
+        Paths of the report databases.
+    output_path : str
+        Path of the merged report database.
+    """
+    reports = [load_report(path) for path in report_paths]
+    merged = create_report(reports[0])
+    for report in reports:
+        for category in report.each_category():
+            get_target_category(merged, category)
+        add_flat_items(report, merged)
+    merged.save(output_path)
+
+
+def get_item_signatures(report_path: str):
+    """
+    Get the markers of a report, independent of cell hierarchy and item order.
+
+    Returns
+    -------
+    dict
+        Number of items per (category name, marker string).
+    """
+    report = load_report(report_path)
+    flat = create_report(report)
+    add_flat_items(report, flat)
+
+    signatures = dict()
+    for item in flat.each_item():
+        values = sorted(v.to_s() for v in item.each_value())
+        key = (flat.category_by_id(item.category_id()).name(), "; ".join(values))
+        signatures[key] = signatures.get(key, 0) + 1
+
+    return signatures
+
+
+def count_category_items(report_path: str):
+    """
+    Get the number of items per category name.
+    """
+    report = load_report(report_path)
+    return {c.name(): c.num_items() for c in report.each_category()}
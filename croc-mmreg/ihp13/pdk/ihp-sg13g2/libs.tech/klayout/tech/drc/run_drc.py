@@ -0,0 +1,525 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Run IHP 130nm BiCMOS Open Source PDK - SG13G2 DRC.
+
+Usage:
+    run_drc.py (--help| -h)
+    run_drc.py (--path=<file_path>) [--deck=<deck>] [--run_dir=<run_dir_path>] [--topcell=<topcell_name>]
+    [--run_mode=<run_mode>] [--threads=<num>] [--groups=<num>] [--tile_size=<um>] [--tile_border=<um>]
+    [--no_offgrid] [--no_filler] [--no_density] [--no_recommended] [--no_sanity]
+    [--incremental] [--verify] [--halo=<um>]
+
+Options:
+    --help -h                           Displays this help message.
+    --path=<file_path>                  Specifies the file path of the input GDS file.
+    --deck=<deck>                       Selects the rule deck (minimal, maximal). [default: maximal]
+    --run_dir=<run_dir_path>            Run directory to save all the generated results [default: pwd]
+    --topcell=<topcell_name>            Specifies the name of the top cell to be used, default is the top cell of
+                                        the layout.
+    --run_mode=<run_mode>               Selects the allowed KLayout mode. (flat, deep, tiling). [default: deep]
+    --threads=<num>                     Number of threads used by each KLayout process. [default: 1]
+    --groups=<num>                      Number of rule groups checked in parallel KLayout processes, default is
+                                        number of CPUs divided by threads.
+    --tile_size=<um>                    Tile size in um for --run_mode=tiling. [default: 1000]
+    --tile_border=<um>                  Tile border in um for --run_mode=tiling. [default: 10]
+    --no_offgrid                        Disables the off-grid checks.
+    --no_filler                         Disables the filler checks.
+    --no_density                        Disables the density checks.
+    --no_recommended                    Disables the recommended rules.
+    --no_sanity                         Disables the sanity checks.
+    --incremental                       Only rechecks the regions that changed since the last incremental run of
+                                        the layout.
+    --verify                            Compares the incremental result with a full run.
+    --halo=<um>                         Interaction distance around changed regions, default is the largest rule
+                                        distance of the deck.
+"""
+
+from docopt import docopt
+import os
+import csv
+import time
+import shutil
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, Popen, PIPE, STDOUT
+import drc_deck
+import drc_incremental
+import drc_report
+
+DRC_DECKS = ["minimal", "maximal"]
+
+
+def check_klayout_version():
+    """
+    Check klayout version and makes sure it would work with the DRC.
+    """
+    proc = run(["klayout", "-b", "-v"], stdout=PIPE, stderr=PIPE, text=True) if shutil.which("klayout") else None
+    klayout_v_ = proc.stdout.split("\n")[0].strip() if proc else ""
+
+    if klayout_v_ == "":
+        logging.error("Klayout is not found. Please make sure klayout is installed.")
+        exit(1)
+
+    klayout_v_list = [int(v) for v in klayout_v_.split(" ")[-1].split(".")]
+    if len(klayout_v_list) < 2 or klayout_v_list[1] < 29:
+        logging.error("Prerequisites at a minimum: KLayout 0.29.0")
+        exit(1)
+
+    logging.info(f"Your Klayout version is: {klayout_v_}")
+
+
+def check_layout_path(layout_path: str):
+    """
+    Check that the layout exists and is GDS2 or OASIS. Otherwise, kill the process.
+
+    Returns
+    -------
+    string
+        Absolute layout path.
+    """
+    layout_path = os.path.abspath(os.path.expanduser(layout_path))
+
+    if not os.path.isfile(layout_path):
+        logging.error(f"Layout file path {layout_path} provided doesn't exist or not a file.")
+        exit(1)
+
+    if ".gds" not in layout_path and ".oas" not in layout_path:
+        logging.error(f"Layout {layout_path} is not in GDS2 or OASIS format, please recheck.")
+        exit(1)
+
+    return layout_path
+
+
+def get_run_mode_code(arguments: dict):
+    """
+    Get the statements that select the KLayout mode and threads of the group decks.
+
+    Parameters
+    ----------
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+
+    Returns
+    -------
+    string
+        Ruby statements replacing the `deep` statement of the deck.
+    """
+    run_mode = arguments["--run_mode"]
+    threads = int(arguments["--threads"])
+
+    if run_mode == "deep":
+        return f"deep\nthreads({threads})"
+    if run_mode == "flat":
+        return f"flat\nthreads({threads})"
+    if run_mode == "tiling":
+        return "\n".join([
+            f"tiles({float(arguments['--tile_size'])}.um)",
+            f"tile_borders({float(arguments['--tile_border'])}.um)",
+            f"threads({threads})",
+        ])
+
+    logging.error("Allowed klayout modes are (flat, deep, tiling) only")
+    exit(1)
+
+
+def generate_klayout_switches(arguments: dict, layout_path: str):
+    """
+    Parse all the args from input to prepare switches for the DRC run.
+
+    Returns
+    -------
+    dict
+        Dictionary that represent all run switches passed to klayout.
+    """
+    switches = {
+        "in_gds": layout_path,
+        "offGrid": "false" if arguments.get("--no_offgrid") else "true",
+        "filler": "false" if arguments.get("--no_filler") else "true",
+        "density": "false" if arguments.get("--no_density") else "true",
+        "noRecommendedRules": "true" if arguments.get("--no_recommended") else "false",
+        "sanityRules": "false" if arguments.get("--no_sanity") else "true",
+    }
+
+    if arguments.get("--topcell"):
+        switches["cell"] = arguments["--topcell"]
+
+    return switches
+
+
+def get_num_groups(arguments: dict):
+    """
+    Get the number of parallel rule groups.
+    """
+    if arguments.get("--groups"):
+        return max(1, int(arguments["--groups"]))
+
+    return max(1, (os.cpu_count() or 1) // max(1, int(arguments["--threads"])))
+
+
+def run_group(deck_path: str, sws: dict, log_path: str):
+    """
+    Run a group deck in a klayout process.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the group deck.
+    sws : dict
+        Switches of the run, including report_file and rule_stats.
+    log_path : str
+        Path of the klayout log.
+
+    Returns
+    -------
+    tuple
+        Exit code and run time in seconds.
+    """
+    cmd = ["klayout", "-b", "-r", deck_path]
+    for k, v in sws.items():
+        cmd.extend(["-rd", f"{k}={v}"])
+
+    t0 = time.time()
+    with open(log_path, "w") as log:
+        proc = Popen(cmd, stdout=log, stderr=STDOUT)
+        proc.wait()
+
+    return proc.returncode, time.time() - t0
+
+
+def write_rule_table(rule_stats: list, table_path: str):
+    """
+    Write violation count and run time of all rules, slowest first.
+    """
+    with open(table_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["rule", "category", "group", "violations", "run_time"])
+        writer.writeheader()
+        for s in sorted(rule_stats, key=lambda s: -s["time"]):
+            writer.writerow({
+                "rule": s["rule"],
+                "category": drc_deck.get_rule_category(s["rule"]),
+                "group": s["group"],
+                "violations": s["count"],
+                "run_time": f"{s['time']:.3f}",
+            })
+
+
+def run_drc(
+    deck_path: str,
+    layout_path: str,
+    run_dir: str,
+    sws: dict,
+    num_groups: int,
+    run_mode_code: str,
+    rules: list = None,
+    record_times: bool = True,
+):
+    """
+    Run the DRC with the rule categories split into groups checked in parallel.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the DRC deck.
+    layout_path : str
+        Path of the layout.
+    run_dir : str
+        Run directory for all results.
+    sws : dict
+        Switches of the run.
+    num_groups : int
+        Number of parallel groups.
+    run_mode_code : str
+        Statements that select the KLayout mode of the group decks.
+    rules : list of str, optional
+        Names of the rules to check, default is all rules of the deck.
+    record_times : bool
+        Save the rule run times for balancing the groups of later runs.
+
+    Returns
+    -------
+    tuple
+        Path of the merged (flat) report database and list of the rule statistics.
+    """
+    deck_name = os.path.splitext(os.path.basename(deck_path))[0]
+    layout_base_name = os.path.splitext(os.path.basename(layout_path))[0]
+
+    categories = drc_deck.get_rule_categories(drc_deck.read_deck(deck_path))
+    if rules is not None:
+        categories = {c: [r for r in rs if r in rules] for c, rs in categories.items()}
+        categories = {c: rs for c, rs in categories.items() if rs}
+    groups = drc_deck.split_categories(categories, num_groups, drc_deck.load_rule_times(deck_name))
+    logging.info(f"Checking {len(categories)} rule categories of {deck_name} in {len(groups)} groups.")
+
+    jobs = []
+    for i, group in enumerate(groups):
+        group_dir = os.path.join(run_dir, f"group_{i}")
+        os.makedirs(group_dir, exist_ok=True)
+        group_deck = os.path.join(group_dir, f"{deck_name}_group_{i}.drc")
+        rules = [r for category in group for r in categories[category]]
+        drc_deck.write_group_deck(deck_path, rules, group_deck, run_mode_code)
+
+        group_sws = dict(sws)
+        group_sws["in_gds"] = layout_path
+        group_sws["report_file"] = os.path.join(group_dir, f"{layout_base_name}_{deck_name}.lyrdb")
+        group_sws["rule_stats"] = os.path.join(group_dir, "rule_stats.jsonl")
+        jobs.append((i, group, group_deck, group_sws, os.path.join(group_dir, f"{layout_base_name}_drc.log")))
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(run_group, deck, group_sws, log) for _, _, deck, group_sws, log in jobs]
+        results = [f.result() for f in futures]
+
+    rule_stats = []
+    failed = False
+    for (i, group, _, group_sws, log_path), (returncode, run_time) in zip(jobs, results):
+        stats = drc_deck.read_rule_stats(group_sws["rule_stats"])
+        rule_stats.extend(dict(s, group=i) for s in stats)
+        logging.info(f"Group {i} ({', '.join(group)}): {len(stats)} rules checked in {run_time:.1f}s")
+        if returncode != 0 or not os.path.isfile(group_sws["report_file"]):
+            logging.error(f"Klayout DRC run of group {i} failed with exit code {returncode}, see {log_path}")
+            failed = True
+
+    if failed:
+        exit(1)
+
+    if record_times:
+        drc_deck.save_rule_times(deck_name, rule_stats)
+
+    report_path = os.path.join(run_dir, f"{layout_base_name}_{deck_name}.lyrdb")
+    drc_report.merge_reports([job[3]["report_file"] for job in jobs], report_path)
+    write_rule_table(rule_stats, os.path.join(run_dir, f"{layout_base_name}_{deck_name}_rules.csv"))
+
+    return report_path, rule_stats
+
+
+def run_incremental_drc(
+    deck_path: str,
+    layout_path: str,
+    run_dir: str,
+    sws: dict,
+    num_groups: int,
+    run_mode_code: str,
+    halo: float = None,
+):
+    """
+    Run the DRC only in the regions that changed since the last incremental
+    run of the layout and merge the results into its report. Without a
+    usable previous run, the full layout is checked.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the DRC deck.
+    layout_path : str
+        Path of the layout.
+    run_dir : str
+        Run directory for all results.
+    sws : dict
+        Switches of the run.
+    num_groups : int
+        Number of parallel groups.
+    run_mode_code : str
+        Statements that select the KLayout mode of the group decks.
+    halo : float, optional
+        Interaction distance in um, default is the largest rule distance of the deck.
+
+    Returns
+    -------
+    tuple
+        Path of the merged report database and list of the rule statistics.
+    """
+    deck_name = os.path.splitext(os.path.basename(deck_path))[0]
+    layout_base_name = os.path.splitext(os.path.basename(layout_path))[0]
+    report_path = os.path.join(run_dir, f"{layout_base_name}_{deck_name}.lyrdb")
+
+    deck_hash = drc_incremental.get_deck_hash(deck_path)
+    state_dir = drc_incremental.get_state_dir(layout_path, deck_path, sws)
+    state = drc_incremental.load_state(state_dir, deck_hash)
+
+    changed = None
+    if state is not None:
+        changed = drc_incremental.get_changed_region(state["layout"], layout_path, sws.get("cell"))
+
+    if changed is None:
+        logging.info("No comparable previous run of this layout, checking the full layout.")
+        report_path, rule_stats = run_drc(deck_path, layout_path, run_dir, sws, num_groups, run_mode_code)
+        drc_incremental.save_state(state_dir, deck_hash, layout_path, report_path)
+        return report_path, rule_stats
+
+    if changed.is_empty():
+        logging.info("Layout is unchanged since the last run, reusing its report.")
+        shutil.copyfile(state["report"], report_path)
+        return report_path, []
+
+    code = drc_deck.read_deck(deck_path)
+    halo = float(halo) if halo else drc_deck.get_interaction_distance(code)
+    layout, _ = drc_incremental.read_layout(layout_path, sws.get("cell"))
+    result_region, windows = drc_incremental.get_check_windows(changed, int(round(halo / layout.dbu)))
+    checked_area = sum(w.area() for w in windows) * layout.dbu ** 2
+    logging.info(
+        f"Checking {len(windows)} window(s) of {checked_area:.0f} um2 around the changes with a halo of {halo} um."
+    )
+
+    window_dir = os.path.join(run_dir, "windows")
+    os.makedirs(window_dir, exist_ok=True)
+    window_layout = os.path.join(window_dir, f"{layout_base_name}.gds")
+    drc_incremental.write_window_layout(layout_path, sws.get("cell"), windows, window_layout)
+
+    categories = drc_deck.get_rule_categories(code)
+    density_rules = drc_deck.get_density_rules(code) if sws.get("density") != "false" else []
+    local_rules = [r for rs in categories.values() for r in rs if r not in density_rules]
+
+    window_report, rule_stats = run_drc(
+        deck_path, window_layout, window_dir, sws, num_groups, run_mode_code, local_rules, record_times=False
+    )
+
+    density_report = None
+    if density_rules:
+        density_dir = os.path.join(run_dir, "density")
+        os.makedirs(density_dir, exist_ok=True)
+        density_report, density_stats = run_drc(
+            deck_path, layout_path, density_dir, sws, num_groups, run_mode_code, density_rules, record_times=False
+        )
+        rule_stats += density_stats
+
+    drc_incremental.merge_incremental_report(
+        state["report"], window_report, result_region, layout.dbu, report_path, density_report, density_rules
+    )
+    drc_incremental.save_state(state_dir, deck_hash, layout_path, report_path)
+
+    return report_path, rule_stats
+
+
+def verify_incremental_drc(
+    deck_path: str, layout_path: str, run_dir: str, sws: dict, num_groups: int, run_mode_code: str, report_path: str
+):
+    """
+    Compare the report of an incremental run with a full run of the layout.
+
+    Returns
+    -------
+    bool
+        True if both reports have the same markers.
+    """
+    verify_dir = os.path.join(run_dir, "verify")
+    os.makedirs(verify_dir, exist_ok=True)
+    full_report, _ = run_drc(deck_path, layout_path, verify_dir, sws, num_groups, run_mode_code)
+
+    differences = drc_incremental.compare_reports(report_path, full_report)
+    for category, counts in sorted(differences.items()):
+        logging.error(
+            f"Rule {category}: {counts['extra']} extra and {counts['missing']} missing marker(s) in incremental run"
+        )
+
+    return not differences
+
+
+def main(drc_run_dir: str, arguments: dict):
+    """
+    Main function to run the DRC.
+
+    Parameters
+    ----------
+    drc_run_dir : str
+        String with absolute path of the full run dir.
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+        This is generated by docopt library.
+    """
+    if arguments["--deck"] not in DRC_DECKS:
+        logging.error(f"Allowed rule decks are ({', '.join(DRC_DECKS)}) only")
+        exit(1)
+
+    check_klayout_version()
+
+    deck_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), f"sg13g2_{arguments['--deck']}.lydrc"
+    )
+    layout_path = check_layout_path(arguments["--path"])
+    switches = generate_klayout_switches(arguments, layout_path)
+
+    num_groups = get_num_groups(arguments)
+    run_mode_code = get_run_mode_code(arguments)
+
+    if arguments.get("--incremental"):
+        report_path, rule_stats = run_incremental_drc(
+            deck_path, layout_path, drc_run_dir, switches, num_groups, run_mode_code, arguments.get("--halo")
+        )
+    else:
+        report_path, rule_stats = run_drc(deck_path, layout_path, drc_run_dir, switches, num_groups, run_mode_code)
+
+    for s in sorted(rule_stats, key=lambda s: -s["time"])[:10]:
+        logging.info(f"Rule {s['rule']}: {s['count']} violation(s) in {s['time']:.3f}s")
+
+    if arguments.get("--incremental") and arguments.get("--verify"):
+        if not verify_incremental_drc(
+            deck_path, layout_path, drc_run_dir, switches, num_groups, run_mode_code, report_path
+        ):
+            logging.error("Incremental DRC result differs from the full run.")
+            exit(1)
+        logging.info("Incremental DRC result matches the full run.")
+
+    violations = sum(drc_report.count_category_items(report_path).values())
+    if violations > 0:
+        logging.error(f"DRC found {violations} violation(s), please check the report {report_path}")
+        exit(1)
+
+    logging.info(f"DRC is clean, report saved to {report_path}")
+
+
+# ================================================================
+# -------------------------- MAIN --------------------------------
+# ================================================================
+
+
+if __name__ == "__main__":
+    # arguments
+    arguments = docopt(__doc__, version="RUN DRC: 1.0")
+
+    now_str = datetime.utcnow().strftime("drc_run_%Y_%m_%d_%H_%M_%S")
+
+    if (
+        arguments["--run_dir"] == "pwd"
+        or arguments["--run_dir"] == ""
+        or arguments["--run_dir"] is None
+    ):
+        drc_run_dir = os.path.join(os.path.abspath(os.getcwd()), now_str)
+    else:
+        drc_run_dir = os.path.abspath(arguments["--run_dir"])
+
+    os.makedirs(drc_run_dir, exist_ok=True)
+
+    # logs format
+    logging.basicConfig(
+        level=logging.DEBUG,
+        handlers=[
+            logging.FileHandler(os.path.join(drc_run_dir, "{}.log".format(now_str))),
+            logging.StreamHandler(),
+        ],
+        format="%(asctime)s | %(levelname)-7s | %(message)s",
+        datefmt="%d-%b-%Y %H:%M:%S",
+    )
+
+    # Start of execution time
+    t0 = time.time()
+
+    # Calling main function
+    main(drc_run_dir, arguments)
+
+    #  End of execution time
+    logging.info("Total execution time {}s".format(time.time() - t0))
@@ -0,0 +1,637 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Layout metadata scanner for SG13G2 LVS.
+
+Builds the cell reference graph of a GDS2 or OASIS layout without building
+geometry, to find top cells and collect layout statistics before LVS starts.
+GDS2 files (also gzip compressed) are streamed record by record, OASIS files
+are read by KLayout with all layers disabled. Results are cached by file hash.
+
+Usage:
+    layout_scanner.py <layout_path> [--no_cache] [--check]
+
+    --check     Compare the scanned top cells with the top cells KLayout reads, exit 1 on mismatch.
+"""
+
+import os
+import sys
+import gzip
+import json
+import struct
+import hashlib
+import math
+import logging
+import threading
+
+# Cache location, can be changed with environment variable SG13G2_LVS_CACHE
+CACHE_DIR_ENV = "SG13G2_LVS_CACHE"
+SCAN_CACHE_VERSION = 3
+
+# Hidden cell KLayout writes for PCell and library context, dropped by KLayout when reading
+CONTEXT_INFO_CELL = "$$$CONTEXT_INFO$$$"
+
+# GDS2 record types used by the scanner
+GDS_HEADER = 0x00
+GDS_BGNLIB = 0x01
+GDS_UNITS = 0x03
+GDS_ENDLIB = 0x04
+GDS_BGNSTR = 0x05
+GDS_STRNAME = 0x06
+GDS_ENDSTR = 0x07
+GDS_BOUNDARY = 0x08
+GDS_PATH = 0x09
+GDS_SREF = 0x0A
+GDS_AREF = 0x0B
+GDS_TEXT = 0x0C
+GDS_LAYER = 0x0D
+GDS_DATATYPE = 0x0E
+GDS_WIDTH = 0x0F
+GDS_XY = 0x10
+GDS_ENDEL = 0x11
+GDS_SNAME = 0x12
+GDS_COLROW = 0x13
+GDS_TEXTTYPE = 0x16
+GDS_STRANS = 0x1A
+GDS_MAG = 0x1B
+GDS_ANGLE = 0x1C
+GDS_BOX = 0x2D
+GDS_BOXTYPE = 0x2E
+
+GDS_SHAPE_RECORDS = (GDS_BOUNDARY, GDS_PATH, GDS_BOX)
+GDS_READ_CHUNK = 1 << 22
+
+
+def get_cache_dir(sub_dir: str = ""):
+    """
+    Get the local cache directory for SG13G2 LVS and create it if needed.
+
+    Parameters
+    ----------
+    sub_dir : str
+        Sub directory inside the cache directory.
+
+    Returns
+    -------
+    string
+        Path of the cache directory.
+    """
+    base_dir = os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.path.expanduser("~"), ".cache", "sg13g2_lvs"
+    )
+    cache_dir = os.path.join(base_dir, sub_dir) if sub_dir else base_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_sha256(file_path: str):
+    """
+    Get the SHA256 hash of a file. Hashes are remembered per path, size and
+    modification time, so unchanged large layouts are hashed only once.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file to hash.
+
+    Returns
+    -------
+    string
+        Hex digest of the file content.
+    """
+    stat = os.stat(file_path)
+    stamp = f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    index_path = os.path.join(get_cache_dir("hash"), "index.json")
+
+    index = {}
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+    if stamp in index:
+        return index[stamp]
+
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(GDS_READ_CHUNK), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    index[stamp] = digest
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    return digest
+
+
+def open_layout_stream(layout_path: str):
+    """
+    Open layout file for binary reading, gzip compressed files are detected by magic number.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout file.
+
+    Returns
+    -------
+    file object
+        Binary stream with uncompressed layout data.
+    """
+    with open(layout_path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(layout_path, "rb")
+    return open(layout_path, "rb")
+
+
+def gds_string(data: bytes):
+    """Decode GDS2 string record data, strings are padded with zero bytes."""
+    return data.rstrip(b"\x00").decode("ascii", errors="replace")
+
+
+def gds_records(stream):
+    """
+    Iterate over GDS2 records of a binary stream.
+
+    Parameters
+    ----------
+    stream : file object
+        Binary stream of GDS2 data.
+
+    Yields
+    ------
+    tuple
+        Record type and record data (without the 4 byte header).
+    """
+    buffer = b""
+    pos = 0
+    eof = False
+
+    while True:
+        if len(buffer) - pos < 4 or len(buffer) - pos < struct.unpack_from(">H", buffer, pos)[0]:
+            if eof:
+                if len(buffer) - pos > 0:
+                    raise ValueError("Unexpected end of GDS2 stream")
+                return
+            chunk = stream.read(GDS_READ_CHUNK)
+            eof = len(chunk) == 0
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        length, record_type = struct.unpack_from(">HB", buffer, pos)
+        if length < 4:
+            # zero padding at end of file
+            if record_type == 0 and not buffer[pos:].strip(b"\x00"):
+                return
+            raise ValueError(f"Invalid GDS2 record length {length}")
+
+        yield record_type, buffer[pos + 4:pos + length]
+        pos += length
+
+        if record_type == GDS_ENDLIB:
+            return
+
+
+def scan_gds(layout_path: str):
+    """
+    Scan GDS2 file for cells, references, shape counts and bounding boxes without building geometry.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the GDS2 file, can be gzip compressed.
+
+    Returns
+    -------
+    dict
+        Scan result, see scan_layout.
+    """
+    cells = {}
+    dbu = None
+    cell = None
+    cell_name = None
+    element = None
+    ref_name = None
+    ref_count = 1
+
+    # Geometry needed for bounding boxes, kept in memory only
+    local_boxes = {}
+    placements = {}
+    path_width = 0
+    ref = None
+
+    with open_layout_stream(layout_path) as stream:
+        for record_type, data in gds_records(stream):
+            if record_type == GDS_STRNAME:
+                cell_name = gds_string(data)
+                cell = cells.setdefault(cell_name, {"refs": {}, "shapes": {}})
+                placements.setdefault(cell_name, [])
+            elif record_type == GDS_ENDSTR:
+                cell = None
+                cell_name = None
+            elif record_type in GDS_SHAPE_RECORDS or record_type == GDS_TEXT:
+                element = record_type
+                path_width = 0
+            elif record_type in (GDS_SREF, GDS_AREF):
+                element = record_type
+                ref_name = None
+                ref_count = 1
+                ref = {"reflect": False, "mag": 1.0, "angle": 0.0, "colrow": (1, 1), "xy": []}
+            elif record_type == GDS_SNAME:
+                ref_name = gds_string(data)
+            elif record_type == GDS_COLROW:
+                columns, rows = struct.unpack_from(">hh", data)
+                ref_count = columns * rows
+                ref["colrow"] = (columns, rows)
+            elif record_type == GDS_LAYER and element in GDS_SHAPE_RECORDS:
+                layer = struct.unpack_from(">h", data)[0]
+                cell["shapes"][str(layer)] = cell["shapes"].get(str(layer), 0) + 1
+            elif record_type == GDS_WIDTH:
+                path_width = abs(struct.unpack_from(">i", data)[0])
+            elif record_type in (GDS_STRANS, GDS_MAG, GDS_ANGLE) and element in (GDS_SREF, GDS_AREF):
+                read_gds_ref_transformation(ref, record_type, data)
+            elif record_type == GDS_XY and cell is not None and element in GDS_SHAPE_RECORDS:
+                box = gds_shape_bbox(data, element, path_width)
+                local_boxes[cell_name] = bbox_union(local_boxes.get(cell_name), box)
+            elif record_type == GDS_XY and cell is not None and element in (GDS_SREF, GDS_AREF):
+                xy = struct.unpack(f">{len(data) // 4}i", data)
+                ref["xy"] = list(zip(xy[0::2], xy[1::2]))
+            elif record_type == GDS_ENDEL:
+                if element in (GDS_SREF, GDS_AREF) and cell is not None and ref_name:
+                    cell["refs"][ref_name] = cell["refs"].get(ref_name, 0) + ref_count
+                    if ref["xy"]:
+                        placements[cell_name].append((ref_name, ref))
+                element = None
+            elif record_type == GDS_UNITS:
+                dbu = gds_real8(data[8:16]) / 1e-6
+
+    # KLayout does not load the context cell, it must not count as a top cell
+    cells.pop(CONTEXT_INFO_CELL, None)
+    local_boxes.pop(CONTEXT_INFO_CELL, None)
+    placements.pop(CONTEXT_INFO_CELL, None)
+
+    for name, box in compute_bboxes(cells, local_boxes, placements).items():
+        cells[name]["bbox"] = box
+
+    return {"format": "GDS2", "dbu": dbu, "cells": cells}
+
+
+def read_gds_ref_transformation(ref: dict, record_type: int, data: bytes):
+    """Store the reflection, magnification or angle record of a GDS2 reference."""
+    if record_type == GDS_STRANS:
+        ref["reflect"] = bool(struct.unpack_from(">H", data)[0] & 0x8000)
+    elif record_type == GDS_MAG:
+        ref["mag"] = gds_real8(data)
+    elif record_type == GDS_ANGLE:
+        ref["angle"] = gds_real8(data)
+
+
+def gds_shape_bbox(data: bytes, element: int, path_width: int):
+    """Bounding box (x1, y1, x2, y2) of the XY record of a shape, paths are extended by half their width."""
+    xy = struct.unpack(f">{len(data) // 4}i", data)
+    half_width = path_width / 2 if element == GDS_PATH else 0
+    return (
+        min(xy[0::2]) - half_width,
+        min(xy[1::2]) - half_width,
+        max(xy[0::2]) + half_width,
+        max(xy[1::2]) + half_width,
+    )
+
+
+def bbox_union(box_a, box_b):
+    """Union of two boxes (x1, y1, x2, y2), None is an empty box."""
+    if box_a is None:
+        return box_b
+    if box_b is None:
+        return box_a
+    return (
+        min(box_a[0], box_b[0]),
+        min(box_a[1], box_b[1]),
+        max(box_a[2], box_b[2]),
+        max(box_a[3], box_b[3]),
+    )
+
+
+def transform_bbox(box, ref: dict, origin: tuple):
+    """
+    Bounding box of a child cell box placed by a GDS2 reference at origin.
+    Reflection at the x axis is applied first, then magnification and rotation.
+    """
+    angle = math.radians(ref["angle"])
+    cos_a = math.cos(angle) * ref["mag"]
+    sin_a = math.sin(angle) * ref["mag"]
+    corners = []
+    for x, y in [(box[0], box[1]), (box[0], box[3]), (box[2], box[1]), (box[2], box[3])]:
+        if ref["reflect"]:
+            y = -y
+        corners.append((origin[0] + x * cos_a - y * sin_a, origin[1] + x * sin_a + y * cos_a))
+    xs = [c[0] for c in corners]
+    ys = [c[1] for c in corners]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def compute_bboxes(cells: dict, local_boxes: dict, placements: dict):
+    """
+    Compute the bounding box of all cells bottom up, from their own shapes and placed child cells.
+    The boxes are conservative: path ends and the boxes of rotated child cells can make them slightly larger.
+
+    Parameters
+    ----------
+    cells : dict
+        Scanned cells with references.
+    local_boxes : dict
+        Bounding box of the shapes of each cell.
+    placements : dict
+        List of (child name, reference) of each cell, reference with xy, colrow, reflect, mag and angle.
+
+    Returns
+    -------
+    dict
+        Bounding box [x1, y1, x2, y2] in database units of each cell, None for empty cells.
+    """
+    bboxes = {}
+
+    for top in cells:
+        stack = [(top, False)]
+        while stack:
+            name, expanded = stack.pop()
+            if name in bboxes:
+                continue
+            children = [c for c, _ in placements.get(name, []) if c in cells]
+            if not expanded:
+                stack.append((name, True))
+                stack.extend((c, False) for c in children if c not in bboxes)
+                continue
+
+            box = local_boxes.get(name)
+            for child, ref in placements.get(name, []):
+                child_box = bboxes.get(child)
+                if child_box is None:
+                    continue
+                origins = [ref["xy"][0]]
+                if len(ref["xy"]) == 3:
+                    # AREF: first and last column and row of the array
+                    columns, rows = ref["colrow"]
+                    (x0, y0), (xc, yc), (xr, yr) = ref["xy"]
+                    col = ((xc - x0) * (columns - 1) / columns, (yc - y0) * (columns - 1) / columns)
+                    row = ((xr - x0) * (rows - 1) / rows, (yr - y0) * (rows - 1) / rows)
+                    origins += [
+                        (x0 + col[0], y0 + col[1]),
+                        (x0 + row[0], y0 + row[1]),
+                        (x0 + col[0] + row[0], y0 + col[1] + row[1]),
+                    ]
+                for origin in origins:
+                    box = bbox_union(box, transform_bbox(child_box, ref, origin))
+
+            bboxes[name] = None if box is None else [round(v) for v in box]
+
+    return bboxes
+
+
+def gds_real8(data: bytes):
+    """Convert GDS2 8 byte real (excess-64 base 16) to float."""
+    value = struct.unpack(">Q", data)[0]
+    sign = -1.0 if value & 0x8000000000000000 else 1.0
+    exponent = (value >> 56) & 0x7F
+    mantissa = value & 0x00FFFFFFFFFFFFFF
+    return sign * mantissa / (1 << 56) * 16.0 ** (exponent - 64)
+
+
+def scan_oasis(layout_path: str):
+    """
+    Scan OASIS file for cells and references. KLayout reads the cell tree only,
+    no layers are created so no geometry is stored.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the OASIS file.
+
+    Returns
+    -------
+    dict
+        Scan result, see scan_layout. Shape counts and bounding boxes are not available for OASIS.
+    """
+    import klayout.db
+
+    options = klayout.db.LoadLayoutOptions()
+    options.layer_map = klayout.db.LayerMap()
+    options.create_other_layers = False
+
+    layout = klayout.db.Layout()
+    layout.read(layout_path, options)
+
+    cells = {}
+    for cell in layout.each_cell():
+        refs = {}
+        for inst in cell.each_inst():
+            name = inst.cell.name
+            count = inst.na * inst.nb if inst.is_regular_array() else 1
+            refs[name] = refs.get(name, 0) + count
+        cells[cell.name] = {"refs": refs, "shapes": {}, "bbox": None}
+
+    return {"format": "OASIS", "dbu": layout.dbu, "cells": cells}
+
+
+def analyze_hierarchy(scan: dict):
+    """
+    Add top cells, hierarchy depth and total shape counts to a scan result.
+
+    Parameters
+    ----------
+    scan : dict
+        Scan result with cells and references.
+
+    Returns
+    -------
+    dict
+        Same scan result, with added keys top_cells, depth, cell_count and shapes_per_layer.
+    """
+    cells = scan["cells"]
+    referenced = set()
+    for cell in cells.values():
+        referenced.update(cell["refs"].keys())
+
+    # cells that are defined but never referenced, in file order
+    scan["top_cells"] = [name for name in cells if name not in referenced]
+    scan["cell_count"] = len(cells)
+
+    # hierarchy depth, iterative to avoid recursion limits on deep hierarchies
+    depth = {}
+    for top in scan["top_cells"]:
+        stack = [(top, False)]
+        while stack:
+            name, expanded = stack.pop()
+            if name in depth:
+                continue
+            children = [c for c in cells.get(name, {"refs": {}})["refs"] if c in cells]
+            if expanded:
+                depth[name] = 1 + max([depth.get(c, 0) for c in children], default=0)
+            else:
+                stack.append((name, True))
+                stack.extend((c, False) for c in children if c not in depth)
+    scan["depth"] = max([depth.get(t, 1) for t in scan["top_cells"]], default=0)
+
+    # flat shape count per layer: multiply cell shapes with number of placements
+    placements = {name: 0 for name in cells}
+    for top in scan["top_cells"]:
+        placements[top] = 1
+    for name in sorted(depth, key=lambda n: depth[n], reverse=True):
+        for child, count in cells[name]["refs"].items():
+            if child in placements:
+                placements[child] += placements[name] * count
+
+    shapes_per_layer = {}
+    for name, cell in cells.items():
+        for layer, count in cell["shapes"].items():
+            shapes_per_layer[layer] = shapes_per_layer.get(layer, 0) + count * placements[name]
+    scan["shapes_per_layer"] = shapes_per_layer
+
+    return scan
+
+
+def scan_layout(layout_path: str, use_cache: bool = True):
+    """
+    Scan layout metadata: cells, cell references, top cells, hierarchy depth and shape counts.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the GDS2 or OASIS layout.
+    use_cache : bool
+        Use and update the scan cache, keyed by layout file hash.
+
+    Returns
+    -------
+    dict
+        Scan result with keys format, dbu, cells (with refs, shapes and bbox per cell),
+        top_cells, cell_count, depth, shapes_per_layer.
+    """
+    cache_path = None
+    if use_cache:
+        digest = file_sha256(layout_path)
+        cache_path = os.path.join(get_cache_dir("scan"), f"{digest}.json")
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    scan = json.load(f)
+                if scan.get("version") == SCAN_CACHE_VERSION:
+                    logging.info(f"Using cached layout scan for {layout_path}")
+                    return scan
+            except (OSError, ValueError):
+                pass
+
+    with open_layout_stream(layout_path) as stream:
+        magic = stream.read(13)
+
+    if magic.startswith(b"%SEMI-OASIS"):
+        scan = scan_oasis(layout_path)
+    else:
+        scan = scan_gds(layout_path)
+
+    scan = analyze_hierarchy(scan)
+    scan["version"] = SCAN_CACHE_VERSION
+
+    if cache_path:
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(scan, f)
+        os.replace(tmp_path, cache_path)
+
+    return scan
+
+
+def get_top_cells(layout_path: str, use_cache: bool = True):
+    """
+    Get the top cell names of a layout without loading its geometry.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the GDS2 or OASIS layout.
+    use_cache : bool
+        Use and update the scan cache.
+
+    Returns
+    -------
+    List of string
+        Names of the top cells in the layout.
+    """
+    return scan_layout(layout_path, use_cache)["top_cells"]
+
+
+def check_top_cells(layout_path: str):
+    """
+    Compare the scanned top cells with the top cells of the layout read by KLayout.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the GDS2 or OASIS layout.
+
+    Returns
+    -------
+    bool
+        True if both give the same top cells.
+    """
+    import klayout.db
+
+    layout = klayout.db.Layout()
+    layout.read(layout_path)
+    expected = sorted(cell.name for cell in layout.top_cells())
+    scanned = sorted(scan_layout(layout_path, use_cache=False)["top_cells"])
+
+    if scanned != expected:
+        logging.error(f"Top cells of {layout_path} differ, scanner: {scanned}, KLayout: {expected}")
+        return False
+
+    logging.info(f"Top cells of {layout_path} match KLayout: {scanned}")
+    return True
+
+
+# ================================================================
+# -------------------------- MAIN --------------------------------
+# ================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-7s | %(message)s")
+    if "--check" in sys.argv:
+        exit(0 if check_top_cells(sys.argv[1]) else 1)
+
+    result = scan_layout(sys.argv[1], use_cache="--no_cache" not in sys.argv)
+    print(f"Format      : {result['format']}")
+    print(f"Cells       : {result['cell_count']}")
+    print(f"Depth       : {result['depth']}")
+    print(f"Top cells   : {' '.join(result['top_cells'])}")
+    for top in result["top_cells"]:
+        bbox = result["cells"][top].get("bbox")
+        if bbox and result["dbu"]:
+            bbox_um = ", ".join(f"{v * result['dbu']:.3f}" for v in bbox)
+            print(f"Bbox        : {top} ({bbox_um}) um")
+    for layer, count in sorted(result["shapes_per_layer"].items(), key=lambda x: -x[1]):
+        print(f"Layer {layer:>6}: {count} shapes")
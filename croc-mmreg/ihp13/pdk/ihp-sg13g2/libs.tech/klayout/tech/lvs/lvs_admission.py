@@ -0,0 +1,329 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Memory-aware admission control for parallel SG13G2 LVS runs.
+
+The peak memory of each job is predicted from the measured peak memory of
+previous runs of the same layout, or from the layout statistics and the cost
+model of the run planner. Jobs are only started while the predicted memory of
+all running jobs fits into the memory budget. A job that grows far beyond its
+prediction is killed and requeued to run alone.
+
+Usage:
+    lvs_admission.py <layout_path> [<topcell>]
+"""
+
+import os
+import sys
+import json
+import logging
+import threading
+import concurrent.futures
+from layout_scanner import get_cache_dir, scan_layout
+import lvs_planner
+
+# Default memory budget as part of the available memory
+DEFAULT_BUDGET_FRACTION = 0.8
+
+# Margin on the measured peak memory of a previous run of the same job
+HISTORY_MARGIN = 1.2
+
+# A job is killed if it uses more than this factor times its predicted memory ...
+RUNAWAY_FACTOR = 2.0
+
+# ... and at least this much more than predicted, small predictions are inaccurate
+RUNAWAY_MIN_MB = 512
+
+# Interval of memory checks of running klayout processes in seconds
+MEMORY_POLL_INTERVAL = 0.5
+
+_memory_history_lock = threading.Lock()
+
+
+class MemoryLimitExceeded(Exception):
+    """
+    Raised when a klayout process was killed for using more memory than its limit.
+
+    Parameters
+    ----------
+    rss_mb : float
+        Memory of the process when it was killed in MB.
+    limit_mb : float
+        Memory limit of the process in MB.
+    """
+
+    def __init__(self, rss_mb: float, limit_mb: float):
+        super().__init__(
+            f"klayout process killed, it used {rss_mb:.0f} MB with a limit of {limit_mb:.0f} MB"
+        )
+        self.rss_mb = rss_mb
+        self.limit_mb = limit_mb
+
+    def __reduce__(self):
+        # Keep the attributes when the exception is passed from a worker process
+        return (MemoryLimitExceeded, (self.rss_mb, self.limit_mb))
+
+
+def get_process_rss_mb(pid: int):
+    """
+    Get the current memory (RSS) of a process in MB.
+
+    Returns
+    -------
+    float or None
+        Memory in MB, None if it can't be read on this platform.
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+    return None
+
+
+def get_memory_budget_mb(budget_gb: float = None):
+    """
+    Get the memory budget for all parallel jobs in MB.
+
+    Parameters
+    ----------
+    budget_gb : float, optional
+        Budget given by the user in GB, default is a part of the available memory.
+
+    Returns
+    -------
+    float or None
+        Budget in MB, None if no budget is given and the available memory is unknown.
+    """
+    if budget_gb:
+        return float(budget_gb) * 1024
+
+    _, memory_mb = lvs_planner.get_system_resources()
+    return None if memory_mb is None else memory_mb * DEFAULT_BUDGET_FRACTION
+
+
+def get_memory_history_path():
+    """
+    Get the path of the file with the measured peak memory of previous jobs.
+    """
+    return os.path.join(get_cache_dir("admission"), "memory.json")
+
+
+def get_job_key(layout_path: str, topcell: str = None, run_mode: str = None):
+    """
+    Get the key of a job in the memory history.
+    """
+    return f"{os.path.abspath(layout_path)}|{topcell or ''}|{run_mode or ''}"
+
+
+def load_memory_history():
+    """
+    Load the measured peak memory of previous jobs.
+
+    Returns
+    -------
+    dict
+        Peak memory in MB per job key.
+    """
+    if not os.path.isfile(get_memory_history_path()):
+        return dict()
+
+    try:
+        with open(get_memory_history_path(), "r") as f:
+            return json.load(f)
+    except ValueError:
+        return dict()
+
+
+def record_peak_memory(layout_path: str, topcell: str, run_mode: str, peak_rss_mb: float):
+    """
+    Record the measured peak memory of a finished job.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout.
+    topcell : str
+        Name of the top cell, None if not known.
+    run_mode : str
+        Run mode of the job, None if not known.
+    peak_rss_mb : float
+        Measured peak memory in MB.
+    """
+    if peak_rss_mb is None:
+        return
+
+    with _memory_history_lock:
+        history = load_memory_history()
+        history[get_job_key(layout_path, topcell, run_mode)] = round(peak_rss_mb, 1)
+
+        tmp_path = f"{get_memory_history_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(history, f)
+        os.replace(tmp_path, get_memory_history_path())
+
+
+def estimate_job_memory_mb(layout_path: str, topcell: str = None, run_mode: str = None, history: dict = None):
+    """
+    Predict the peak memory of a LVS job.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout.
+    topcell : str, optional
+        Name of the top cell, default is the first top cell of the layout.
+    run_mode : str, optional
+        Run mode (flat or deep). If not given or auto, the larger prediction is used.
+    history : dict, optional
+        Memory history from load_memory_history, it is loaded if not given.
+
+    Returns
+    -------
+    float
+        Predicted peak memory in MB.
+    """
+    history = load_memory_history() if history is None else history
+    measured = history.get(get_job_key(layout_path, topcell, run_mode))
+    if measured is not None:
+        return measured * HISTORY_MARGIN
+
+    try:
+        scan = scan_layout(layout_path)
+        stats = lvs_planner.get_layout_stats(scan, topcell or scan["top_cells"][0])
+    except (OSError, ValueError, IndexError, KeyError) as e:
+        logging.warning(f"Could not scan {layout_path} for memory prediction: {e}")
+        return lvs_planner.BASE_MEMORY_MB
+
+    model = lvs_planner.fit_model(lvs_planner.load_history())
+    estimate = {
+        "flat": model["flat"]["mb_per_kshape"] * stats["flat_shapes"] / 1000,
+        "deep": model["deep"]["mb_per_kshape"] * stats["hier_shapes"] / 1000,
+    }
+    if run_mode in estimate:
+        return lvs_planner.BASE_MEMORY_MB + estimate[run_mode]
+
+    return lvs_planner.BASE_MEMORY_MB + max(estimate.values())
+
+
+def get_runaway_limit_mb(memory_mb: float):
+    """
+    Get the memory limit at which a job with the given prediction is killed.
+    """
+    return max(memory_mb * RUNAWAY_FACTOR, memory_mb + RUNAWAY_MIN_MB)
+
+
+class AdmissionScheduler:
+    """
+    Start jobs on an executor while their predicted memory fits into a budget.
+
+    Jobs are started in the given order, a later job is started first if an
+    earlier one doesn't fit yet. A job is always started if nothing else is
+    running, so jobs larger than the budget run alone. Jobs killed with
+    MemoryLimitExceeded are requeued to run alone without memory limit.
+
+    Parameters
+    ----------
+    budget_mb : float or None
+        Memory budget in MB, None for no memory limit.
+    max_running : int
+        Maximum number of jobs running at the same time.
+    """
+
+    def __init__(self, budget_mb: float, max_running: int):
+        self.budget_mb = budget_mb
+        self.max_running = max(1, max_running)
+
+    def fits(self, job: dict, used_mb: float, running: dict):
+        """
+        Check if a job can start now.
+        """
+        if len(running) == 0:
+            return True
+        if job.get("exclusive") or len(running) >= self.max_running:
+            return False
+        if any(j.get("exclusive") for j, _ in running.values()):
+            return False
+        return self.budget_mb is None or used_mb + job["memory_mb"] <= self.budget_mb
+
+    def run(self, jobs: list, submit, on_result):
+        """
+        Run all jobs.
+
+        Parameters
+        ----------
+        jobs : list of dict
+            Jobs to run, each with the predicted memory in "memory_mb".
+        submit : function
+            submit(job, memory_limit_mb) starts a job and returns its future.
+            The limit is None for jobs that run alone.
+        on_result : function
+            on_result(job, future) is called for each finished job that is not requeued.
+        """
+        pending = list(jobs)
+        running = dict()
+        used_mb = 0.0
+
+        while pending or running:
+            for job in list(pending):
+                # A requeued job waits for the running jobs to end, nothing else starts meanwhile
+                if job.get("exclusive") and running:
+                    break
+                if not self.fits(job, used_mb, running):
+                    continue
+                pending.remove(job)
+
+                limit_mb = None if job.get("exclusive") else get_runaway_limit_mb(job["memory_mb"])
+                running[submit(job, limit_mb)] = (job, job["memory_mb"])
+                used_mb += job["memory_mb"]
+
+            done, _ = concurrent.futures.wait(
+                list(running), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                job, reserved_mb = running.pop(future)
+                used_mb -= reserved_mb
+
+                error = future.exception()
+                if isinstance(error, MemoryLimitExceeded) and not job.get("exclusive"):
+                    logging.warning(f"{error}, requeuing the job to run alone.")
+                    pending.insert(
+                        0, dict(job, exclusive=True, memory_mb=max(job["memory_mb"], error.rss_mb))
+                    )
+                    continue
+
+                on_result(job, future)
+
+
+# ================================================================
+# -------------------------- MAIN --------------------------------
+# ================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-7s | %(message)s")
+    top = sys.argv[2] if len(sys.argv) > 2 else None
+    for mode in ["flat", "deep"]:
+        print(f"{mode:<20}: {estimate_job_memory_mb(sys.argv[1], top, mode):.0f} MB")
+    budget = get_memory_budget_mb()
+    print(f"{'budget':<20}: {'unknown' if budget is None else f'{budget:.0f} MB'}")
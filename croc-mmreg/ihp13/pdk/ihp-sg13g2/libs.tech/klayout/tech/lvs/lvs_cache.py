@@ -0,0 +1,299 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""LVS result cache for SG13G2 LVS.
+
+Stores the lvsdb, the extracted netlist and the verdict of finished LVS runs.
+The cache key covers everything that changes the result: layout and netlist
+content, run switches, the LVS deck with all included rule decks and the
+KLayout version. The store is bounded in size, least recently used entries
+are removed first.
+
+Usage:
+    lvs_cache.py [--clear]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from layout_scanner import get_cache_dir, file_sha256
+
+# Maximum cache size in MB, can be changed with environment variable SG13G2_LVS_CACHE_SIZE
+CACHE_SIZE_ENV = "SG13G2_LVS_CACHE_SIZE"
+DEFAULT_CACHE_SIZE_MB = 2048
+LVS_CACHE_VERSION = 1
+
+# Switches that only hold file locations, they don't change the LVS result
+PATH_SWITCHES = ["input", "schematic", "report", "target_netlist", "profile_output"]
+
+# Switches that only change how the result is computed
+RUN_SWITCHES = ["threads"]
+
+INCLUDE_PATTERN = re.compile(r"^\s*#\s*%include\s+(\S+)")
+
+REPORT_FILE = "result.lvsdb"
+NETLIST_FILE = "extracted.cir"
+VERDICT_FILE = "verdict.json"
+
+_cache_lock = threading.Lock()
+
+
+def get_deck_files(deck_path: str):
+    """
+    Get the LVS deck file and all files included by it, recursively.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the main LVS deck.
+
+    Returns
+    -------
+    List of string
+        Paths of all deck files, in include order.
+    """
+    deck_files = []
+    pending = [os.path.abspath(deck_path)]
+
+    while pending:
+        path = pending.pop(0)
+        if path in deck_files:
+            continue
+        deck_files.append(path)
+
+        with open(path, "r") as f:
+            for line in f:
+                match = INCLUDE_PATTERN.match(line)
+                if match:
+                    pending.append(
+                        os.path.abspath(os.path.join(os.path.dirname(path), match.group(1)))
+                    )
+
+    return deck_files
+
+
+def get_deck_hash(deck_path: str):
+    """
+    Get the content hash of the LVS deck including all rule decks it includes.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the main LVS deck.
+
+    Returns
+    -------
+    string
+        Hex digest of all deck files.
+    """
+    sha = hashlib.sha256()
+    deck_dir = os.path.dirname(os.path.abspath(deck_path))
+
+    for path in get_deck_files(deck_path):
+        sha.update(os.path.relpath(path, deck_dir).encode())
+        with open(path, "rb") as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def get_cache_key(
+    layout_path: str, netlist_path: str, switches: dict, deck_path: str, klayout_version: str
+):
+    """
+    Get the cache key of one LVS run.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout file.
+    netlist_path : str
+        Path of the schematic netlist.
+    switches : dict
+        Run switches passed to the deck, path and thread switches are ignored.
+    deck_path : str
+        Path of the main LVS deck.
+    klayout_version : str
+        Version of KLayout that runs the deck.
+
+    Returns
+    -------
+    string
+        Hex digest used as cache key.
+    """
+    key_data = {
+        "version": LVS_CACHE_VERSION,
+        "layout": file_sha256(layout_path),
+        "netlist": file_sha256(netlist_path),
+        "switches": {
+            k: str(v) for k, v in switches.items() if k not in PATH_SWITCHES + RUN_SWITCHES
+        },
+        "deck": get_deck_hash(deck_path),
+        "klayout": klayout_version,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def get_max_cache_size():
+    """
+    Get the maximum size of the LVS result cache in bytes.
+    """
+    try:
+        size_mb = float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE_MB))
+    except ValueError:
+        size_mb = DEFAULT_CACHE_SIZE_MB
+
+    return int(size_mb * 1024 * 1024)
+
+
+def get_entry_size(entry_dir: str):
+    """
+    Get the size of one cache entry in bytes.
+    """
+    return sum(
+        os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir)
+    )
+
+
+def restore_result(key: str, report_path: str, netlist_path: str):
+    """
+    Restore a cached LVS result to the run directory.
+
+    Parameters
+    ----------
+    key : str
+        Cache key of the run.
+    report_path : str
+        Path to restore the lvsdb file to.
+    netlist_path : str
+        Path to restore the extracted netlist to.
+
+    Returns
+    -------
+    dict or None
+        Verdict of the cached run, None if there is no cache entry.
+    """
+    entry_dir = os.path.join(get_cache_dir("results"), key)
+    verdict_path = os.path.join(entry_dir, VERDICT_FILE)
+
+    with _cache_lock:
+        if not os.path.isfile(verdict_path):
+            return None
+
+        try:
+            with open(verdict_path, "r") as f:
+                verdict = json.load(f)
+            shutil.copyfile(os.path.join(entry_dir, REPORT_FILE), report_path)
+            if os.path.isfile(os.path.join(entry_dir, NETLIST_FILE)):
+                shutil.copyfile(os.path.join(entry_dir, NETLIST_FILE), netlist_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not restore LVS result from cache ({e}), running LVS.")
+            return None
+
+        # Access time for least recently used eviction
+        os.utime(verdict_path)
+
+    return verdict
+
+
+def store_result(key: str, report_path: str, netlist_path: str, verdict: dict):
+    """
+    Store the result of a finished LVS run and limit the cache size.
+
+    Parameters
+    ----------
+    key : str
+        Cache key of the run.
+    report_path : str
+        Path of the generated lvsdb file.
+    netlist_path : str
+        Path of the extracted netlist.
+    verdict : dict
+        Verdict of the run, e.g. {"match": True, "run_time": 12.3}.
+    """
+    results_dir = get_cache_dir("results")
+    entry_dir = os.path.join(results_dir, key)
+    tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        shutil.copyfile(report_path, os.path.join(tmp_dir, REPORT_FILE))
+        if os.path.isfile(netlist_path):
+            shutil.copyfile(netlist_path, os.path.join(tmp_dir, NETLIST_FILE))
+        with open(os.path.join(tmp_dir, VERDICT_FILE), "w") as f:
+            json.dump(dict(verdict, created=time.strftime("%Y-%m-%d %H:%M:%S")), f, indent=1)
+
+        with _cache_lock:
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+            prune_cache(get_max_cache_size())
+    except OSError as e:
+        logging.warning(f"Could not store LVS result in cache: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def prune_cache(max_size: int):
+    """
+    Remove least recently used cache entries until the cache fits into max_size bytes.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum size of all cache entries in bytes.
+    """
+    results_dir = get_cache_dir("results")
+
+    entries = []
+    for name in os.listdir(results_dir):
+        verdict_path = os.path.join(results_dir, name, VERDICT_FILE)
+        if name.endswith(".tmp") or not os.path.isfile(verdict_path):
+            continue
+        entry_dir = os.path.join(results_dir, name)
+        entries.append((os.path.getmtime(verdict_path), get_entry_size(entry_dir), entry_dir))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+
+# ================================================================
+# -------------------------- MAIN --------------------------------
+# ================================================================
+
+if __name__ == "__main__":
+    results_dir = get_cache_dir("results")
+
+    if "--clear" in sys.argv:
+        shutil.rmtree(results_dir, ignore_errors=True)
+        print(f"LVS result cache {results_dir} cleared.")
+        exit(0)
+
+    names = [n for n in os.listdir(results_dir) if not n.endswith(".tmp")]
+    size = sum(get_entry_size(os.path.join(results_dir, n)) for n in names)
+    print(f"Location    : {results_dir}")
+    print(f"Entries     : {len(names)}")
+    print(f"Size        : {size / (1024 * 1024):.1f} MB of {get_max_cache_size() / (1024 * 1024):.0f} MB")
@@ -0,0 +1,350 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Incremental LVS support for hierarchical SG13G2 designs.
+
+Each subcell of the layout gets a geometry hash that covers its own shapes
+and the hashes and placements of its child cells (Merkle hash), each subckt
+of the schematic gets a hash of its netlist text and its child subckts.
+Cells that matched in a previous LVS run with the same geometry, schematic,
+LVS deck, switches and KLayout version are verified. In the next run these
+cells are reduced to their routing layers and blanked in both netlists, so
+device extraction and comparison is only done for the changed hierarchy.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from layout_scanner import get_cache_dir
+from lvs_cache import get_deck_hash, PATH_SWITCHES, RUN_SWITCHES
+
+# Layers kept in abstracted cells (all datatypes): metals and vias,
+# so that nets of the parent still connect to the pins of the cell.
+ABSTRACT_LAYERS = [
+    8,  # Metal1
+    19,  # Via1
+    10,  # Metal2
+    29,  # Via2
+    30,  # Metal3
+    49,  # Via3
+    50,  # Metal4
+    66,  # Via4
+    67,  # Metal5
+    125,  # TopVia1
+    126,  # TopMetal1
+    133,  # TopVia2
+    134,  # TopMetal2
+]
+
+# Switches that don't change the result of a cell
+NON_RESULT_SWITCHES = PATH_SWITCHES + RUN_SWITCHES + ["blank_cells", "verbose"]
+
+MAX_VERIFIED_CELLS = 100000
+
+_store_lock = threading.Lock()
+
+
+def get_context_hash(deck_path: str, switches: dict, klayout_version: str):
+    """
+    Get the hash of everything besides the cell content that changes the LVS result of a cell.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the main LVS deck.
+    switches : dict
+        Run switches passed to the deck.
+    klayout_version : str
+        Version of KLayout that runs the deck.
+
+    Returns
+    -------
+    string
+        Hex digest of the LVS context.
+    """
+    context = {
+        "deck": get_deck_hash(deck_path),
+        "switches": {k: str(v) for k, v in switches.items() if k not in NON_RESULT_SWITCHES},
+        "klayout": klayout_version,
+    }
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+
+
+def compute_cell_hashes(layout, top_cell_name: str):
+    """
+    Compute the geometry hash of all cells below the top cell, bottom up.
+    The top cell itself is always checked, so it is not hashed.
+
+    Parameters
+    ----------
+    layout : klayout.db.Layout
+        Loaded layout.
+    top_cell_name : str
+        Name of the top cell used for LVS.
+
+    Returns
+    -------
+    dict
+        Dictionary with cell name as key and hex digest as value.
+    """
+    sub_cells = set(layout.cell(top_cell_name).called_cells())
+    layer_names = {li: layout.get_info(li).to_s() for li in layout.layer_indexes()}
+    layer_order = sorted(layer_names.keys(), key=lambda li: layer_names[li])
+
+    hashes = {}
+    for ci in layout.each_cell_bottom_up():
+        if ci not in sub_cells:
+            continue
+        cell = layout.cell(ci)
+
+        sha = hashlib.sha256()
+        for li in layer_order:
+            shapes = cell.shapes(li)
+            if shapes.is_empty():
+                continue
+            sha.update(layer_names[li].encode())
+            for shape_str in sorted(shape.to_s() for shape in shapes.each()):
+                sha.update(shape_str.encode())
+
+        inst_keys = []
+        for inst in cell.each_inst():
+            inst_key = f"{hashes[inst.cell_index]} {inst.cplx_trans}"
+            if inst.is_regular_array():
+                inst_key += f" {inst.a} {inst.b} {inst.na} {inst.nb}"
+            inst_keys.append(inst_key)
+        for inst_key in sorted(inst_keys):
+            sha.update(inst_key.encode())
+
+        hashes[ci] = sha.hexdigest()
+
+    return {layout.cell(ci).name: h for ci, h in hashes.items()}
+
+
+def read_subckt_hashes(netlist_path: str):
+    """
+    Compute the hash of all subckts in a SPICE/CDL netlist, including the subckts they instantiate.
+
+    Parameters
+    ----------
+    netlist_path : str
+        Path of the schematic netlist.
+
+    Returns
+    -------
+    dict
+        Dictionary with upper case subckt name as key and hex digest as value.
+    """
+
+    # Join continuation lines, drop comments
+    lines = []
+    with open(netlist_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("*"):
+                continue
+            if line.startswith("+") and lines:
+                lines[-1] += " " + line[1:].strip()
+            else:
+                lines.append(line)
+
+    bodies = {}
+    children = {}
+    current = None
+    for line in lines:
+        tokens = line.split()
+        keyword = tokens[0].upper()
+        if keyword == ".SUBCKT" and len(tokens) > 1:
+            current = tokens[1].upper()
+            bodies[current] = [" ".join(tokens)]
+            children[current] = []
+        elif keyword == ".ENDS":
+            current = None
+        elif current is not None:
+            bodies[current].append(" ".join(tokens))
+            if keyword.startswith("X"):
+                # Subckt name is the last token that is not a parameter
+                names = [t for t in tokens[1:] if "=" not in t and t != "/"]
+                if names:
+                    children[current].append(names[-1].upper())
+
+    hashes = {}
+
+    def subckt_hash(name, stack):
+        if name in hashes:
+            return hashes[name]
+        sha = hashlib.sha256("\n".join(bodies[name]).encode())
+        for child in sorted(set(children[name])):
+            if child in bodies and child not in stack:
+                sha.update(subckt_hash(child, stack | {name}).encode())
+        hashes[name] = sha.hexdigest()
+        return hashes[name]
+
+    for name in bodies:
+        subckt_hash(name, set())
+
+    return hashes
+
+
+def get_cell_key(context: str, cell_name: str, cell_hash: str, subckt_hash: str):
+    """
+    Get the key of a verified cell in the store.
+    """
+    return hashlib.sha256(
+        f"{context}|{cell_name.upper()}|{cell_hash}|{subckt_hash}".encode()
+    ).hexdigest()
+
+
+def load_store(store_name: str):
+    """
+    Load a JSON store from the incremental cache directory.
+    """
+    store_path = os.path.join(get_cache_dir("incremental"), f"{store_name}.json")
+    if not os.path.isfile(store_path):
+        return {}
+
+    try:
+        with open(store_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_store(store_name: str, store: dict):
+    """
+    Save a JSON store to the incremental cache directory.
+    """
+    store_path = os.path.join(get_cache_dir("incremental"), f"{store_name}.json")
+    tmp_path = f"{store_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(store, f)
+    os.replace(tmp_path, store_path)
+
+
+def select_reusable_cells(cell_names: list, cell_hashes: dict, subckt_hashes: dict, context: str):
+    """
+    Select the cells that were verified before with the same geometry, schematic and context.
+
+    Parameters
+    ----------
+    cell_names : list
+        Names of the cells below the top cell.
+    cell_hashes : dict
+        Geometry hashes of the layout cells.
+    subckt_hashes : dict
+        Hashes of the schematic subckts, with upper case names.
+    context : str
+        Context hash of this run.
+
+    Returns
+    -------
+    List of string
+        Names of the cells that can be reused.
+    """
+    verified = load_store("verified")
+
+    reusable = []
+    for name in cell_names:
+        if name not in cell_hashes or name.upper() not in subckt_hashes:
+            continue
+        key = get_cell_key(context, name, cell_hashes[name], subckt_hashes[name.upper()])
+        if key in verified:
+            reusable.append(name)
+
+    return sorted(reusable)
+
+
+def record_verified_cells(
+    matched_cells: list, cell_hashes: dict, subckt_hashes: dict, context: str
+):
+    """
+    Record the cells that matched in this run as verified.
+
+    Parameters
+    ----------
+    matched_cells : list
+        Names of the layout cells with a matching schematic subckt.
+    cell_hashes : dict
+        Geometry hashes of the layout cells.
+    subckt_hashes : dict
+        Hashes of the schematic subckts, with upper case names.
+    context : str
+        Context hash of this run.
+    """
+    with _store_lock:
+        verified = load_store("verified")
+        now = time.time()
+
+        for name in matched_cells:
+            if name not in cell_hashes or name.upper() not in subckt_hashes:
+                continue
+            key = get_cell_key(context, name, cell_hashes[name], subckt_hashes[name.upper()])
+            verified[key] = {"cell": name, "time": now}
+
+        # Keep the store bounded, drop the oldest entries
+        if len(verified) > MAX_VERIFIED_CELLS:
+            keep = sorted(verified.items(), key=lambda kv: kv[1]["time"])[-MAX_VERIFIED_CELLS:]
+            verified = dict(keep)
+
+        save_store("verified", verified)
+
+
+def get_full_run_time(layout_path: str, topcell: str, context: str):
+    """
+    Get the run time of the last full (not incremental) LVS run of this design, None if unknown.
+    """
+    key = f"{os.path.realpath(layout_path)}|{topcell}|{context}"
+    entry = load_store("runs").get(key)
+    return entry["run_time"] if entry else None
+
+
+def set_full_run_time(layout_path: str, topcell: str, context: str, run_time: float):
+    """
+    Remember the run time of a full LVS run of this design, to report the time saved by incremental runs.
+    """
+    key = f"{os.path.realpath(layout_path)}|{topcell}|{context}"
+    with _store_lock:
+        runs = load_store("runs")
+        runs[key] = {"run_time": run_time, "time": time.time()}
+        save_store("runs", runs)
+
+
+def write_abstract_layout(layout, cell_names: list, output_path: str):
+    """
+    Remove all shapes except the routing layers from the given cells and write the layout.
+
+    Parameters
+    ----------
+    layout : klayout.db.Layout
+        Loaded layout, it is modified.
+    cell_names : list
+        Names of the cells to abstract.
+    output_path : str
+        Path of the written layout, the format is selected by the file suffix.
+    """
+    keep_layers = set(
+        li for li in layout.layer_indexes() if layout.get_info(li).layer in ABSTRACT_LAYERS
+    )
+
+    for name in cell_names:
+        cell = layout.cell(name)
+        for li in layout.layer_indexes():
+            if li not in keep_layers:
+                cell.shapes(li).clear()
+
+    layout.write(output_path)
@@ -0,0 +1,360 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Resource-aware run planner for SG13G2 LVS.
+
+Chooses the KLayout run mode and thread count from layout statistics of the
+layout scanner (cell count, shapes per layer, hierarchy depth, bounding box)
+within a memory and core budget. Each planned run is recorded together with
+its measured run time and peak memory, and the cost model is fitted to this
+history. LVS netlist extraction always works on the whole layout, tiling is
+only available for DRC, so no tile size is planned.
+
+Usage:
+    lvs_planner.py <layout_path> [<topcell>]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import statistics
+import threading
+from layout_scanner import get_cache_dir, scan_layout
+
+# Layouts with fewer flat shapes run faster in flat mode,
+# handling the hierarchy costs more than it saves.
+FLAT_MAX_SHAPES = 200000
+
+# Minimum ratio of flat to hierarchical shape count for deep mode on larger layouts
+DEEP_MIN_COMPRESSION = 1.5
+
+# Hierarchical shapes per thread in deep mode, more threads only add overhead
+SHAPES_PER_THREAD = 250000
+
+# Memory of KLayout with loaded LVS deck, before any layout data
+BASE_MEMORY_MB = 300
+
+# Default cost model per 1000 shapes (flat shapes for flat mode, hierarchical shapes for deep mode)
+DEFAULT_MODEL = {
+    "flat": {"mb_per_kshape": 0.5, "s_per_kshape": 0.02},
+    "deep": {"mb_per_kshape": 1.0, "s_per_kshape": 0.03},
+}
+
+# Number of recorded runs per mode needed to replace the default model
+HISTORY_MIN_RUNS = 3
+
+_history_lock = threading.Lock()
+
+
+def get_system_resources():
+    """
+    Get the number of usable cores and the available memory.
+
+    Returns
+    -------
+    tuple
+        Number of cores and available memory in MB (None if unknown).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+
+    memory_mb = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    memory_mb = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        try:
+            memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") / (1024 * 1024)
+        except (ValueError, OSError, AttributeError):
+            memory_mb = None
+
+    return cores, memory_mb
+
+
+def get_layout_stats(scan: dict, topcell: str):
+    """
+    Get the statistics of the hierarchy below a top cell from a layout scan.
+
+    Parameters
+    ----------
+    scan : dict
+        Result of layout_scanner.scan_layout.
+    topcell : str
+        Name of the top cell used for LVS.
+
+    Returns
+    -------
+    dict
+        Statistics with cell_count, depth, flat_shapes, hier_shapes,
+        shapes_per_layer, bbox_um and area_mm2.
+    """
+    cells = scan["cells"]
+    if topcell not in cells:
+        raise ValueError(f"Top cell {topcell} not found in layout scan")
+
+    # Cells below the top cell, children before parents
+    order = []
+    depth = {}
+    stack = [(topcell, False)]
+    while stack:
+        name, expanded = stack.pop()
+        if name in depth:
+            continue
+        children = [c for c in cells[name]["refs"] if c in cells]
+        if expanded:
+            depth[name] = 1 + max([depth[c] for c in children], default=0)
+            order.append(name)
+        else:
+            stack.append((name, True))
+            stack.extend((c, False) for c in children if c not in depth)
+
+    placements = {name: 0 for name in order}
+    placements[topcell] = 1
+    for name in reversed(order):
+        for child, count in cells[name]["refs"].items():
+            if child in placements:
+                placements[child] += placements[name] * count
+
+    shapes_per_layer = {}
+    hier_shapes = 0
+    for name in order:
+        for layer, count in cells[name]["shapes"].items():
+            shapes_per_layer[layer] = shapes_per_layer.get(layer, 0) + count * placements[name]
+            hier_shapes += count
+
+    bbox_um = None
+    area_mm2 = None
+    bbox = cells[topcell].get("bbox")
+    if bbox and scan.get("dbu"):
+        bbox_um = [round(v * scan["dbu"], 3) for v in bbox]
+        area_mm2 = (bbox_um[2] - bbox_um[0]) * (bbox_um[3] - bbox_um[1]) * 1e-6
+
+    return {
+        "format": scan["format"],
+        "cell_count": len(order),
+        "depth": depth[topcell],
+        "flat_shapes": sum(shapes_per_layer.values()),
+        "hier_shapes": hier_shapes,
+        "shapes_per_layer": shapes_per_layer,
+        "bbox_um": bbox_um,
+        "area_mm2": area_mm2,
+    }
+
+
+def get_history_path():
+    """
+    Get the path of the planner history file.
+    """
+    return os.path.join(get_cache_dir("planner"), "history.jsonl")
+
+
+def load_history():
+    """
+    Load all recorded runs from the planner history.
+
+    Returns
+    -------
+    list of dict
+        Recorded runs, oldest first.
+    """
+    history = []
+    if not os.path.isfile(get_history_path()):
+        return history
+
+    with open(get_history_path(), "r") as f:
+        for line in f:
+            try:
+                history.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return history
+
+
+def fit_model(history: list):
+    """
+    Fit the cost model to the recorded runs. Modes with too few runs keep the default model.
+
+    Parameters
+    ----------
+    history : list of dict
+        Recorded runs.
+
+    Returns
+    -------
+    dict
+        Cost model per run mode.
+    """
+    model = {mode: dict(values) for mode, values in DEFAULT_MODEL.items()}
+
+    for mode in model:
+        shape_key = "flat_shapes" if mode == "flat" else "hier_shapes"
+        memory = []
+        run_time = []
+        for entry in history:
+            outcome = entry.get("outcome") or {}
+            kshapes = entry["stats"][shape_key] / 1000
+            if entry["plan"]["run_mode"] != mode or kshapes < 1:
+                continue
+            if outcome.get("run_time") is not None:
+                run_time.append(outcome["run_time"] / kshapes)
+            if outcome.get("peak_rss_mb") is not None:
+                memory.append(max(outcome["peak_rss_mb"] - BASE_MEMORY_MB, 0) / kshapes)
+
+        if len(run_time) >= HISTORY_MIN_RUNS:
+            model[mode]["s_per_kshape"] = statistics.median(run_time)
+        if len(memory) >= HISTORY_MIN_RUNS:
+            model[mode]["mb_per_kshape"] = statistics.median(memory)
+
+    return model
+
+
+def plan_run(stats: dict, max_memory_mb: float = None, max_threads: int = None, model: dict = None):
+    """
+    Choose run mode and thread count for a LVS run.
+
+    Parameters
+    ----------
+    stats : dict
+        Layout statistics from get_layout_stats.
+    max_memory_mb : float, optional
+        Memory budget in MB, default is the available memory.
+    max_threads : int, optional
+        Core budget, default is the number of usable cores.
+    model : dict, optional
+        Cost model, default is the model fitted to the run history.
+
+    Returns
+    -------
+    dict
+        Plan with run_mode, threads, tile_size, estimated memory and run time and the reason of the choice.
+    """
+    cores, memory_mb = get_system_resources()
+    max_threads = max(1, max_threads or cores)
+    max_memory_mb = max_memory_mb or memory_mb
+    model = model or fit_model(load_history())
+
+    flat_kshapes = stats["flat_shapes"] / 1000
+    hier_kshapes = stats["hier_shapes"] / 1000
+    estimate = {
+        "flat": {
+            "memory_mb": BASE_MEMORY_MB + model["flat"]["mb_per_kshape"] * flat_kshapes,
+            "run_time": model["flat"]["s_per_kshape"] * flat_kshapes,
+        },
+        "deep": {
+            "memory_mb": BASE_MEMORY_MB + model["deep"]["mb_per_kshape"] * hier_kshapes,
+            "run_time": model["deep"]["s_per_kshape"] * hier_kshapes,
+        },
+    }
+    flat_fits = max_memory_mb is None or estimate["flat"]["memory_mb"] <= max_memory_mb
+    compression = stats["flat_shapes"] / max(stats["hier_shapes"], 1)
+
+    if stats["flat_shapes"] == 0:
+        run_mode = "deep"
+        reason = "no shape counts available (OASIS), using deep mode"
+    elif stats["flat_shapes"] <= FLAT_MAX_SHAPES and flat_fits:
+        run_mode = "flat"
+        reason = f"small layout ({stats['flat_shapes']} shapes)"
+    elif compression < DEEP_MIN_COMPRESSION and flat_fits:
+        run_mode = "flat"
+        reason = f"little hierarchy (flat/hierarchical shapes {compression:.2f})"
+    elif not flat_fits:
+        run_mode = "deep"
+        reason = "flat mode doesn't fit into the memory budget"
+    else:
+        run_mode = "deep"
+        reason = f"hierarchical layout (flat/hierarchical shapes {compression:.2f})"
+
+    # Threads are only used by deep mode for LVS, flat mode runs without tiling
+    if run_mode == "deep":
+        threads = min(max_threads, max(1, math.ceil(stats["hier_shapes"] / SHAPES_PER_THREAD)))
+    else:
+        threads = 1
+
+    if max_memory_mb is not None and estimate[run_mode]["memory_mb"] > max_memory_mb:
+        reason += f", estimated memory above budget of {max_memory_mb:.0f} MB"
+
+    return {
+        "run_mode": run_mode,
+        "threads": threads,
+        "tile_size": None,
+        "estimated_memory_mb": round(estimate[run_mode]["memory_mb"], 1),
+        "estimated_run_time": round(estimate[run_mode]["run_time"], 3),
+        "max_memory_mb": None if max_memory_mb is None else round(max_memory_mb, 1),
+        "max_threads": max_threads,
+        "reason": reason,
+    }
+
+
+def record_run(layout_path: str, topcell: str, stats: dict, plan: dict, outcome: dict):
+    """
+    Append a planned run with its measured outcome to the planner history.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path of the layout.
+    topcell : str
+        Name of the top cell.
+    stats : dict
+        Layout statistics used for planning.
+    plan : dict
+        Plan of the run.
+    outcome : dict
+        Measured outcome with run_time, peak_rss_mb and match.
+    """
+    entry = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "layout": os.path.abspath(layout_path),
+        "topcell": topcell,
+        "stats": {k: v for k, v in stats.items() if k != "shapes_per_layer"},
+        "plan": plan,
+        "outcome": outcome,
+    }
+
+    with _history_lock:
+        with open(get_history_path(), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+# ================================================================
+# -------------------------- MAIN --------------------------------
+# ================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-7s | %(message)s")
+    layout_scan = scan_layout(sys.argv[1])
+    top = sys.argv[2] if len(sys.argv) > 2 else layout_scan["top_cells"][0]
+    layout_stats = get_layout_stats(layout_scan, top)
+    run_plan = plan_run(layout_stats)
+
+    for key in ["cell_count", "depth", "flat_shapes", "hier_shapes", "bbox_um", "area_mm2"]:
+        print(f"{key:<20}: {layout_stats[key]}")
+    for key, value in run_plan.items():
+        print(f"{key:<20}: {value}")
@@ -0,0 +1,256 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Rule deck profiling for SG13G2 LVS.
+
+Generates a copy of the LVS deck with all `# %include` files inlined and
+wrapped in timers. Inside the rule decks, each top level statement is
+timed as one operation, in the main deck the steps between `logger.info`
+calls. Wall time and memory (RSS) are written as JSON lines while the deck
+runs, and converted to a sorted profile table afterwards.
+"""
+
+import os
+import csv
+import json
+import re
+from lvs_cache import INCLUDE_PATTERN
+
+# Rule decks with class definitions, only timed as a whole
+NO_OPERATION_PROFILE = re.compile(r"^(custom_.*|globals)\.lvs$")
+
+# Line endings that continue a statement on the next line
+CONTINUATION_ENDINGS = (",", "(", "[", "{", "\\", "+", "-", "*", "/", "&&", "||", "|", "=", ".", " do", "?", ":")
+
+# Line starts that don't begin a new statement
+NO_STATEMENT_STARTS = ("end", "else", "elsif", "when", "rescue", "ensure", "}", "]", ")", ".", "#", "=")
+
+PROFILER_PRELUDE = """# Profiling helpers, generated by run_lvs.py --profile
+require 'json'
+
+class LVSProfiler
+  def initialize(output)
+    @output = output
+    @records = []
+    @stack = []
+    @op = nil
+  end
+
+  def rss_mb
+    status = "/proc/#{Process.pid}/status"
+    File.exist?(status) ? File.read(status)[/VmRSS:\\s+(\\d+)/, 1].to_f / 1024 : nil
+  end
+
+  def record(kind, name, start, rss, self_time = nil)
+    elapsed = Time.now - start
+    rss_now = rss_mb
+    @records.push({ 'kind' => kind, 'name' => name, 'include' => @stack.empty? ? nil : @stack[-1][0],
+                    'depth' => @stack.size, 'time' => elapsed, 'self_time' => self_time || elapsed,
+                    'rss_mb' => rss_now, 'rss_delta_mb' => rss_now && rss ? rss_now - rss : nil })
+    elapsed
+  end
+
+  def start(name)
+    op_done
+    @stack.push([name, Time.now, rss_mb, 0.0])
+  end
+
+  def stop
+    op_done
+    name, start, rss, child_time = @stack[-1]
+    elapsed = Time.now - start
+    @stack.pop
+    record('include', name, start, rss, elapsed - child_time)
+    @stack[-1][3] += elapsed unless @stack.empty?
+  end
+
+  def op(name)
+    op_done
+    @op = [name, Time.now, rss_mb]
+  end
+
+  def op_done
+    return unless @op
+    name, start, rss = @op
+    @op = nil
+    record('operation', name, start, rss)
+  end
+
+  def finish
+    stop until @stack.empty?
+    File.open(@output, 'w') { |f| @records.each { |r| f.puts(r.to_json) } }
+  end
+end
+
+$lvs_profiler = LVSProfiler.new($profile_output)
+"""
+
+
+def ruby_string(text: str):
+    """Single quoted Ruby string literal."""
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def is_statement_start(line: str, previous: str):
+    """
+    Check if a line starts a new top level statement, so a timer call can be put in front of it.
+
+    Parameters
+    ----------
+    line : str
+        Line to check.
+    previous : str
+        Previous line with code, stripped.
+    """
+    if not line or line[0].isspace() or line.startswith(NO_STATEMENT_STARTS):
+        return False
+
+    return not previous.endswith(CONTINUATION_ENDINGS)
+
+
+def get_operation_name(deck_name: str, line_number: int, line: str, main_deck: bool):
+    """Name of the operation starting at this line."""
+    if main_deck:
+        message = re.match(r"logger\.info\((['\"])(.*)\1\)", line.strip())
+        label = message.group(2) if message else line.strip()
+    else:
+        label = line.strip()
+    return f"{deck_name}:{line_number} {label[:60]}"
+
+
+def expand_deck(deck_path: str, deck_dir: str, main_deck: bool = False):
+    """
+    Expand a deck file: includes are inlined with include timers, operations get operation timers.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the deck file.
+    deck_dir : str
+        Directory of the main deck, include names are relative to it.
+    main_deck : bool
+        Main deck file, only `logger.info` steps are timed as operations.
+
+    Returns
+    -------
+    List of string
+        Lines of the expanded deck.
+    """
+    deck_name = os.path.relpath(deck_path, deck_dir)
+    profile_ops = not NO_OPERATION_PROFILE.match(os.path.basename(deck_path))
+
+    lines = []
+    previous = ""
+    with open(deck_path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            include = INCLUDE_PATTERN.match(line)
+            if include:
+                include_path = os.path.normpath(
+                    os.path.join(os.path.dirname(deck_path), include.group(1))
+                )
+                include_name = os.path.relpath(include_path, deck_dir)
+                lines.append(f"$lvs_profiler.start({ruby_string(include_name)})")
+                lines.extend(expand_deck(include_path, deck_dir))
+                lines.append("$lvs_profiler.stop")
+                previous = ""
+                continue
+
+            if profile_ops and is_statement_start(line, previous):
+                if not main_deck or line.startswith("logger.info("):
+                    name = get_operation_name(deck_name, line_number, line, main_deck)
+                    lines.append(f"$lvs_profiler.op({ruby_string(name)})")
+
+            lines.append(line)
+            stripped = line.split(" #")[0].strip()
+            if stripped and not stripped.startswith("#"):
+                previous = stripped
+
+    return lines
+
+
+def build_profile_deck(deck_path: str, output_path: str):
+    """
+    Write a profiling copy of the LVS deck. The deck writes its profile to the
+    file given by the switch profile_output.
+
+    Parameters
+    ----------
+    deck_path : str
+        Path of the main LVS deck.
+    output_path : str
+        Path of the generated deck.
+    """
+    deck_dir = os.path.dirname(os.path.abspath(deck_path))
+    deck_name = os.path.basename(deck_path)
+
+    lines = [PROFILER_PRELUDE]
+    # KLayout's own operation profile in the log, if this version has it
+    lines.append("profile if respond_to?(:profile)")
+    lines.append("begin")
+    lines.append(f"$lvs_profiler.start({ruby_string(deck_name)})")
+    lines.extend(expand_deck(os.path.abspath(deck_path), deck_dir, main_deck=True))
+    lines.append("ensure")
+    lines.append("  $lvs_profiler.finish")
+    lines.append("end")
+
+    with open(output_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_profile_tables(raw_path: str, csv_path: str, json_path: str):
+    """
+    Convert the raw profile of a run to tables sorted by self time.
+
+    Parameters
+    ----------
+    raw_path : str
+        JSON lines written by the profiling deck.
+    csv_path : str
+        Path of the CSV table.
+    json_path : str
+        Path of the JSON table.
+
+    Returns
+    -------
+    list of dict
+        Profile records, slowest first.
+    """
+    records = []
+    with open(raw_path, "r") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+
+    for record in records:
+        for key in ["time", "self_time"]:
+            record[key] = round(record[key], 6)
+        for key in ["rss_mb", "rss_delta_mb"]:
+            record[key] = None if record[key] is None else round(record[key], 1)
+
+    records.sort(key=lambda r: r["self_time"], reverse=True)
+
+    fields = ["kind", "name", "include", "depth", "self_time", "time", "rss_mb", "rss_delta_mb"]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+
+    with open(json_path, "w") as f:
+        json.dump(records, f, indent=1)
+
+    return records
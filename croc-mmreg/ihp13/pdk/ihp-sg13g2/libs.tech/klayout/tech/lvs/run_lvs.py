@@ -21,17 +21,31 @@ Usage:
     run_lvs.py (--help| -h)
     run_lvs.py (--layout=<layout_path>) (--netlist=<netlist_path>)
     [--run_dir=<run_dir_path>] [--topcell=<topcell_name>] [--run_mode=<run_mode>]
+    [--threads=<num>] [--max_memory=<GB>]
     [--no_net_names] [--spice_comments] [--net_only] [--no_simplify]
     [--no_series_res] [--no_parallel_res] [--combine_devices] [--top_lvl_pins]
-    [--purge] [--purge_nets] [--verbose]
+    [--purge] [--purge_nets] [--verbose] [--in_process] [--no_cache] [--incremental] [--profile]
+    run_lvs.py (--manifest=<manifest_path>) [--jobs=<num>] [--memory_budget=<GB>]
+    [--run_dir=<run_dir_path>] [--run_mode=<run_mode>]
+    [--threads=<num>] [--max_memory=<GB>]
+    [--no_net_names] [--spice_comments] [--net_only] [--no_simplify]
+    [--no_series_res] [--no_parallel_res] [--combine_devices] [--top_lvl_pins]
+    [--purge] [--purge_nets] [--verbose] [--in_process] [--no_cache] [--incremental] [--profile]
 
 Options:
     --help -h                           Displays this help message.
     --layout=<layout_path>              Specifies the file path of the input GDS file.
     --netlist=<netlist_path>            Specifies the file path of the input netlist file.
+    --manifest=<manifest_path>          Specifies a YAML or CSV file with LVS jobs (layout, netlist, topcell, switches).
+    --jobs=<num>                        Number of LVS jobs running in parallel in batch mode, default is number of CPUs.
+    --memory_budget=<GB>                Predicted memory of all parallel jobs in batch mode, default is 80% of the
+                                        available memory.
     --run_dir=<run_dir_path>            Run directory to save all the generated results [default: pwd]
     --topcell=<topcell_name>            Specifies the name of the top cell to be used.
-    --run_mode=<run_mode>               Selects the allowed KLayout mode. (flat, deep). [default: deep]
+    --run_mode=<run_mode>               Selects the allowed KLayout mode. (flat, deep, auto). [default: deep]
+    --threads=<num>                     Number of threads used by KLayout. With --run_mode=auto it is the maximum,
+                                        default is number of CPUs.
+    --max_memory=<GB>                   Memory budget for --run_mode=auto, default is the available memory.
     --no_net_names                      Omits net names in the extracted netlist.
     --spice_comments                    Includes netlist comments in the extracted netlist.
     --net_only                          Generates netlist objects only in the extracted netlist.
@@ -43,24 +57,166 @@ Options:
     --purge                             Removes unused nets from both layout and schematic netlists.
     --purge_nets                        Purges floating nets from both layout and schematic netlists.
     --verbose                           Enables detailed rule execution logs for debugging purposes.
+    --in_process                        Runs the LVS deck inside the current KLayout process if possible.
+    --no_cache                          Runs LVS even if a cached result for the same inputs exists.
+    --incremental                       Reuses results of unchanged subcells verified in previous runs (deep mode only).
+    --profile                           Writes time and memory of each rule deck and operation to a profile table.
 """
 
 from docopt import docopt
 import os
+import sys
+import csv
+import json
+import shutil
 import logging
 import klayout.db
+from dataclasses import dataclass
 from datetime import datetime
-from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, Popen, PIPE, STDOUT, CalledProcessError
+from typing import Optional
+import struct
 import time
+from layout_scanner import get_top_cells, get_cache_dir, scan_layout
+from lvs_cache import get_cache_key, restore_result, store_result
+import lvs_incremental
+import lvs_admission
+import lvs_planner
+import lvs_profile
+
+# KLayout application module, only complete (with macro and Ruby support)
+# when running inside KLayout itself, e.g. `klayout -b -r script.py`.
+try:
+    import pya
+except ImportError:
+    pya = None
+
+
+@dataclass
+class LVSResult:
+    """
+    Result of one LVS run.
+
+    Attributes
+    ----------
+    report_path : str
+        Path of the generated lvsdb file.
+    netlist_path : str
+        Path of the extracted netlist.
+    match : bool or None
+        True if netlists match, False if not, None if no comparison was done.
+    mode : str
+        Execution mode used for the run (in_process or subprocess).
+    run_time : float
+        Run time of the LVS deck in seconds.
+    peak_rss_mb : float or None
+        Peak memory of the klayout process in MB, None if not measured.
+    profile_path : str or None
+        Path of the profile table (CSV), None if the run was not profiled.
+    """
+
+    report_path: str
+    netlist_path: str
+    match: Optional[bool]
+    mode: str
+    run_time: float
+    peak_rss_mb: Optional[float] = None
+    profile_path: Optional[str] = None
+
+
+def in_process_available():
+    """
+    Check if the LVS deck can be run inside this process. This needs the
+    macro and Ruby interpreter support of the KLayout application, the
+    standalone klayout Python package doesn't provide the LVS DSL.
+
+    Returns
+    -------
+    bool
+        True if the LVS deck can be executed in-process.
+    """
+    if pya is None or not hasattr(pya, "Macro") or not hasattr(pya, "Interpreter"):
+        return False
+
+    return pya.Interpreter.ruby_interpreter() is not None
+
+
+def get_klayout_version(klayout_bin: str = "klayout"):
+    """
+    Get the version string of the klayout binary. The result is cached per
+    binary (resolved path, size and modification time), so `klayout -b -v`
+    is only spawned once after each installation or update.
+
+    Parameters
+    ----------
+    klayout_bin : str
+        Name or path of the klayout executable.
+
+    Returns
+    -------
+    string
+        First line of `klayout -b -v` output, empty if klayout is not found.
+    """
+    bin_path = shutil.which(klayout_bin)
+    if bin_path is None:
+        return ""
+
+    bin_path = os.path.realpath(bin_path)
+    st = os.stat(bin_path)
+    stamp = f"{bin_path}|{st.st_size}|{st.st_mtime_ns}"
+    cache_path = os.path.join(get_cache_dir("version"), "klayout.json")
+
+    versions = {}
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                versions = json.load(f)
+        except (OSError, ValueError):
+            versions = {}
+
+    if stamp in versions:
+        return versions[stamp]
+
+    proc = run([bin_path, "-b", "-v"], stdout=PIPE, stderr=PIPE, text=True)
+    klayout_v_ = proc.stdout.split("\n")[0].strip()
+
+    if klayout_v_:
+        # Drop entries of older binaries at the same location
+        versions = {k: v for k, v in versions.items() if not k.startswith(f"{bin_path}|")}
+        versions[stamp] = klayout_v_
+        try:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(versions, f, indent=1)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"Could not write klayout version cache: {e}")
+
+    return klayout_v_
+
+
+def get_run_klayout_version(in_process: bool):
+    """
+    Get the version of KLayout that runs the deck.
+    """
+    return pya.Application.instance().version() if in_process else get_klayout_version()
 
 
-def check_klayout_version():
+def check_klayout_version(in_process: bool = False):
     """
     Check klayout version and makes sure it would work with the LVS.
+
+    Parameters
+    ----------
+    in_process : bool
+        If True, check the version of the running KLayout application instead of the klayout binary.
     """
     # ======= Checking Klayout version =======
-    klayout_v_ = os.popen("klayout -b -v").read()
-    klayout_v_ = klayout_v_.split("\n")[0]
+    if in_process:
+        klayout_v_ = pya.Application.instance().version()
+    else:
+        klayout_v_ = get_klayout_version()
     klayout_v_list = []
 
     if klayout_v_ == "":
@@ -115,7 +271,8 @@ def check_layout_type(layout_path):
 
 def get_top_cell_names(gds_path):
     """
-    Get the top cell names from the GDS file.
+    Get the top cell names from the GDS file. The cell reference graph is
+    scanned without loading geometry, results are cached by file hash.
 
     Parameters
     ----------
@@ -127,9 +284,13 @@ def get_top_cell_names(gds_path):
     List of string
         Names of the top cell in the layout.
     """
-    layout = klayout.db.Layout()
-    layout.read(gds_path)
-    top_cells = [t.name for t in layout.top_cells()]
+    try:
+        top_cells = get_top_cells(gds_path)
+    except (ValueError, struct.error, OSError) as e:
+        logging.warning(f"Layout scan failed ({e}), reading full layout to get top cells.")
+        layout = klayout.db.Layout()
+        layout.read(gds_path)
+        top_cells = [t.name for t in layout.top_cells()]
 
     return top_cells
 
@@ -189,10 +350,10 @@ def generate_klayout_switches(arguments, layout_path, netlist_path):
     """
     switches = dict()
 
-    if arguments["--run_mode"] in ["flat", "deep"]:
+    if arguments["--run_mode"] in ["flat", "deep", "auto"]:
         run_mode = arguments["--run_mode"]
     else:
-        logging.error("Allowed klayout modes are (flat , deep) only")
+        logging.error("Allowed klayout modes are (flat , deep, auto) only")
         exit(1)
 
     switches = {
@@ -213,6 +374,9 @@ def generate_klayout_switches(arguments, layout_path, netlist_path):
         "schematic": os.path.abspath(netlist_path)
     }
 
+    if arguments.get("--threads"):
+        switches["threads"] = str(arguments["--threads"])
+
     return switches
 
 
@@ -243,7 +407,210 @@ def check_lvs_results(results_db_files: list):
         exit(1)
 
 
-def run_check(lvs_file: str, path: str, run_dir: str, sws: dict):
+def read_lvs_match(report_path: str):
+    """
+    Read the comparison status from a LVS results database.
+
+    Parameters
+    ----------
+    report_path : str
+        Path of the lvsdb file.
+
+    Returns
+    -------
+    bool or None
+        True if all circuits match, False if any circuit doesn't match,
+        None if the database has no comparison results (e.g. net_only runs).
+    """
+
+    lvs_db = klayout.db.LayoutVsSchematic()
+    lvs_db.read(report_path)
+
+    xref = lvs_db.xref()
+    if xref is None:
+        return None
+
+    statuses = [pair.status() for pair in xref.each_circuit_pair()]
+    if len(statuses) < 1:
+        return None
+
+    match_statuses = [
+        klayout.db.NetlistCrossReference.Match,
+        klayout.db.NetlistCrossReference.MatchWithWarning,
+    ]
+    return all(status in match_statuses for status in statuses)
+
+
+def read_lvs_matched_circuits(report_path: str):
+    """
+    Get the layout circuits that match their schematic counterpart in a LVS results database.
+
+    Parameters
+    ----------
+    report_path : str
+        Path of the lvsdb file.
+
+    Returns
+    -------
+    List of string
+        Names of the matching layout circuits.
+    """
+
+    lvs_db = klayout.db.LayoutVsSchematic()
+    lvs_db.read(report_path)
+
+    xref = lvs_db.xref()
+    if xref is None:
+        return []
+
+    match_statuses = [
+        klayout.db.NetlistCrossReference.Match,
+        klayout.db.NetlistCrossReference.MatchWithWarning,
+    ]
+    return [
+        pair.first().name
+        for pair in xref.each_circuit_pair()
+        if pair.first() is not None and pair.second() is not None and pair.status() in match_statuses
+    ]
+
+
+def run_deck_in_process(lvs_file: str, sws: dict, layout=None):
+    """
+    Run the LVS deck with the Ruby interpreter of the running KLayout application.
+
+    Parameters
+    ----------
+    lvs_file : str
+        String that has the file full path to run.
+    sws : dict
+        Dictionary that holds all switches that needs to be passed to the LVS deck.
+    layout : pya.Layout, optional
+        Already loaded layout. If given, the deck uses it instead of reading the input file again.
+    """
+
+    ruby = pya.Interpreter.ruby_interpreter()
+
+    # Same global variables as `-rd` on the command line. Reset the optional ones
+    # so values from a previous run in this process are not reused by accident.
+    for k in ["input_layout", "blank_cells", "threads", "profile_output"]:
+        ruby.define_variable(k, None)
+    for k, v in sws.items():
+        ruby.define_variable(k, v)
+    ruby.define_variable("input_layout", layout)
+
+    macro = pya.Macro(lvs_file)
+    macro.run()
+
+
+def run_deck_subprocess(lvs_file: str, sws: dict, log_path: str = None, memory_limit_mb: float = None):
+    """
+    Run the LVS deck in a separate klayout batch process.
+
+    Parameters
+    ----------
+    lvs_file : str
+        String that has the file full path to run.
+    sws : dict
+        Dictionary that holds all switches that needs to be passed to the LVS deck.
+    log_path : str, optional
+        File to write the klayout output to. If not given, the output goes to the console.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory, checked on platforms with /proc only.
+
+    Returns
+    -------
+    float or None
+        Peak memory of the klayout process in MB, None if not available on this platform.
+
+    Raises
+    ------
+    lvs_admission.MemoryLimitExceeded
+        If klayout was killed for using more memory than the limit.
+    """
+
+    run_args = ["klayout", "-b", "-r", lvs_file]
+    for k, v in sws.items():
+        run_args += ["-rd", f"{k}={v}"]
+
+    logging.debug(f"klayout -b -r {lvs_file} {build_switches_string(sws)}")
+    log_file = open(log_path, "w") if log_path else None
+    try:
+        proc = Popen(run_args, stdout=log_file, stderr=STDOUT if log_file else None)
+        peak_rss_mb = None
+        if hasattr(os, "wait4"):
+            # Resource usage of this klayout process only, also with parallel batch jobs
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG if memory_limit_mb else 0)
+            while pid == 0:
+                rss_mb = lvs_admission.get_process_rss_mb(proc.pid)
+                if rss_mb is not None and rss_mb > memory_limit_mb:
+                    proc.kill()
+                    os.wait4(proc.pid, 0)
+                    proc.returncode = -9
+                    raise lvs_admission.MemoryLimitExceeded(rss_mb, memory_limit_mb)
+                time.sleep(lvs_admission.MEMORY_POLL_INTERVAL)
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        else:
+            proc.wait()
+    finally:
+        if log_file:
+            log_file.close()
+
+    if proc.returncode != 0:
+        raise CalledProcessError(proc.returncode, run_args)
+
+    return peak_rss_mb
+
+
+def write_profile(raw_path: str, run_dir: str, layout_base_name: str):
+    """
+    Write the profile table of a profiled run next to the lvsdb and log the slowest steps.
+
+    Parameters
+    ----------
+    raw_path : str
+        Raw profile written by the profiling deck.
+    run_dir : str
+        String that holds the full path of the run location.
+    layout_base_name : str
+        Base name of the layout, used for the table file names.
+
+    Returns
+    -------
+    str or None
+        Path of the CSV profile table, None if the deck didn't write a profile.
+    """
+    if not os.path.isfile(raw_path):
+        logging.warning("The LVS deck didn't write a profile, please check the log.")
+        return None
+
+    csv_path = os.path.join(run_dir, f"{layout_base_name}_profile.csv")
+    json_path = os.path.join(run_dir, f"{layout_base_name}_profile.json")
+    records = lvs_profile.write_profile_tables(raw_path, csv_path, json_path)
+    os.remove(raw_path)
+
+    # Netlist extraction runs lazily, its time shows up in the compare step of the main deck
+    logging.info(f"LVS profile written to {csv_path}, slowest steps:")
+    for record in records[:10]:
+        rss = f"{record['rss_mb']:.0f} MB" if record["rss_mb"] is not None else "-"
+        logging.info(f"  {record['self_time']:>10.3f}s {rss:>9}  {record['kind']:<9} {record['name']}")
+
+    return csv_path
+
+
+def run_check(
+    lvs_file: str,
+    path: str,
+    run_dir: str,
+    sws: dict,
+    in_process: bool = False,
+    layout=None,
+    log_path: str = None,
+    use_cache: bool = False,
+    profile: bool = False,
+    memory_limit_mb: float = None,
+):
     """
     Run LVS check.
 
@@ -257,11 +624,25 @@ def run_check(lvs_file: str, path: str, run_dir: str, sws: dict):
         String that holds the full path of the run location.
     sws : dict
         Dictionary that holds all switches that needs to be passed to the antenna checks.
+    in_process : bool
+        Run the deck inside the current KLayout process if available, otherwise klayout is spawned.
+    layout : pya.Layout, optional
+        Already loaded layout, only used for in-process runs.
+    log_path : str, optional
+        File to write the klayout output to, only used for klayout batch process runs.
+    use_cache : bool
+        Restore the result from the LVS result cache if the same run was done before,
+        and store the result after the run. Not used if a loaded layout is given.
+    profile : bool
+        Run a profiling copy of the deck and write the time and memory of each
+        rule deck and operation to <layout>_profile.csv/json. Profiled runs don't use the cache.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory, only used for klayout batch process runs.
 
     Returns
     -------
-    string
-        string that represent the path to the results output database for this run.
+    LVSResult
+        Paths of the results database and extracted netlist, and the comparison status for this run.
 
     """
 
@@ -276,12 +657,674 @@ def run_check(lvs_file: str, path: str, run_dir: str, sws: dict):
     new_sws["report"] = report_path
     new_sws["target_netlist"] = ext_net_path
 
-    sws_str = build_switches_string(new_sws)
+    if in_process and not in_process_available():
+        logging.warning("KLayout macro support is not available in this process, running klayout in batch mode.")
+        in_process = False
+
+    # Profiling copy of the deck with inlined rule decks and timers
+    if profile:
+        run_deck = os.path.join(run_dir, f"{layout_base_name}_profile.lvs")
+        lvs_profile.build_profile_deck(lvs_file, run_deck)
+        new_sws["profile_output"] = os.path.join(run_dir, f"{layout_base_name}_profile.jsonl")
+        use_cache = False
+    else:
+        run_deck = lvs_file
+
+    # Look up the result cache, the key covers layout, netlist, switches, deck and klayout version
+    cache_key = None
+    if use_cache and layout is None:
+        try:
+            cache_key = get_cache_key(
+                path, sws["schematic"], sws, lvs_file, get_run_klayout_version(in_process)
+            )
+        except OSError as e:
+            logging.warning(f"Could not compute LVS cache key: {e}")
+
+    if cache_key:
+        t0 = time.time()
+        verdict = restore_result(cache_key, report_path, ext_net_path)
+        if verdict is not None:
+            logging.info(
+                f"LVS result restored from cache, saved {verdict['run_time']:.3f}s of LVS run time"
+            )
+            return LVSResult(
+                report_path=report_path,
+                netlist_path=ext_net_path,
+                match=verdict["match"],
+                mode="cache",
+                run_time=time.time() - t0,
+            )
+
+    t0 = time.time()
+    if in_process:
+        run_deck_in_process(run_deck, new_sws, layout)
+        peak_rss_mb = None
+    else:
+        peak_rss_mb = run_deck_subprocess(run_deck, new_sws, log_path, memory_limit_mb)
+    run_time = time.time() - t0
+
+    profile_path = None
+    if profile:
+        profile_path = write_profile(new_sws["profile_output"], run_dir, layout_base_name)
+
+    match = read_lvs_match(report_path) if os.path.isfile(report_path) else None
+
+    if cache_key and os.path.isfile(report_path):
+        store_result(
+            cache_key, report_path, ext_net_path, {"match": match, "run_time": run_time}
+        )
+
+    return LVSResult(
+        report_path=report_path,
+        netlist_path=ext_net_path,
+        match=match,
+        mode="in_process" if in_process else "subprocess",
+        run_time=run_time,
+        peak_rss_mb=peak_rss_mb,
+        profile_path=profile_path,
+    )
+
+
+def run_lvs(
+    layout_path: str,
+    netlist_path: str,
+    run_dir: str,
+    options: dict = None,
+    in_process: bool = True,
+    layout=None,
+    use_cache: bool = True,
+    log_path: str = None,
+    memory_limit_mb: float = None,
+):
+    """
+    Run LVS from Python, e.g. for regression runs inside one KLayout process.
+
+    Parameters
+    ----------
+    layout_path : str
+        Path to the layout file that we will run LVS on.
+    netlist_path : str
+        Path to the netlist file that we will run LVS on.
+    run_dir : str
+        Run directory to save all the generated results.
+    options : dict, optional
+        Command line options in docopt format, e.g. {"--topcell": "top", "--net_only": True}.
+        With {"--run_mode": "auto"} run mode and threads are planned from the layout statistics.
+    in_process : bool
+        Run the deck inside the current KLayout process if available.
+    layout : pya.Layout, optional
+        Already loaded layout, only used for in-process runs.
+    use_cache : bool
+        Use the LVS result cache.
+    log_path : str, optional
+        File to write the klayout output to, only used for klayout batch process runs.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory, only used for klayout batch process runs.
+
+    Returns
+    -------
+    LVSResult
+        Paths of the results database and extracted netlist, and the comparison status for this run.
+    """
+
+    arguments = {"--run_mode": "deep", "--topcell": None}
+    arguments.update(options or {})
+
+    os.makedirs(run_dir, exist_ok=True)
+    layout_path = os.path.abspath(layout_path)
+    netlist_path = os.path.abspath(netlist_path)
+
+    lvs_rule_deck = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "sg13g2.lvs"
+    )
+
+    switches = generate_klayout_switches(arguments, layout_path, netlist_path)
+
+    return run_planned_check(
+        run_check,
+        lvs_rule_deck,
+        layout_path,
+        run_dir,
+        switches,
+        arguments,
+        in_process=in_process,
+        layout=layout,
+        log_path=log_path,
+        use_cache=use_cache,
+        memory_limit_mb=memory_limit_mb,
+    )
+
 
-    run_str = f"klayout -b -r {lvs_file} {sws_str}"
-    check_call(run_str, shell=True)
+def run_incremental_check(
+    lvs_file: str,
+    path: str,
+    run_dir: str,
+    sws: dict,
+    in_process: bool = False,
+    log_path: str = None,
+    use_cache: bool = False,
+    profile: bool = False,
+    memory_limit_mb: float = None,
+):
+    """
+    Run LVS check, reusing the results of subcells that are unchanged since a previous matching run.
 
-    return report_path
+    Unchanged verified subcells are reduced to their metal and via layers
+    and blanked in both netlists, so only the changed hierarchy is
+    extracted and compared. If this run doesn't match, it is repeated
+    without reused cells, so a reused cell can't hide a mismatch.
+
+    Parameters
+    ----------
+    lvs_file : str
+        String that has the file full path to run.
+    path : str
+        String that holds the full path of the layout.
+    run_dir : str
+        String that holds the full path of the run location.
+    sws : dict
+        Dictionary that holds all switches that needs to be passed to the LVS deck.
+    in_process : bool
+        Run the deck inside the current KLayout process if available.
+    log_path : str, optional
+        File to write the klayout output to, only used for klayout batch process runs.
+    use_cache : bool
+        Use the LVS result cache.
+    profile : bool
+        Write a profile table of the LVS run.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory, only used for klayout batch process runs.
+
+    Returns
+    -------
+    LVSResult
+        Result of the LVS run.
+    """
+
+    if sws["run_mode"] != "deep" or sws["net_only"] == "true":
+        logging.warning("Incremental LVS needs deep mode and netlist comparison, running full LVS.")
+        return run_check(
+            lvs_file, path, run_dir, sws, in_process, log_path=log_path, use_cache=use_cache,
+            profile=profile, memory_limit_mb=memory_limit_mb
+        )
+
+    in_process = in_process and in_process_available()
+    topcell = sws["topcell"]
+
+    t0 = time.time()
+    layout = klayout.db.Layout()
+    layout.read(path)
+    cell_hashes = lvs_incremental.compute_cell_hashes(layout, topcell)
+    subckt_hashes = lvs_incremental.read_subckt_hashes(sws["schematic"])
+    context = lvs_incremental.get_context_hash(
+        lvs_file, sws, get_run_klayout_version(in_process)
+    )
+    reused = lvs_incremental.select_reusable_cells(
+        list(cell_hashes.keys()), cell_hashes, subckt_hashes, context
+    )
+    recomputed = sorted(set(cell_hashes.keys()) - set(reused)) + [topcell]
+    hash_time = time.time() - t0
+    logging.info(
+        f"Incremental LVS: {len(reused)} cells reused, {len(recomputed)} cells recomputed "
+        f"(hashing took {hash_time:.3f}s)"
+    )
+
+    result = None
+    if reused:
+        layout_base_name = os.path.basename(path).split(".")[0]
+        abstract_path = os.path.join(run_dir, f"{layout_base_name}_incremental.oas")
+        lvs_incremental.write_abstract_layout(layout, reused, abstract_path)
+
+        inc_sws = sws.copy()
+        inc_sws["input"] = abstract_path
+        inc_sws["blank_cells"] = ",".join(reused)
+        result = run_check(
+            lvs_file, path, run_dir, inc_sws, in_process, log_path=log_path, use_cache=use_cache,
+            profile=profile, memory_limit_mb=memory_limit_mb
+        )
+
+        if result.match is not True:
+            logging.warning("Incremental LVS doesn't match, running full LVS to confirm.")
+            result = None
+
+    if result is None:
+        reused = []
+        recomputed = sorted(cell_hashes.keys()) + [topcell]
+        result = run_check(
+            lvs_file, path, run_dir, sws, in_process, log_path=log_path, use_cache=use_cache,
+            profile=profile, memory_limit_mb=memory_limit_mb
+        )
+        if result.mode != "cache":
+            lvs_incremental.set_full_run_time(path, topcell, context, result.run_time)
+
+    if os.path.isfile(result.report_path):
+        lvs_incremental.record_verified_cells(
+            read_lvs_matched_circuits(result.report_path), cell_hashes, subckt_hashes, context
+        )
+
+    # Report reused and recomputed cells with the time saved against the last full run
+    full_run_time = lvs_incremental.get_full_run_time(path, topcell, context)
+    time_saved = None
+    if reused and full_run_time is not None:
+        time_saved = full_run_time - result.run_time - hash_time
+
+    report = {
+        "topcell": topcell,
+        "reused": reused,
+        "recomputed": recomputed,
+        "hash_time": round(hash_time, 3),
+        "run_time": round(result.run_time, 3),
+        "full_run_time": full_run_time,
+        "time_saved": None if time_saved is None else round(time_saved, 3),
+    }
+    report_path = os.path.join(
+        run_dir, f"{os.path.basename(path).split('.')[0]}_incremental.json"
+    )
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=1)
+
+    logging.info(f"Reused cells: {' '.join(reused) if reused else 'none'}")
+    logging.info(f"Recomputed cells: {' '.join(recomputed)}")
+    if time_saved is not None:
+        logging.info(
+            f"Incremental LVS time saved: {time_saved:.3f}s (last full run {full_run_time:.3f}s)"
+        )
+
+    return result
+
+
+def apply_run_plan(arguments: dict, sws: dict, layout_path: str):
+    """
+    Plan run mode and thread count from layout statistics if run mode is auto, and update the switches.
+
+    Parameters
+    ----------
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+    sws : dict
+        Dictionary that holds all switches that needs to be passed to the LVS deck, it is updated.
+    layout_path : str
+        Path to the layout file that we will run LVS on.
+
+    Returns
+    -------
+    tuple or None
+        Plan and layout statistics, None if run mode is not auto.
+    """
+    if sws["run_mode"] != "auto":
+        return None
+
+    stats = lvs_planner.get_layout_stats(scan_layout(layout_path), sws["topcell"])
+    max_threads = int(arguments["--threads"]) if arguments.get("--threads") else None
+    max_memory_mb = float(arguments["--max_memory"]) * 1024 if arguments.get("--max_memory") else None
+    plan = lvs_planner.plan_run(stats, max_memory_mb, max_threads)
+
+    sws["run_mode"] = plan["run_mode"]
+    sws["threads"] = str(plan["threads"])
+    logging.info(
+        f"Run plan for {sws['topcell']}: {plan['run_mode']} mode, {plan['threads']} threads, "
+        f"estimated {plan['estimated_memory_mb']:.0f} MB ({plan['reason']})"
+    )
+
+    return plan, stats
+
+
+def run_planned_check(run_function, lvs_file: str, path: str, run_dir: str, sws: dict, arguments: dict, **kwargs):
+    """
+    Run LVS check with planned run mode and threads if run mode is auto, and record the outcome in the planner history.
+
+    Parameters
+    ----------
+    run_function : function
+        run_check or run_incremental_check.
+    lvs_file : str
+        String that has the file full path to run.
+    path : str
+        String that holds the full path of the layout.
+    run_dir : str
+        String that holds the full path of the run location.
+    sws : dict
+        Dictionary that holds all switches that needs to be passed to the LVS deck.
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+    **kwargs
+        Further arguments of the run function.
+
+    Returns
+    -------
+    LVSResult
+        Result of the LVS run.
+    """
+    sws = sws.copy()
+    planned = apply_run_plan(arguments, sws, path)
+
+    result = run_function(lvs_file, path, run_dir, sws, **kwargs)
+
+    # Cached results have no measurements
+    if planned is not None and result.mode != "cache":
+        plan, stats = planned
+        lvs_planner.record_run(
+            path,
+            sws["topcell"],
+            stats,
+            plan,
+            {"run_time": result.run_time, "peak_rss_mb": result.peak_rss_mb, "match": result.match},
+        )
+
+    return result
+
+
+def parse_switches_string(switches_str: str):
+    """
+    Parse a switches string like "--net_only --run_mode=flat" into a dictionary.
+
+    Parameters
+    ----------
+    switches_str : str
+        Space separated switches, the leading "--" is optional.
+
+    Returns
+    -------
+    dict
+        Dictionary with switch names as keys, switches without value are True.
+    """
+    switches = dict()
+    for sw in (switches_str or "").split():
+        sw = sw.lstrip("-")
+        if "=" in sw:
+            k, v = sw.split("=", 1)
+            switches[k] = v
+        else:
+            switches[sw] = True
+
+    return switches
+
+
+def read_manifest(manifest_path: str):
+    """
+    Read the LVS jobs from a YAML or CSV manifest file.
+
+    A YAML manifest is a list of jobs (or a dict with a "jobs" list), each job
+    with the keys layout, netlist and optionally name, topcell and switches
+    (dict like {net_only: true, run_mode: flat}). A CSV manifest has the same
+    columns, with switches as string like "--net_only --run_mode=flat".
+    Relative paths are relative to the manifest location.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Path of the manifest file.
+
+    Returns
+    -------
+    list of dict
+        List of jobs with keys name, layout, netlist, topcell and switches.
+    """
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    if manifest_path.endswith((".yaml", ".yml")):
+        import yaml
+
+        with open(manifest_path, "r") as f:
+            entries = yaml.safe_load(f) or []
+        if isinstance(entries, dict):
+            entries = entries.get("jobs") or []
+    elif manifest_path.endswith(".csv"):
+        with open(manifest_path, "r", newline="") as f:
+            entries = list(csv.DictReader(f))
+        for entry in entries:
+            entry["switches"] = parse_switches_string(entry.get("switches"))
+    else:
+        logging.error(f"Manifest {manifest_path} is not a YAML or CSV file, please recheck.")
+        exit(1)
+
+    jobs = []
+    names = set()
+    for i, entry in enumerate(entries):
+        if not entry.get("layout") or not entry.get("netlist"):
+            logging.error(f"Manifest job {i + 1} needs a layout and a netlist, please recheck.")
+            exit(1)
+
+        layout_path = os.path.join(base_dir, os.path.expanduser(str(entry["layout"])))
+        netlist_path = os.path.join(base_dir, os.path.expanduser(str(entry["netlist"])))
+        topcell = entry.get("topcell") or None
+
+        # Unique job name, used for the job run directory
+        name = entry.get("name") or os.path.basename(layout_path).split(".")[0]
+        if not entry.get("name") and topcell:
+            name = f"{name}_{topcell}"
+        unique_name = str(name)
+        count = 1
+        while unique_name in names:
+            count += 1
+            unique_name = f"{name}_{count}"
+        names.add(unique_name)
+
+        jobs.append(
+            {
+                "name": unique_name,
+                "layout": os.path.abspath(layout_path),
+                "netlist": os.path.abspath(netlist_path),
+                "topcell": topcell,
+                "switches": entry.get("switches") or {},
+            }
+        )
+
+    return jobs
+
+
+def get_job_arguments(arguments: dict, job: dict):
+    """
+    Merge the command line options with the switches of one manifest job.
+
+    Parameters
+    ----------
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+    job : dict
+        Manifest job, its switches override the command line options.
+
+    Returns
+    -------
+    dict
+        Options for this job in docopt format.
+    """
+    job_args = dict(arguments)
+    job_args["--topcell"] = job["topcell"]
+
+    for k, v in job["switches"].items():
+        if isinstance(v, str) and v.lower() in ["true", "false"]:
+            v = v.lower() == "true"
+        job_args[f"--{k}"] = v
+
+    return job_args
+
+
+def run_batch_job(
+    lvs_file: str, job: dict, run_dir: str, arguments: dict, in_process: bool, memory_limit_mb: float = None
+):
+    """
+    Run one manifest job in its own run directory.
+
+    Parameters
+    ----------
+    lvs_file : str
+        String that has the file full path to run.
+    job : dict
+        Manifest job to run.
+    run_dir : str
+        Batch run directory, the job runs in a sub directory named like the job.
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+    in_process : bool
+        Run the deck inside the current KLayout process.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory.
+
+    Returns
+    -------
+    LVSResult
+        Result of this job.
+    """
+
+    for path in [job["layout"], job["netlist"]]:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} doesn't exist")
+
+    job_dir = os.path.join(run_dir, job["name"])
+    os.makedirs(job_dir, exist_ok=True)
+
+    try:
+        switches = generate_klayout_switches(
+            get_job_arguments(arguments, job), job["layout"], job["netlist"]
+        )
+    except SystemExit:
+        raise ValueError("invalid switches or top cell, please check the log")
+
+    run_function = run_incremental_check if arguments.get("--incremental") else run_check
+
+    return run_planned_check(
+        run_function,
+        lvs_file,
+        job["layout"],
+        job_dir,
+        switches,
+        get_job_arguments(arguments, job),
+        in_process=in_process,
+        log_path=os.path.join(job_dir, f"{job['name']}_lvs.log"),
+        use_cache=not arguments.get("--no_cache"),
+        profile=bool(arguments.get("--profile")),
+        memory_limit_mb=memory_limit_mb,
+    )
+
+
+def get_job_status(result: LVSResult):
+    """
+    Get the status string of a finished job for the batch summary.
+    """
+    if not os.path.isfile(result.report_path):
+        return "no_result"
+    if result.match is None:
+        return "extracted"
+
+    return "match" if result.match else "mismatch"
+
+
+def run_batch(lvs_file: str, manifest_path: str, run_dir: str, arguments: dict):
+    """
+    Run all LVS jobs of a manifest on a bounded worker pool.
+
+    Jobs are started largest layout first, so that long runs don't end up
+    at the tail of the batch. A job only starts while the predicted peak
+    memory of all running jobs fits into the memory budget, and jobs that use
+    far more memory than predicted are killed and run again alone. The status
+    of each job is logged when it finishes, a summary table is written to
+    lvs_batch_summary.csv.
+
+    Parameters
+    ----------
+    lvs_file : str
+        String that has the file full path to run.
+    manifest_path : str
+        Path of the YAML or CSV manifest file.
+    run_dir : str
+        String with absolute path of the batch run dir.
+    arguments : dict
+        Dictionary that holds the arguments used by user in the run command.
+
+    Returns
+    -------
+    list of dict
+        Summary rows of all jobs.
+    """
+
+    jobs = read_manifest(manifest_path)
+    if len(jobs) < 1:
+        logging.error(f"No LVS jobs found in manifest {manifest_path}.")
+        exit(1)
+
+    for job in jobs:
+        job["layout_size"] = os.path.getsize(job["layout"]) if os.path.isfile(job["layout"]) else 0
+    jobs.sort(key=lambda j: j["layout_size"], reverse=True)
+
+    # The Ruby interpreter of an in-process run can only execute one deck at a time
+    in_process = bool(arguments.get("--in_process")) and in_process_available()
+    if in_process:
+        num_workers = 1
+    elif arguments.get("--jobs"):
+        num_workers = max(1, int(arguments["--jobs"]))
+    else:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(jobs))
+
+    # Predicted peak memory of each job, from previous runs or layout statistics
+    memory_history = lvs_admission.load_memory_history()
+    for job in jobs:
+        job["run_mode"] = get_job_arguments(arguments, job).get("--run_mode")
+        job["memory_mb"] = lvs_admission.estimate_job_memory_mb(
+            job["layout"], job["topcell"], job["run_mode"], memory_history
+        )
+    budget_mb = lvs_admission.get_memory_budget_mb(arguments.get("--memory_budget"))
+
+    logging.info(
+        f"Running {len(jobs)} LVS jobs from {manifest_path} with {num_workers} workers, memory budget "
+        + ("unknown" if budget_mb is None else f"{budget_mb:.0f} MB")
+    )
+
+    summary = []
+
+    def on_result(job, future):
+        row = {
+            "name": job["name"],
+            "status": "error",
+            "run_time": "",
+            "layout": job["layout"],
+            "layout_size": job["layout_size"],
+            "netlist": job["netlist"],
+            "topcell": job["topcell"] or "",
+            "report_path": "",
+            "error": "",
+        }
+        try:
+            result = future.result()
+            row["status"] = get_job_status(result)
+            row["run_time"] = round(result.run_time, 3)
+            row["report_path"] = result.report_path
+            lvs_admission.record_peak_memory(
+                job["layout"], job["topcell"], job["run_mode"], result.peak_rss_mb
+            )
+        except Exception as e:
+            row["error"] = str(e)
+
+        summary.append(row)
+        logging.info(
+            f"[{len(summary)}/{len(jobs)}] {row['name']}: {row['status']}"
+            + (f" ({row['run_time']}s)" if row["run_time"] != "" else f" ({row['error']})")
+        )
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        lvs_admission.AdmissionScheduler(budget_mb, num_workers).run(
+            jobs,
+            lambda job, limit_mb: executor.submit(
+                run_batch_job, lvs_file, job, run_dir, arguments, in_process, limit_mb
+            ),
+            on_result,
+        )
+
+    # Finishing order depends on the run, sort summary by job name
+    summary.sort(key=lambda r: r["name"])
+    summary_path = os.path.join(run_dir, "lvs_batch_summary.csv")
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(summary[0].keys()))
+        writer.writeheader()
+        writer.writerows(summary)
+
+    logging.info(f"LVS batch summary written to {summary_path}")
+    for row in summary:
+        logging.info(f"{row['name']:<40} {row['status']:<10} {row['run_time']}")
+
+    return summary
 
 
 def main(lvs_run_dir: str, arguments: dict):
@@ -297,8 +1340,27 @@ def main(lvs_run_dir: str, arguments: dict):
         This is generated by docopt library.
     """
 
+    in_process = bool(arguments.get("--in_process")) and in_process_available()
+
     # Check Klayout version
-    check_klayout_version()
+    check_klayout_version(in_process)
+
+    lvs_rule_deck = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "sg13g2.lvs"
+    )
+
+    # Batch mode, run all jobs of the manifest
+    if arguments.get("--manifest"):
+        manifest_path = os.path.abspath(os.path.expanduser(arguments["--manifest"]))
+        if not os.path.isfile(manifest_path):
+            logging.error(f"The manifest file {manifest_path} doesn't exist, please recheck.")
+            exit(1)
+
+        summary = run_batch(lvs_rule_deck, manifest_path, lvs_run_dir, arguments)
+        if any(row["status"] not in ["match", "extracted"] for row in summary):
+            logging.error("Some LVS jobs failed or have mismatches, please check the batch summary.")
+            exit(1)
+        return
 
     # Check layout file existence
     layout_path = arguments["--layout"]
@@ -321,18 +1383,31 @@ def main(lvs_run_dir: str, arguments: dict):
         )
         exit(1)
 
-    lvs_rule_deck = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), "sg13g2.lvs"
-    )
-
     # Get run switches
     switches = generate_klayout_switches(arguments, layout_path, netlist_path)
 
     # Run LVS check
-    res_db_files = run_check(lvs_rule_deck, layout_path, lvs_run_dir, switches)
+    try:
+        run_function = run_incremental_check if arguments.get("--incremental") else run_check
+        result = run_planned_check(
+            run_function,
+            lvs_rule_deck,
+            layout_path,
+            lvs_run_dir,
+            switches,
+            arguments,
+            in_process=arguments.get("--in_process"),
+            use_cache=not arguments.get("--no_cache"),
+            profile=bool(arguments.get("--profile")),
+        )
+    except CalledProcessError as e:
+        logging.error(f"Klayout LVS run failed with exit code {e.returncode}")
+        exit(1)
 
     # Check run
-    check_lvs_results(res_db_files)
+    check_lvs_results([p for p in [result.report_path] if os.path.isfile(p)])
+
+    logging.info(f"LVS run in {result.mode} mode took {result.run_time:.3f}s")
 
 
 # ================================================================
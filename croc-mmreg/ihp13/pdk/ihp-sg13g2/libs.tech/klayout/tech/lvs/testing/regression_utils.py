@@ -0,0 +1,1018 @@
+# ==========================================================================
+# Copyright 2024 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# SPDX-License-Identifier: Apache-2.0
+# ==========================================================================
+
+"""Shared helpers of the SG13G2 LVS regression scripts.
+
+Test cases run on a pool of worker threads that stay alive for the whole
+regression. Each worker runs LVS through the Python API of run_lvs.py on
+the test case files in place, and the verdict is read from the lvsdb.
+The regression scripts run in plain Python, where the in-process LVS path of
+run_lvs.py is not available, so every test case still runs in its own
+klayout batch process and the workers only wait on these processes.
+
+Run times of finished tests are kept in a timing database, keyed by test and
+rule deck hash. It is used to start the longest tests first. Shards are
+selected by a hash of the test name, so all shards of a regression agree on
+the split without sharing any state.
+
+For change-aware runs, each test case is mapped to the rule deck files it
+exercises. A test case is only run again if one of these files, its layout,
+netlist or switches changed since its last passing run.
+
+Results are streamed to JSON-lines and JUnit XML files while test cases
+finish, so partial results survive an aborted regression.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import statistics
+import concurrent.futures
+from pathlib import Path
+from subprocess import CalledProcessError
+from xml.etree import ElementTree
+import pandas as pd
+import yaml
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+LVS_DIR = os.path.dirname(TESTING_DIR)
+sys.path.insert(0, LVS_DIR)
+
+import run_lvs  # noqa: E402
+from layout_scanner import get_cache_dir, file_sha256  # noqa: E402
+from lvs_cache import get_deck_hash, get_deck_files  # noqa: E402
+
+TIMING_DB_VERSION = 1
+
+# Weight of the latest run time in the stored estimate
+TIMING_SMOOTHING = 0.5
+
+# Estimate in seconds for tests that never ran before, if no other test has a run time
+DEFAULT_TEST_TIME = 10.0
+
+SELECTION_STATE_VERSION = 1
+
+TESTCASE_MANIFEST_VERSION = 1
+
+RESULTS_JSONL_FILE = "test_results.jsonl"
+RESULTS_JUNIT_FILE = "test_results.junit.xml"
+
+# Shard and all test cases of a shard run, checked when shards are merged
+SHARD_FILE = "shard.json"
+
+# Rule deck files of a device group, e.g. rule_decks/mos_extraction.lvs
+GROUP_DECK_PATTERN = re.compile(r"^([a-z]+)_(derivations|connections|extraction)\.lvs$")
+
+# Deck files named like group files, but used by all device groups
+SHARED_DECK_PREFIXES = ["general", "devices"]
+
+# Variable assignment and identifier use in a deck file
+DECK_ASSIGNMENT = re.compile(r"^\s*([A-Za-z_]\w*)\s*=[^=~]")
+DECK_IDENTIFIER = re.compile(r"\b[A-Za-z_]\w*\b")
+
+
+def get_switches(yaml_file, rule_name):
+    """
+    Parse yaml file and extract the run_lvs.py options of a test case.
+
+    Parameters
+    ----------
+    yaml_file : str
+        yaml config file path of the test case.
+    rule_name : str
+        Name of the test case in the yaml file.
+
+    Returns
+    -------
+    dict
+        Options in docopt format, e.g. {"--run_mode": "flat"}.
+    """
+
+    with open(yaml_file, "r") as stream:
+        yaml_dic = yaml.safe_load(stream)
+
+    options = dict()
+    for param, value in yaml_dic[rule_name].items():
+        if isinstance(value, str) and value.lower() in ["true", "false"]:
+            value = value.lower() == "true"
+        options[param] = value
+
+    return options
+
+
+def run_test(layout_path, netlist_path, output_loc, test_name, options=None, memory_limit_mb=None):
+    """
+    Run LVS of one test case in a klayout batch process.
+
+    Parameters
+    ----------
+    layout_path : string or Path object
+        Path string to the layout of the test case.
+    netlist_path : string or Path object
+        Path string to the netlist of the test case.
+    output_loc : string
+        Run directory of this test case.
+    test_name : string
+        Name of the test case, used for logging and the klayout log file.
+    options : dict, optional
+        Options of run_lvs.py in docopt format.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory, the test case is then requeued by the caller.
+
+    Returns
+    -------
+    dict
+        Status (Passed or Failed), run time in seconds and peak memory in MB of the test case,
+        peak memory is None if not available on this platform.
+    """
+
+    os.makedirs(output_loc, exist_ok=True)
+    log_path = os.path.join(output_loc, f"{test_name}_lvs.log")
+
+    t0 = time.time()
+    try:
+        result = run_lvs.run_lvs(
+            layout_path,
+            netlist_path,
+            output_loc,
+            options,
+            in_process=False,
+            use_cache=False,
+            log_path=log_path,
+            memory_limit_mb=memory_limit_mb,
+        )
+        match = result.match
+        peak_rss_mb = result.peak_rss_mb
+    except CalledProcessError as e:
+        # A failing klayout run can still have written a comparison result
+        report_path = os.path.join(
+            output_loc, f"{os.path.basename(str(layout_path)).split('.')[0]}.lvsdb"
+        )
+        if not os.path.isfile(report_path):
+            raise Exception(f"Failed LVS run of {test_name}: {e}")
+        match = run_lvs.read_lvs_match(report_path)
+        peak_rss_mb = None
+    except SystemExit:
+        raise Exception(f"Failed LVS run of {test_name}, please check the log.")
+    run_time = time.time() - t0
+
+    if match:
+        rss = f"{peak_rss_mb:.0f} MB" if peak_rss_mb is not None else "- MB"
+        logging.info(f"{test_name} testcase passed ({run_time:.3f}s, {rss})")
+        status = "Passed"
+    else:
+        logging.error(f"{test_name} testcase failed.")
+        logging.error(f"Please recheck {layout_path} and {netlist_path} files.")
+        status = "Failed"
+
+    return {
+        "status": status,
+        "run_time": round(run_time, 3),
+        "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+    }
+
+
+def get_worker_pool(num_workers):
+    """
+    Get the pool of workers that run the test cases.
+
+    Each test case runs in its own klayout batch process, so threads are enough to run them in parallel.
+
+    Parameters
+    ----------
+    num_workers : int
+        Number of worker threads.
+
+    Returns
+    -------
+    concurrent.futures.ThreadPoolExecutor
+        Thread pool, the workers are reused for all test cases.
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+
+
+def get_lvs_deck_hash():
+    """
+    Get the content hash of the SG13G2 LVS deck with all included rule decks.
+    """
+    return get_deck_hash(os.path.join(LVS_DIR, "sg13g2.lvs"))
+
+
+def get_timing_db_path(timing_db=None):
+    """
+    Get the path of the regression timing database.
+
+    Parameters
+    ----------
+    timing_db : str, optional
+        Path given by the user, the local cache directory is used if not given.
+
+    Returns
+    -------
+    string
+        Path of the timing database file.
+    """
+    if timing_db:
+        return os.path.abspath(timing_db)
+    return os.path.join(get_cache_dir("regression"), "timings.json")
+
+
+def load_timings(db_path):
+    """
+    Load the regression timing database.
+
+    Parameters
+    ----------
+    db_path : str
+        Path of the timing database file.
+
+    Returns
+    -------
+    dict
+        Run times per test name and rule deck hash, empty if there is no database yet.
+    """
+    if not os.path.isfile(db_path):
+        return dict()
+
+    try:
+        with open(db_path, "r") as f:
+            data = json.load(f)
+    except ValueError:
+        logging.warning(f"Timing database {db_path} is not readable, it will be rebuilt.")
+        return dict()
+
+    if data.get("version") != TIMING_DB_VERSION:
+        return dict()
+
+    return data.get("tests", dict())
+
+
+def save_timings(db_path, timings):
+    """
+    Write the regression timing database, the file is replaced atomically.
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": TIMING_DB_VERSION, "tests": timings}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, db_path)
+
+
+def estimate_test_time(timings, test_id, deck_hash):
+    """
+    Get the expected run time of a test from the timing database.
+
+    Parameters
+    ----------
+    timings : dict
+        Timing database loaded by load_timings.
+    test_id : str
+        Name of the test.
+    deck_hash : str
+        Hash of the current rule decks.
+
+    Returns
+    -------
+    float or None
+        Run time of this test with the current rule decks if known, otherwise the
+        latest run time with other rule decks, None if the test never ran.
+    """
+    entries = timings.get(test_id)
+    if not entries:
+        return None
+    if deck_hash in entries:
+        return entries[deck_hash]["run_time"]
+    return max(entries.values(), key=lambda e: e["updated"])["run_time"]
+
+
+def update_timings(timings, results_df, id_column, status_column, deck_hash):
+    """
+    Add the run times of finished tests to the timing database.
+
+    Parameters
+    ----------
+    timings : dict
+        Timing database loaded by load_timings, updated in place.
+    results_df : pd.DataFrame
+        Results with run_time column.
+    id_column : str
+        Column that holds the test name.
+    status_column : str
+        Column that holds the test status, only Passed and Failed tests are recorded.
+    deck_hash : str
+        Hash of the current rule decks.
+    """
+    done_df = results_df[
+        results_df[status_column].isin(["Passed", "Failed"]) & results_df["run_time"].notnull()
+    ]
+    now = time.time()
+
+    for test_id, run_time in zip(done_df[id_column], done_df["run_time"]):
+        entry = timings.setdefault(test_id, dict()).get(deck_hash)
+        if entry is None:
+            estimate = float(run_time)
+        else:
+            estimate = TIMING_SMOOTHING * float(run_time) + (1 - TIMING_SMOOTHING) * entry["run_time"]
+        timings[test_id][deck_hash] = {"run_time": round(estimate, 3), "updated": now}
+
+
+def schedule_tests(tc_df, id_column, timings, deck_hash):
+    """
+    Order test cases longest expected run time first.
+
+    Tests that never ran get the median run time of the known tests.
+
+    Parameters
+    ----------
+    tc_df : pd.DataFrame
+        Test cases to run.
+    id_column : str
+        Column that holds the test name.
+    timings : dict
+        Timing database loaded by load_timings.
+    deck_hash : str
+        Hash of the current rule decks.
+
+    Returns
+    -------
+    pd.DataFrame
+        Test cases with an est_time column, sorted by it.
+    """
+    estimates = [estimate_test_time(timings, test_id, deck_hash) for test_id in tc_df[id_column]]
+    known = [e for e in estimates if e is not None]
+    default_time = statistics.median(known) if known else DEFAULT_TEST_TIME
+
+    tc_df = tc_df.copy()
+    tc_df["est_time"] = [default_time if e is None else e for e in estimates]
+    tc_df.sort_values(["est_time", id_column], ascending=[False, True], inplace=True)
+
+    logging.info(
+        f"Scheduled {len(tc_df)} test cases longest first, "
+        f"{len(known)} with known run times, expected total {tc_df['est_time'].sum():.1f}s"
+    )
+    return tc_df
+
+
+def parse_shard(shard):
+    """
+    Parse a shard selection of the form i/N, with 1 <= i <= N.
+
+    Returns
+    -------
+    tuple
+        Shard index (starting at 1) and number of shards.
+    """
+    try:
+        index, count = (int(v) for v in str(shard).split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be given as i/N, got {shard}")
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}, got {shard}")
+
+    return index, count
+
+
+def get_test_shard(test_id, count):
+    """Shard (starting at 1) of a test, from a stable hash of its name."""
+    return int(hashlib.sha256(test_id.encode()).hexdigest(), 16) % count + 1
+
+
+def select_shard(tc_df, id_column, shard, output_path):
+    """
+    Select the test cases of one shard.
+
+    Tests are assigned to shards by a hash of their name, the assignment doesn't
+    depend on timings or results of other shards. All test cases and the shard are
+    written to the run directory, so merged shards can be checked for completeness.
+
+    Parameters
+    ----------
+    tc_df : pd.DataFrame
+        All test cases of the regression.
+    id_column : str
+        Column that holds the test name.
+    shard : str
+        Shard selection i/N.
+    output_path : str
+        Run directory of the shard.
+
+    Returns
+    -------
+    pd.DataFrame
+        Test cases of the selected shard.
+    """
+    index, count = parse_shard(shard)
+    shard_df = tc_df[[get_test_shard(t, count) == index for t in tc_df[id_column]]].copy()
+
+    with open(os.path.join(output_path, SHARD_FILE), "w") as f:
+        json.dump({"index": index, "count": count, "tests": sorted(tc_df[id_column])}, f, indent=1)
+
+    logging.info(f"Shard {index}/{count}: {len(shard_df)} of {len(tc_df)} test cases")
+    return shard_df
+
+
+def check_shard_results(shard_dirs, results_df, id_column):
+    """
+    Check that the shard runs cover all test cases of the regression exactly once.
+
+    Parameters
+    ----------
+    shard_dirs : list of str
+        Run directories of the shards.
+    results_df : pd.DataFrame
+        Merged results of all shards.
+    id_column : str
+        Column that holds the test name.
+
+    Returns
+    -------
+    bool
+        True if all shards of the same regression are merged and each test case
+        has exactly one result.
+    """
+    shards = []
+    for shard_dir in shard_dirs:
+        try:
+            with open(os.path.join(shard_dir, SHARD_FILE), "r") as f:
+                shards.append(json.load(f))
+        except (OSError, ValueError):
+            logging.error(f"Shard selection {os.path.join(shard_dir, SHARD_FILE)} can't be read, please recheck.")
+            return False
+
+    count = shards[0]["count"]
+    tests = shards[0]["tests"]
+    if any(s["count"] != count or s["tests"] != tests for s in shards):
+        logging.error("Shard runs are from different regressions (shard count or test cases differ).")
+        return False
+
+    indexes = sorted(s["index"] for s in shards)
+    if indexes != list(range(1, count + 1)):
+        logging.error(f"Shards {indexes} don't match the shard count {count}.")
+        return False
+
+    result_counts = results_df[id_column].value_counts()
+    missing = [t for t in tests if t not in result_counts]
+    repeated = [t for t in tests if result_counts.get(t, 0) > 1]
+    unknown = [t for t in result_counts.index if t not in set(tests)]
+    for name, problem in [("without result", missing), ("with several results", repeated), ("unknown", unknown)]:
+        if problem:
+            logging.error(f"{len(problem)} test cases {name}: {', '.join(problem)}")
+
+    return not (missing or repeated or unknown)
+
+
+def read_shard_results(shard_dirs, results_file):
+    """
+    Read and concatenate the result tables of several shard runs.
+
+    Parameters
+    ----------
+    shard_dirs : list of str
+        Run directories of the shards.
+    results_file : str
+        Name of the result CSV file in each shard run directory.
+
+    Returns
+    -------
+    pd.DataFrame
+        Results of all shards.
+    """
+    shard_dfs = []
+    for shard_dir in shard_dirs:
+        csv_path = os.path.join(shard_dir, results_file)
+        if not os.path.isfile(csv_path):
+            logging.error(f"Shard results {csv_path} don't exist, please recheck.")
+            exit(1)
+        shard_dfs.append(pd.read_csv(csv_path))
+
+    logging.info(f"Merging results of {len(shard_dirs)} shards")
+    return pd.concat(shard_dfs, ignore_index=True)
+
+
+def read_deck_variables(deck_path):
+    """
+    Get the variables a deck file assigns and the identifiers it uses, comments are skipped.
+
+    Returns
+    -------
+    tuple
+        Set of assigned variable names and set of used identifiers.
+    """
+    defined = set()
+    used = set()
+    with open(deck_path, "r") as f:
+        for line in f:
+            code = line.split("#")[0]
+            match = DECK_ASSIGNMENT.match(code)
+            if match:
+                defined.add(match.group(1))
+                code = code[match.end(1):]
+            used.update(DECK_IDENTIFIER.findall(code))
+
+    return defined, used
+
+
+def get_deck_dependencies(device_groups):
+    """
+    Map each device group to the rule deck files it exercises.
+
+    The files are taken from the include graph of sg13g2.lvs. A group uses its
+    own files (<group>_derivations/connections/extraction.lvs) and the general
+    and custom deck files, which are shared by all groups. Any deck file that
+    defines a variable used by one of these files is added as well, until no
+    more files are found, e.g. the RFMOS derivations use layers derived in
+    mos_derivations.lvs.
+
+    Parameters
+    ----------
+    device_groups : list of str
+        Names of the device groups, e.g. MOS.
+
+    Returns
+    -------
+    dict
+        Deck file paths relative to the LVS directory per device group.
+    """
+    groups = {g.lower() for g in device_groups}
+    shared_files = []
+    group_files = {g: [] for g in groups}
+    defined_in = dict()
+    used_by = dict()
+
+    for path in get_deck_files(os.path.join(LVS_DIR, "sg13g2.lvs")):
+        rel_path = os.path.relpath(path, LVS_DIR)
+        match = GROUP_DECK_PATTERN.match(os.path.basename(path))
+        if match and match.group(1) not in SHARED_DECK_PREFIXES:
+            if match.group(1) in groups:
+                group_files[match.group(1)].append(rel_path)
+        else:
+            shared_files.append(rel_path)
+
+        defined, used_by[rel_path] = read_deck_variables(path)
+        for name in defined:
+            defined_in.setdefault(name, set()).add(rel_path)
+
+    dependencies = dict()
+    for group, files in group_files.items():
+        deck_files = set(shared_files + files)
+        pending = list(deck_files)
+        while pending:
+            for name in used_by[pending.pop()]:
+                for path in defined_in.get(name, set()) - deck_files:
+                    deck_files.add(path)
+                    pending.append(path)
+        dependencies[group.upper()] = sorted(deck_files)
+
+    return dependencies
+
+
+def get_netlist_device_groups(netlist_path, devices_df):
+    """
+    Get the device groups of the devices used in a netlist.
+
+    Parameters
+    ----------
+    netlist_path : str or Path
+        Path of the netlist.
+    devices_df : pd.DataFrame
+        Devices of the rule decks, as given by parse_existing_devices.
+
+    Returns
+    -------
+    set
+        Device groups used by the netlist, all groups if no known device is found.
+    """
+    device_groups = dict(
+        zip(devices_df["device_name"].str.lower(), devices_df["device_group"])
+    )
+    with open(netlist_path, "r", errors="ignore") as f:
+        tokens = set(re.findall(r"[\w.]+", f.read().lower()))
+
+    groups = {device_groups[t] for t in tokens if t in device_groups}
+    return groups if groups else set(devices_df["device_group"])
+
+
+def get_test_fingerprint(input_files, deck_files):
+    """
+    Get the content hashes of everything a test case depends on.
+
+    Parameters
+    ----------
+    input_files : dict
+        Input files of the test case by role, e.g. layout, netlist, switches.
+        Files that don't exist are recorded as None.
+    deck_files : list of str
+        Rule deck files exercised by the test case, relative to the LVS directory.
+
+    Returns
+    -------
+    dict
+        Hashes of the test case inputs and rule deck files.
+    """
+    return {
+        "inputs": {
+            role: file_sha256(str(path)) if path and os.path.isfile(path) else None
+            for role, path in input_files.items()
+        },
+        "decks": {
+            rel_path: file_sha256(os.path.join(LVS_DIR, rel_path)) for rel_path in deck_files
+        },
+    }
+
+
+def get_selection_state_path(regression_name):
+    """
+    Get the path of the state file of change-aware runs of a regression.
+    """
+    return os.path.join(get_cache_dir("regression"), f"selection_{regression_name}.json")
+
+
+def load_selection_state(regression_name):
+    """
+    Load the fingerprints and status of the last run of each test case.
+
+    Parameters
+    ----------
+    regression_name : str
+        Name of the regression, e.g. unit or cells.
+
+    Returns
+    -------
+    dict
+        Last fingerprint and status per test name.
+    """
+    state_path = get_selection_state_path(regression_name)
+    if not os.path.isfile(state_path):
+        return dict()
+
+    try:
+        with open(state_path, "r") as f:
+            data = json.load(f)
+    except ValueError:
+        return dict()
+
+    if data.get("version") != SELECTION_STATE_VERSION:
+        return dict()
+
+    return data.get("tests", dict())
+
+
+def save_selection_state(regression_name, state):
+    """
+    Write the state file of change-aware runs, the file is replaced atomically.
+    """
+    state_path = get_selection_state_path(regression_name)
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": SELECTION_STATE_VERSION, "tests": state}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def get_change_reason(fingerprint, previous):
+    """
+    Explain why a test case has to run again, None if nothing changed since its last passing run.
+    """
+    if previous is None:
+        return "no previous run"
+    if previous["status"] != "Passed":
+        return "previous run failed"
+
+    reasons = []
+    old = previous["fingerprint"]
+    changed_inputs = [
+        role for role, digest in fingerprint["inputs"].items()
+        if old["inputs"].get(role) != digest
+    ]
+    if changed_inputs:
+        reasons.append("changed test case " + ", ".join(changed_inputs))
+
+    changed_decks = [
+        rel_path for rel_path in sorted(set(fingerprint["decks"]) | set(old["decks"]))
+        if fingerprint["decks"].get(rel_path) != old["decks"].get(rel_path)
+    ]
+    if changed_decks:
+        reasons.append("changed rule decks " + ", ".join(changed_decks))
+
+    return "; ".join(reasons) if reasons else None
+
+
+def select_changed_tests(tc_df, id_column, fingerprints, state):
+    """
+    Split test cases into the ones affected by changes and the ones that can be skipped.
+
+    Parameters
+    ----------
+    tc_df : pd.DataFrame
+        Test cases of the regression.
+    id_column : str
+        Column that holds the test name.
+    fingerprints : dict
+        Current fingerprint per test name, see get_test_fingerprint.
+    state : dict
+        State of previous runs, see load_selection_state.
+
+    Returns
+    -------
+    tuple of pd.DataFrame
+        Test cases to run and skipped test cases, both with a selection column
+        that tells why the test case is run or skipped.
+    """
+    reasons = [
+        get_change_reason(fingerprints[test_id], state.get(test_id))
+        for test_id in tc_df[id_column]
+    ]
+    tc_df = tc_df.copy()
+    tc_df["selection"] = [r if r else "unchanged since last passing run" for r in reasons]
+
+    run_mask = [r is not None for r in reasons]
+    run_df = tc_df[run_mask]
+    skipped_df = tc_df[[not m for m in run_mask]]
+
+    logging.info(
+        f"Change-aware selection: running {len(run_df)} test cases, skipping {len(skipped_df)}"
+    )
+    for test_id, reason in zip(run_df[id_column], run_df["selection"]):
+        logging.info(f"Running {test_id}: {reason}")
+    if len(skipped_df) > 0:
+        logging.info(
+            "Skipped test cases, unchanged since last passing run: \n"
+            + str(skipped_df[id_column].tolist())
+        )
+
+    return run_df, skipped_df
+
+
+def update_selection_state(state, results_df, id_column, status_column, fingerprints):
+    """
+    Record the fingerprints and status of finished test cases, updated in place.
+    """
+    for test_id, status in zip(results_df[id_column], results_df[status_column]):
+        if status in ["Passed", "Failed"]:
+            state[test_id] = {"status": status, "fingerprint": fingerprints[test_id]}
+
+
+def get_manifest_path(root_dir):
+    """
+    Get the path of the cached test case manifest of a directory.
+    """
+    dir_key = hashlib.sha256(os.path.abspath(root_dir).encode()).hexdigest()[:16]
+    return os.path.join(get_cache_dir("regression"), f"manifest_{dir_key}.json")
+
+
+def load_manifest(manifest_path, extensions):
+    """
+    Load a cached test case manifest if no directory changed since it was written.
+
+    Returns
+    -------
+    dict or None
+        File index of the manifest, None if it doesn't exist or is outdated.
+    """
+    if not os.path.isfile(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except ValueError:
+        return None
+
+    if manifest.get("version") != TESTCASE_MANIFEST_VERSION or manifest.get("extensions") != extensions:
+        return None
+
+    # Adding, removing or renaming a file changes the mtime of its directory
+    for dir_path, mtime_ns in manifest["dirs"].items():
+        try:
+            if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                return None
+        except OSError:
+            return None
+
+    return manifest["index"]
+
+
+def index_testcase_files(root_dir, extensions):
+    """
+    Index the test case files below a directory by exact file name.
+
+    The directory tree is walked once for all extensions. The index is kept in a
+    manifest in the local cache, which is reused until a directory in the tree changes.
+
+    Parameters
+    ----------
+    root_dir : str or Path
+        Directory of the test cases.
+    extensions : list of str
+        File extensions to index, e.g. ["gds", "cdl"].
+
+    Returns
+    -------
+    dict
+        For each extension, the file path per file name without extension. If a name
+        exists more than once, the file inside the directory of the same name is used.
+    """
+    root_dir = os.path.abspath(root_dir)
+    manifest_path = get_manifest_path(root_dir)
+
+    index = load_manifest(manifest_path, extensions)
+    if index is None:
+        index = {ext: dict() for ext in extensions}
+        dirs = dict()
+        suffixes = {f".{ext}": ext for ext in extensions}
+
+        for dir_path, _, file_names in os.walk(root_dir):
+            dirs[dir_path] = os.stat(dir_path).st_mtime_ns
+            for file_name in file_names:
+                stem, suffix = os.path.splitext(file_name)
+                ext = suffixes.get(suffix)
+                if ext is None:
+                    continue
+                path = os.path.join(dir_path, file_name)
+                if stem not in index[ext] or stem in Path(dir_path).parts:
+                    index[ext][stem] = path
+
+        manifest = {
+            "version": TESTCASE_MANIFEST_VERSION,
+            "extensions": extensions,
+            "dirs": dirs,
+            "index": index,
+        }
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    return {ext: {stem: Path(path) for stem, path in files.items()} for ext, files in index.items()}
+
+
+class ResultStream:
+    """
+    Stream results of finished test cases to JSON-lines and JUnit XML files.
+
+    Each result is appended to the JSON-lines file and flushed right away, so
+    it holds all finished results if the regression is aborted. The JUnit XML
+    file is written once when the stream is closed. Progress with passed, failed
+    and remaining test cases and the expected remaining time is logged for each result.
+
+    Parameters
+    ----------
+    output_path : str
+        Run directory of the regression.
+    suite_name : str
+        Name of the JUnit test suite.
+    total : int
+        Number of test cases that will run.
+    """
+
+    def __init__(self, output_path, suite_name, total):
+        self.suite_name = suite_name
+        self.total = total
+        self.jsonl_path = os.path.join(output_path, RESULTS_JSONL_FILE)
+        self.junit_path = os.path.join(output_path, RESULTS_JUNIT_FILE)
+        self.records = []
+        self.counts = {"Passed": 0, "Failed": 0, "exception": 0}
+        self.t0 = time.time()
+        self.jsonl_file = open(self.jsonl_path, "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, run_id, test_id, result, message=None):
+        """
+        Record the result of one finished test case.
+
+        Parameters
+        ----------
+        run_id : int
+            Run id of the test case.
+        test_id : str
+            Name of the test case.
+        result : dict
+            Result with status, run_time and peak_rss_mb.
+        message : str, optional
+            Error message of a test case that raised an exception.
+        """
+        record = {
+            "run_id": int(run_id),
+            "test_id": test_id,
+            "status": result["status"],
+            "run_time": result.get("run_time"),
+            "peak_rss_mb": result.get("peak_rss_mb"),
+            "message": message,
+            "finished": round(time.time() - self.t0, 3),
+        }
+        self.records.append(record)
+        self.counts[record["status"]] = self.counts.get(record["status"], 0) + 1
+
+        self.jsonl_file.write(json.dumps(record) + "\n")
+        self.jsonl_file.flush()
+        self.log_progress(record)
+
+    def log_progress(self, record):
+        """
+        Log the counters and expected remaining time after a finished test case.
+        """
+        done = len(self.records)
+        remaining = self.total - done
+        elapsed = time.time() - self.t0
+        eta = elapsed / done * remaining
+        logging.info(
+            f"[{done}/{self.total}] {record['test_id']}: {record['status']} | "
+            f"passed {self.counts['Passed']}, failed {self.counts['Failed']}, "
+            f"exceptions {self.counts['exception']}, remaining {remaining} | ETA {eta:.0f}s"
+        )
+
+    def write_junit(self):
+        """
+        Write all recorded results as JUnit XML.
+        """
+        suite = ElementTree.Element(
+            "testsuite",
+            name=self.suite_name,
+            tests=str(len(self.records)),
+            failures=str(self.counts["Failed"]),
+            errors=str(self.counts["exception"]),
+            time=f"{time.time() - self.t0:.3f}",
+        )
+        for record in self.records:
+            class_name, _, name = record["test_id"].rpartition("/")
+            case = ElementTree.SubElement(
+                suite,
+                "testcase",
+                classname=class_name.replace("/", ".") or self.suite_name,
+                name=name,
+                time=f"{record['run_time'] or 0:.3f}",
+            )
+            if record["status"] == "Failed":
+                ElementTree.SubElement(case, "failure", message="Netlists don't match")
+            elif record["status"] != "Passed":
+                ElementTree.SubElement(case, "error", message=record["message"] or record["status"])
+
+        tmp_path = f"{self.junit_path}.tmp"
+        ElementTree.ElementTree(suite).write(tmp_path, encoding="utf-8", xml_declaration=True)
+        os.replace(tmp_path, self.junit_path)
+
+    def results_df(self):
+        """
+        Get all recorded results as a DataFrame indexed by run id.
+        """
+        columns = ["run_id", "status", "run_time", "peak_rss_mb"]
+        return pd.DataFrame(self.records, columns=columns + ["test_id", "message", "finished"])[
+            columns
+        ]
+
+    def close(self):
+        """
+        Close the JSON-lines file and write the JUnit XML file.
+        """
+        if not self.jsonl_file.closed:
+            self.jsonl_file.close()
+            self.write_junit()
+
+
+def join_results(tc_df, results_df, status_column):
+    """
+    Join the streamed results to the test cases in one pass.
+
+    Parameters
+    ----------
+    tc_df : pd.DataFrame
+        Test cases with run_id column.
+    results_df : pd.DataFrame
+        Results as given by ResultStream.results_df.
+    status_column : str
+        Name of the status column in the joined table.
+
+    Returns
+    -------
+    pd.DataFrame
+        Test cases with status, run_time and peak_rss_mb columns. Test cases
+        without result get the status "no status".
+    """
+    df = tc_df.merge(
+        results_df.rename(columns={"status": status_column}), on="run_id", how="left"
+    )
+    df[status_column] = df[status_column].fillna("no status")
+    return df
@@ -20,18 +20,21 @@
 Usage:
     run_regression.py (--help| -h)
     run_regression.py [--device=<device>] [--run_dir=<run_dir_path>] [--mp=<num>]
+    [--shard=<i/N>] [--timing_db=<path>] [--changed_only] [--memory_budget=<GB>]
+    run_regression.py --merge=<shard_dirs> [--run_dir=<run_dir_path>]
 
 Options:
     --help -h                 Print this help message.
     --device=<device>         Select device category you want to run regression on.
     --run_dir=<run_dir_path>  Run directory to save all the results [default: pwd]
     --mp=<num>                The number of threads used in run.
+    --shard=<i/N>             Run only shard i of N shards, test cases are split by a hash of their name.
+    --timing_db=<path>        Timing database of previous runs.
+    --merge=<shard_dirs>      Comma separated run directories of shard runs to merge.
+    --changed_only            Run only test cases affected by changes since their last passing run.
+    --memory_budget=<GB>      Predicted memory of all parallel test cases, default is 80% of the available memory.
 """
 
-from subprocess import check_call
-import concurrent.futures
-import traceback
-import yaml
 from docopt import docopt
 import os
 from datetime import datetime
@@ -41,12 +44,42 @@ import logging
 import glob
 from pathlib import Path
 import errno
-import shutil
+from regression_utils import (
+    get_switches,
+    get_worker_pool,
+    run_test,
+    get_lvs_deck_hash,
+    get_timing_db_path,
+    load_timings,
+    save_timings,
+    update_timings,
+    schedule_tests,
+    select_shard,
+    parse_shard,
+    read_shard_results,
+    check_shard_results,
+    get_deck_dependencies,
+    get_test_fingerprint,
+    load_selection_state,
+    save_selection_state,
+    select_changed_tests,
+    update_selection_state,
+    ResultStream,
+    join_results,
+)
+from lvs_admission import (
+    AdmissionScheduler,
+    estimate_job_memory_mb,
+    get_memory_budget_mb,
+    load_memory_history,
+    record_peak_memory,
+)
 
 # CONSTANTS
 SUPPORTED_TC_EXT = "gds"
 SUPPORTED_SPICE_EXT = "cdl"
 SUPPORTED_SW_EXT = "yaml"
+SHARD_RESULTS_FILE = "shard_test_cases_results.csv"
 
 
 def parse_existing_devices(rule_deck_path, output_path, target_device_group=None):
@@ -157,6 +190,7 @@ def build_tests_dataframe(unit_test_cases_dir, target_device_group):
     tc_df["device_group"] = tc_df["test_layout_path"].apply(
         lambda x: x.parent.parent.name.replace("_devices", "").upper()
     )
+    tc_df["test_id"] = "unit/" + tc_df["device_group"] + "/" + tc_df["device_name"]
 
     if target_device_group is not None:
         tc_df = tc_df[tc_df["device_group"] == target_device_group]
@@ -168,42 +202,55 @@ def build_tests_dataframe(unit_test_cases_dir, target_device_group):
     return tc_df
 
 
-def get_switches(yaml_file, rule_name):
-    """Parse yaml file and extract switches data
+def get_test_fingerprints(tc_df):
+    """
+    Get the fingerprint of each test case for change-aware runs.
+
+    Each unit test case depends on its layout, netlist, switches and the rule
+    decks of its device group.
+
     Parameters
     ----------
-    yaml_file : str
-            yaml config file path given py the user.
+    tc_df : pd.DataFrame
+        DataFrame that holds all the test cases information for running.
+
     Returns
     -------
-    yaml_dic : dictionary
-            dictionary containing switches data.
+    dict
+        Fingerprint per test name.
     """
+    deck_deps = get_deck_dependencies(tc_df["device_group"].unique())
 
-    # load yaml config data
-    with open(yaml_file, "r") as stream:
-        try:
-            yaml_dic = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+    fingerprints = dict()
+    for _, row in tc_df.iterrows():
+        sw_file = os.path.join(
+            Path(row["test_layout_path"].parent).absolute(),
+            f"{row['device_name']}.{SUPPORTED_SW_EXT}",
+        )
+        input_files = {
+            "layout": row["test_layout_path"],
+            "netlist": row["test_netlist_path"],
+            "switches": sw_file,
+        }
+        fingerprints[row["test_id"]] = get_test_fingerprint(
+            input_files, deck_deps[row["device_group"]]
+        )
 
-    return [f"{param}={value}" for param, value in yaml_dic[rule_name].items()]
+    return fingerprints
 
 
 def run_test_case(
-    lvs_dir,
     layout_path,
     netlist_path,
     run_dir,
     device_name,
+    memory_limit_mb=None,
 ):
     """
-    This function run a single test case using the correct LVS file.
+    This function run a single test case in a worker thread, on the test case files in place.
 
     Parameters
     ----------
-    lvs_dir : string or Path
-        Path to the location where all runsets exist.
     layout_path : stirng or Path object
         Path string to the layout of the test pattern we want to test.
     netlist_path : stirng or Path object
@@ -212,11 +259,13 @@ def run_test_case(
         Path to the location where is the regression run is done.
     device_name : string
         Device name that we are running on.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory.
 
     Returns
     -------
     dict
-        A dict with all rule counts
+        A dict with the device status, run time and peak memory.
     """
 
     # Get switches used for each run
@@ -226,61 +275,16 @@ def run_test_case(
 
     # Switches setup
     if os.path.exists(sw_file):
-        switches = " ".join(get_switches(sw_file, device_name))
+        options = get_switches(sw_file, device_name)
     else:
-        # Get switches
-        switches = ""  # default switch
+        options = dict()  # default switch
 
-    # Creating run folder structure and copy testcases in it
-    pattern_clean = ".".join(os.path.basename(layout_path).split(".")[:-1])
     output_loc = os.path.join(run_dir, device_name)
-    pattern_log = os.path.join(output_loc, f"{pattern_clean}_lvs.log")
-    os.makedirs(output_loc, exist_ok=True)
-    layout_path_run = os.path.join(run_dir, device_name, f"{device_name}.gds")
-    netlist_path_run = os.path.join(run_dir, device_name, f"{device_name}.cdl")
-    shutil.copyfile(layout_path, layout_path_run)
-    shutil.copyfile(netlist_path, netlist_path_run)
-
-    # command to run LVS
-    call_str = (
-        f"python3 {lvs_dir}/run_lvs.py --layout={layout_path_run} "
-        f"--netlist={netlist_path_run} --run_dir={output_loc} {switches} > {pattern_log} 2>&1"
-    )
-
-    # Starting klayout run
-    try:
-        check_call(call_str, shell=True)
-    except Exception as e:
-        pattern_results = glob.glob(os.path.join(output_loc, f"{pattern_clean}*.lvsdb"))
-        if len(pattern_results) < 1:
-            logging.error("%s generated an exception: %s" % (pattern_clean, e))
-            traceback.print_exc()
-            raise Exception("Failed LVS run.")
-
-    # dumping log into output to make CI have the log
-    if os.path.isfile(pattern_log):
-        with open(pattern_log, "r") as f:
-            result = f.read()
-            for line in f:
-                line = line.strip()
-                logging.info(f"{line}")
-
-        # checking device status
-        device_status = "Failed"
-        if "Congratulations! Netlists match" in result:
-            logging.info(f"{device_name} testcase passed")
-            device_status = "Passed"
-        else:
-            logging.error(f"{device_name} testcase failed.")
-            logging.error(f"Please recheck {layout_path} file.")
-    else:
-        logging.error("Klayout LVS run failed, there is no log file is generated")
-        exit(1)
 
-    return device_status
+    return run_test(layout_path, netlist_path, output_loc, device_name, options, memory_limit_mb)
 
 
-def run_all_test_cases(tc_df, lvs_dir, run_dir, num_workers):
+def run_all_test_cases(tc_df, run_dir, num_workers, memory_budget=None):
     """
     This function run all test cases from the input dataframe.
 
@@ -288,12 +292,12 @@ def run_all_test_cases(tc_df, lvs_dir, run_dir, num_workers):
     ----------
     tc_df : pd.DataFrame
         DataFrame that holds all the test cases information for running.
-    lvs_dir : string or Path
-        Path string to the location of the lvs runsets.
     run_dir : string or Path
         Path string to the location of the testing code and output.
     num_workers : int
-        Number of workers to use for running the regression.
+        Number of test cases to run in parallel.
+    memory_budget : float, optional
+        Memory budget in GB for all running test cases, default is a part of the available memory.
 
     Returns
     -------
@@ -301,32 +305,54 @@ def run_all_test_cases(tc_df, lvs_dir, run_dir, num_workers):
         A pandas DataFrame with all test cases information post running.
     """
 
-    tc_df["device_status"] = "no status"
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        future_to_run_id = dict()
-        for _, row in tc_df.iterrows():
-            future_to_run_id[
-                executor.submit(
-                    run_test_case,
-                    lvs_dir,
-                    row["test_layout_path"],
-                    row["test_netlist_path"],
-                    run_dir,
-                    row["device_name"],
-                )
-            ] = row["run_id"]
+    # Test cases only start while their predicted memory fits into the budget
+    budget_mb = get_memory_budget_mb(memory_budget)
+    memory_history = load_memory_history()
+    jobs = [
+        {
+            "run_id": row["run_id"],
+            "test_id": row["test_id"],
+            "layout_path": row["test_layout_path"],
+            "netlist_path": row["test_netlist_path"],
+            "name": row["device_name"],
+            "topcell": None,
+            "memory_mb": estimate_job_memory_mb(
+                str(row["test_layout_path"]), None, None, memory_history
+            ),
+        }
+        for _, row in tc_df.iterrows()
+    ]
+
+    with get_worker_pool(num_workers) as executor, ResultStream(
+        run_dir, "unit", len(tc_df)
+    ) as stream:
 
-        for future in concurrent.futures.as_completed(future_to_run_id):
-            run_id = future_to_run_id[future]
+        def on_result(job, future):
+            message = None
             try:
-                tc_df.loc[tc_df["run_id"] == run_id, "device_status"] = future.result()
+                result = future.result()
+                record_peak_memory(
+                    str(job["layout_path"]), job["topcell"], None, result["peak_rss_mb"]
+                )
             except Exception as exc:
-                logging.error("%d generated an exception: %s" % (run_id, exc))
-                traceback.print_exc()
-                tc_df.loc[tc_df["run_id"] == run_id, "device_status"] = "exception"
+                logging.error("%d generated an exception: %s" % (job["run_id"], exc))
+                result, message = {"status": "exception"}, str(exc)
+            stream.record(job["run_id"], job["test_id"], result, message)
+
+        AdmissionScheduler(budget_mb, num_workers).run(
+            jobs,
+            lambda job, limit_mb: executor.submit(
+                run_test_case,
+                job["layout_path"],
+                job["netlist_path"],
+                run_dir,
+                job["name"],
+                limit_mb,
+            ),
+            on_result,
+        )
 
-    return tc_df
+    return join_results(tc_df, stream.results_df(), "device_status")
 
 
 def aggregate_results(results_df: pd.DataFrame, devices_df: pd.DataFrame):
@@ -362,7 +388,49 @@ def aggregate_results(results_df: pd.DataFrame, devices_df: pd.DataFrame):
     return df
 
 
-def run_regression(lvs_dir, output_path, target_device_group, cpu_count):
+def check_results(df: pd.DataFrame, output_path):
+    """
+    Write the final results table and check for failing test cases.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Final results table.
+    output_path : str
+        Path string to the location of the output results of the run.
+
+    Returns
+    -------
+    bool
+        If all regression passed, it returns true. If any of the devices failed it returns false.
+    """
+    logging.info("Final analysis table: \n" + str(df))
+
+    # Generate error if there are any missing info or fails.
+    df.to_csv(os.path.join(output_path, "all_test_cases_results.csv"), index=False)
+
+    # Check if there any device that generated failure
+    failing_results = df[~df["device_status"].isin(["Passed"])]
+    logging.info("Failing test cases: \n" + str(failing_results))
+
+    if len(failing_results) > 0:
+        logging.error("Some test cases failed .....")
+        return False
+    else:
+        logging.info("All testcases passed.")
+        return True
+
+
+def run_regression(
+    lvs_dir,
+    output_path,
+    target_device_group,
+    cpu_count,
+    shard=None,
+    timing_db=None,
+    changed_only=False,
+    memory_budget=None,
+):
     """
     Runs the full regression on all test cases.
 
@@ -376,6 +444,14 @@ def run_regression(lvs_dir, output_path, target_device_group, cpu_count):
         Name of device group that we want to run regression for. If None, run all found.
     cpu_count : int
         Number of cpu cores to be used in running testcases.
+    shard : str or None
+        Shard i/N to run. If None, run all test cases.
+    timing_db : str or None
+        Path of the timing database. If None, the local cache is used.
+    changed_only : bool
+        Run only test cases affected by changes since their last passing run.
+    memory_budget : float or None
+        Memory budget in GB for all running test cases. If None, a part of the available memory is used.
     Returns
     -------
     bool
@@ -396,29 +472,83 @@ def run_regression(lvs_dir, output_path, target_device_group, cpu_count):
     logging.info("Total table gds files found: {}".format(len(tc_df)))
     logging.info("Found testcases: \n" + str(tc_df))
 
+    # Shards are selected by test name, before any state of previous runs is used
+    if shard:
+        tc_df = select_shard(tc_df, "test_id", shard, output_path)
+
+    # Skip test cases whose inputs and rule decks didn't change since they passed
+    fingerprints = get_test_fingerprints(tc_df)
+    selection_state = load_selection_state("unit")
+    skipped_df = tc_df.iloc[0:0]
+    if changed_only:
+        tc_df, skipped_df = select_changed_tests(tc_df, "test_id", fingerprints, selection_state)
+
+    # Longest test cases first, based on previous runs with the same rule decks
+    timing_db_path = get_timing_db_path(timing_db)
+    timings = load_timings(timing_db_path)
+    deck_hash = get_lvs_deck_hash()
+    tc_df = schedule_tests(tc_df, "test_id", timings, deck_hash)
+
     # Run all test cases.
-    results_df = run_all_test_cases(tc_df, lvs_dir, output_path, cpu_count)
+    results_df = run_all_test_cases(tc_df, output_path, cpu_count, memory_budget)
     logging.info("Testcases found results: \n" + str(results_df))
 
+    update_timings(timings, results_df, "test_id", "device_status", deck_hash)
+    save_timings(timing_db_path, timings)
+    update_selection_state(selection_state, results_df, "test_id", "device_status", fingerprints)
+    save_selection_state("unit", selection_state)
+
+    # Skipped test cases keep the status of their last passing run
+    if len(skipped_df) > 0:
+        skipped_df = skipped_df.assign(device_status="Passed")
+        results_df = pd.concat([results_df, skipped_df], ignore_index=True)
+
+    # Devices without test cases are only checked when the shards are merged
+    if shard:
+        results_df.drop("run_id", axis=1).to_csv(
+            os.path.join(output_path, SHARD_RESULTS_FILE), index=False
+        )
+        df = results_df.copy()
+        df.loc[(df["device_status"] != "Passed"), "device_status"] = "Failed"
+        df.drop("run_id", inplace=True, axis=1)
+        return check_results(df, output_path)
+
     # Aggregate all dataframe into one
     df = aggregate_results(results_df, devices_df)
     df.drop_duplicates(inplace=True)
     df.drop("run_id", inplace=True, axis=1)
-    logging.info("Final analysis table: \n" + str(df))
 
-    # Generate error if there are any missing info or fails.
-    df.to_csv(os.path.join(output_path, "all_test_cases_results.csv"), index=False)
+    return check_results(df, output_path)
 
-    # Check if there any device that generated failure
-    failing_results = df[~df["device_status"].isin(["Passed"])]
-    logging.info("Failing test cases: \n" + str(failing_results))
 
-    if len(failing_results) > 0:
-        logging.error("Some test cases failed .....")
-        return False
-    else:
-        logging.info("All testcases passed.")
-        return True
+def merge_shards(shard_dirs, output_path):
+    """
+    Merge the results of shard runs into the results of the full regression.
+
+    Parameters
+    ----------
+    shard_dirs : list of str
+        Run directories of the shard runs.
+    output_path : str
+        Path string to the location of the merged results.
+
+    Returns
+    -------
+    bool
+        If all regression passed, it returns true. If any of the devices failed it returns false.
+    """
+    results_df = read_shard_results(shard_dirs, SHARD_RESULTS_FILE)
+    devices_df = pd.concat(
+        [pd.read_csv(os.path.join(d, "rule_deck_devices.csv")) for d in shard_dirs]
+    ).drop_duplicates()
+    devices_df.to_csv(os.path.join(output_path, "rule_deck_devices.csv"), index=False)
+
+    complete = check_shard_results(shard_dirs, results_df, "test_id")
+
+    df = aggregate_results(results_df, devices_df)
+    df.drop_duplicates(inplace=True)
+
+    return check_results(df, output_path) and complete
 
 
 def main(lvs_dir, output_path, target_device_group):
@@ -450,7 +580,20 @@ def main(lvs_dir, output_path, target_device_group):
     t0 = time.time()
 
     # Calling regression function
-    run_status = run_regression(lvs_dir, output_path, target_device_group, cpu_count)
+    if args["--merge"]:
+        shard_dirs = [os.path.abspath(d) for d in args["--merge"].split(",") if d]
+        run_status = merge_shards(shard_dirs, output_path)
+    else:
+        run_status = run_regression(
+            lvs_dir,
+            output_path,
+            target_device_group,
+            cpu_count,
+            args["--shard"],
+            args["--timing_db"],
+            args["--changed_only"],
+            args["--memory_budget"],
+        )
 
     #  End of execution time
     logging.info("Total execution time {}s".format(time.time() - t0))
@@ -511,5 +654,13 @@ if __name__ == "__main__":
         )
         exit(1)
 
+    # selected shard
+    if args["--shard"]:
+        try:
+            parse_shard(args["--shard"])
+        except ValueError as e:
+            logging.error(e)
+            exit(1)
+
     # Calling main function
     run_status = main(lvs_dir, output_path, target_device_group)
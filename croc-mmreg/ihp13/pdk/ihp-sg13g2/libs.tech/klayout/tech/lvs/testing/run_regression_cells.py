@@ -20,33 +20,70 @@
 Usage:
     run_regression_cells.py (--help| -h)
     run_regression_cells.py [--cell=<cell>] [--run_dir=<run_dir_path>] [--mp=<num>]
+    [--shard=<i/N>] [--timing_db=<path>] [--changed_only] [--memory_budget=<GB>]
+    run_regression_cells.py --merge=<shard_dirs> [--run_dir=<run_dir_path>]
 
 Options:
     --help -h                 Print this help message.
     --cell=<cell>             Specify the cell to run; all cells run if not specified.
     --run_dir=<run_dir_path>  Run directory to save all the results [default: pwd]
     --mp=<num>                The number of threads used in run.
+    --shard=<i/N>             Run only shard i of N shards, test cases are split by a hash of their name.
+    --timing_db=<path>        Timing database of previous runs.
+    --merge=<shard_dirs>      Comma separated run directories of shard runs to merge.
+    --changed_only            Run only test cases affected by changes since their last passing run.
+    --memory_budget=<GB>      Predicted memory of all parallel test cases, default is 80% of the available memory.
 """
 
-from subprocess import check_call
-import concurrent.futures
-import traceback
-import yaml
 from docopt import docopt
 import os
 from datetime import datetime
 import time
 import pandas as pd
 import logging
-import glob
 from pathlib import Path
-import shutil
+from regression_utils import (
+    get_switches,
+    get_worker_pool,
+    run_test,
+    get_lvs_deck_hash,
+    get_timing_db_path,
+    load_timings,
+    save_timings,
+    update_timings,
+    schedule_tests,
+    select_shard,
+    parse_shard,
+    read_shard_results,
+    check_shard_results,
+    get_deck_dependencies,
+    get_netlist_device_groups,
+    get_test_fingerprint,
+    load_selection_state,
+    save_selection_state,
+    select_changed_tests,
+    update_selection_state,
+    ResultStream,
+    join_results,
+    index_testcase_files,
+)
+from lvs_admission import (
+    AdmissionScheduler,
+    estimate_job_memory_mb,
+    get_memory_budget_mb,
+    load_memory_history,
+    record_peak_memory,
+)
+from run_regression import parse_existing_devices
 
 # CONSTANTS
 SUPPORTED_TC_EXT = "gds"
 SUPPORTED_SPICE_EXT = "cdl"
 SUPPORTED_SW_EXT = "yaml"
 
+# Each cell is tested as is and with isolated and digital substrate switches
+CELL_VARIANTS = ["", "_iso", "_digisub"]
+
 
 def build_tests_dataframe(cells_dir, target_cell, cells):
     """
@@ -67,30 +104,16 @@ def build_tests_dataframe(cells_dir, target_cell, cells):
         A DataFrame that has all the targeted test cases that we need to run.
     """
 
-    # Construct df that holds all info
-    tc_df = pd.DataFrame({"cell_name": cells})
-
-    all_cells_layout = sorted(Path(cells_dir).rglob("*.{}".format(SUPPORTED_TC_EXT)))
-    all_cells_netlist = sorted(
-        Path(cells_dir).rglob("*.{}".format(SUPPORTED_SPICE_EXT))
-    )
+    # Exact name index of all test case files, built in one pass
+    index = index_testcase_files(cells_dir, [SUPPORTED_TC_EXT, SUPPORTED_SPICE_EXT])
 
-    # Mapping cell names to paths for both layout and netlist files
-    cell_paths = {
-        cell_name: {
-            "layout_path": next(
-                (path for path in all_cells_layout if cell_name in str(path)), None
-            ),
-            "netlist_path": next(
-                (path for path in all_cells_netlist if cell_name in str(path)), None
-            ),
+    # Construct df that holds all info
+    tc_df = pd.DataFrame(
+        {
+            "cell_name": cells,
+            "layout_path": [index[SUPPORTED_TC_EXT].get(c) for c in cells],
+            "netlist_path": [index[SUPPORTED_SPICE_EXT].get(c) for c in cells],
         }
-        for cell_name in tc_df["cell_name"]
-    }
-
-    # Adding paths to new columns in the DataFrame
-    tc_df[["layout_path", "netlist_path"]] = tc_df["cell_name"].apply(
-        lambda x: pd.Series(cell_paths[x])
     )
 
     # Print warning for cells without layout or netlist path
@@ -119,57 +142,74 @@ def build_tests_dataframe(cells_dir, target_cell, cells):
     logging.info("Total cells found: {}".format(len(tc_df)))
     logging.info("Found cells: \n" + str(tc_df["cell_name"]))
 
-    tc_df["run_id"] = range(len(tc_df))
-
-    # Duplicate the original cells for iso/digisub
-    iso_df = tc_df.copy()
-    sub_df = tc_df.copy()
-
-    # Add the suffix to each cell in the column
-    iso_df["cell_name"] = iso_df["cell_name"] + "_iso"
-    sub_df["cell_name"] = sub_df["cell_name"] + "_digisub"
-
-    # Concatenate the original DataFrame with the modified DataFrame
-    final_df = pd.concat([tc_df, iso_df, sub_df])
-    final_df.reset_index(drop=True, inplace=True)
+    # Add the iso/digisub variants of the cells
+    final_df = pd.concat(
+        [tc_df.assign(cell_name=tc_df["cell_name"] + suffix) for suffix in CELL_VARIANTS],
+        ignore_index=True,
+    )
 
     final_df["run_id"] = range(len(final_df))
+    final_df["test_id"] = "cells/" + final_df["cell_name"]
 
     return final_df
 
 
-def get_switches(yaml_file, rule_name):
-    """Parse yaml file and extract switches data
+def get_test_fingerprints(lvs_dir, output_path, tc_df):
+    """
+    Get the fingerprint of each test case for change-aware runs.
+
+    Each cell test case depends on its layout, netlist, switches and the rule
+    decks of the device groups used in its netlist.
+
     Parameters
     ----------
-    yaml_file : str
-            yaml config file path given py the user.
+    lvs_dir : string
+        Path string to the LVS directory where all the LVS files are located.
+    output_path : str
+        Path string to the location of the output results of the run.
+    tc_df : pd.DataFrame
+        DataFrame that holds all the test cases information for running.
+
     Returns
     -------
-    yaml_dic : dictionary
-            dictionary containing switches data.
+    dict
+        Fingerprint per test name.
     """
+    devices_df = parse_existing_devices(lvs_dir, output_path)
+    deck_deps = get_deck_dependencies(devices_df["device_group"].unique())
+
+    fingerprints = dict()
+    netlist_groups = dict()
+    for _, row in tc_df.iterrows():
+        netlist_path = row["netlist_path"]
+        if netlist_path not in netlist_groups:
+            netlist_groups[netlist_path] = get_netlist_device_groups(netlist_path, devices_df)
+        deck_files = sorted(
+            {f for group in netlist_groups[netlist_path] for f in deck_deps[group]}
+        )
 
-    # load yaml config data
-    with open(yaml_file, "r") as stream:
-        try:
-            yaml_dic = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+        sw_file = os.path.join(
+            Path(row["layout_path"].parent).absolute(),
+            f"{row['cell_name']}.{SUPPORTED_SW_EXT}",
+        )
+        input_files = {
+            "layout": row["layout_path"],
+            "netlist": netlist_path,
+            "switches": sw_file,
+        }
+        fingerprints[row["test_id"]] = get_test_fingerprint(input_files, deck_files)
 
-    return [f"{param}={value}" for param, value in yaml_dic[rule_name].items()]
+    return fingerprints
 
 
 def run_test_case(
-    lvs_dir, layout_path, netlist_path, run_dir, cell_name,
+    layout_path, netlist_path, run_dir, cell_name, memory_limit_mb=None,
 ):
     """
-    This function run a single test case using the correct DRC file.
+    This function run a single test case in a worker thread, on the test case files in place.
 
     Parameters
     ----------
-    lvs_dir : string or Path
-        Path to the location where all runsets exist.
     layout_path : stirng or Path object
         Path string to the layout of the test pattern we want to test.
     netlist_path : stirng or Path object
@@ -178,11 +218,13 @@ def run_test_case(
         Path to the location where is the regression run is done.
     cell_name : string
         Cell name that we are running on.
+    memory_limit_mb : float, optional
+        Kill klayout if it uses more memory.
 
     Returns
     -------
     dict
-        A dict with all rule counts
+        A dict with the cell status, run time and peak memory.
     """
 
     # Get switches used for each run
@@ -192,61 +234,17 @@ def run_test_case(
 
     # Switches setup
     if os.path.exists(sw_file):
-        switches = " ".join(get_switches(sw_file, cell_name))
+        options = get_switches(sw_file, cell_name)
     else:
-        # Get switches
-        switches = ""  # default switch
+        options = dict()  # default switch
+    options["--topcell"] = cell_name
 
-    # Creating run folder structure and copy testcases in it
-    pattern_clean = ".".join(os.path.basename(layout_path).split(".")[:-1])
     output_loc = os.path.join(run_dir, cell_name)
-    pattern_log = os.path.join(output_loc, f"{pattern_clean}_lvs.log")
-    os.makedirs(output_loc, exist_ok=True)
-    layout_path_run = os.path.join(run_dir, cell_name, f"{cell_name}.gds")
-    netlist_path_run = os.path.join(run_dir, cell_name, f"{cell_name}.cdl")
-    shutil.copyfile(layout_path, layout_path_run)
-    shutil.copyfile(netlist_path, netlist_path_run)
-
-    # command to run LVS
-    call_str = (
-        f"python3 {lvs_dir}/run_lvs.py --layout={layout_path_run} --topcell={cell_name} "
-        f"--netlist={netlist_path_run} --run_dir={output_loc} {switches} > {pattern_log} 2>&1"
-    )
-
-    # Starting klayout run
-    try:
-        check_call(call_str, shell=True)
-    except Exception as e:
-        pattern_results = glob.glob(os.path.join(output_loc, f"{pattern_clean}*.lvsdb"))
-        if len(pattern_results) < 1:
-            logging.error("%s generated an exception: %s" % (pattern_clean, e))
-            traceback.print_exc()
-            raise Exception("Failed LVS run.")
-
-    # dumping log into output to make CI have the log
-    if os.path.isfile(pattern_log):
-        with open(pattern_log, "r") as f:
-            result = f.read()
-            for line in f:
-                line = line.strip()
-                logging.info(f"{line}")
-
-        # checking device status
-        cell_status = "Failed"
-        if "Congratulations! Netlists match" in result:
-            logging.info(f"{cell_name} testcase passed")
-            cell_status = "Passed"
-        else:
-            logging.error(f"{cell_name} testcase failed.")
-            logging.error(f"Please recheck {layout_path} and {netlist_path} files.")
-    else:
-        logging.error("Klayout LVS run failed, there is no log file is generated")
-        exit(1)
 
-    return cell_status
+    return run_test(layout_path, netlist_path, output_loc, cell_name, options, memory_limit_mb)
 
 
-def run_all_test_cases(tc_df: pd.DataFrame, lvs_dir, run_dir, num_workers):
+def run_all_test_cases(tc_df: pd.DataFrame, run_dir, num_workers, memory_budget=None):
     """
     This function run all test cases from the input dataframe.
 
@@ -254,12 +252,12 @@ def run_all_test_cases(tc_df: pd.DataFrame, lvs_dir, run_dir, num_workers):
     ----------
     tc_df : pd.DataFrame
         DataFrame that holds all the test cases information for running.
-    lvs_dir : string or Path
-        Path string to the location of the lvs runsets.
     run_dir : string or Path
         Path string to the location of the testing code and output.
     num_workers : int
-        Number of workers to use for running the regression.
+        Number of test cases to run in parallel.
+    memory_budget : float, optional
+        Memory budget in GB for all running test cases, default is a part of the available memory.
 
     Returns
     -------
@@ -267,35 +265,103 @@ def run_all_test_cases(tc_df: pd.DataFrame, lvs_dir, run_dir, num_workers):
         A pandas DataFrame with all test cases information post running.
     """
 
-    tc_df["cell_status"] = "no status"
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        future_to_run_id = dict()
-        for _, row in tc_df.iterrows():
-            future_to_run_id[
-                executor.submit(
-                    run_test_case,
-                    lvs_dir,
-                    row["layout_path"],
-                    row["netlist_path"],
-                    run_dir,
-                    row["cell_name"],
-                )
-            ] = row["run_id"]
+    # Test cases only start while their predicted memory fits into the budget
+    budget_mb = get_memory_budget_mb(memory_budget)
+    memory_history = load_memory_history()
+    jobs = [
+        {
+            "run_id": row["run_id"],
+            "test_id": row["test_id"],
+            "layout_path": row["layout_path"],
+            "netlist_path": row["netlist_path"],
+            "name": row["cell_name"],
+            "topcell": row["cell_name"],
+            "memory_mb": estimate_job_memory_mb(
+                str(row["layout_path"]), row["cell_name"], None, memory_history
+            ),
+        }
+        for _, row in tc_df.iterrows()
+    ]
 
-        for future in concurrent.futures.as_completed(future_to_run_id):
-            run_id = future_to_run_id[future]
+    with get_worker_pool(num_workers) as executor, ResultStream(
+        run_dir, "cells", len(tc_df)
+    ) as stream:
+
+        def on_result(job, future):
+            message = None
             try:
-                tc_df.loc[tc_df["run_id"] == run_id, "cell_status"] = future.result()
+                result = future.result()
+                record_peak_memory(
+                    str(job["layout_path"]), job["topcell"], None, result["peak_rss_mb"]
+                )
             except Exception as exc:
-                logging.error("%d generated an exception: %s" % (run_id, exc))
-                traceback.print_exc()
-                tc_df.loc[tc_df["run_id"] == run_id, "cell_status"] = "exception"
+                logging.error("%d generated an exception: %s" % (job["run_id"], exc))
+                result, message = {"status": "exception"}, str(exc)
+            stream.record(job["run_id"], job["test_id"], result, message)
+
+        AdmissionScheduler(budget_mb, num_workers).run(
+            jobs,
+            lambda job, limit_mb: executor.submit(
+                run_test_case,
+                job["layout_path"],
+                job["netlist_path"],
+                run_dir,
+                job["name"],
+                limit_mb,
+            ),
+            on_result,
+        )
 
-    return tc_df
+    return join_results(tc_df, stream.results_df(), "cell_status")
 
 
-def run_regression(lvs_dir, cells_dir, output_path, target_cell, cpu_count, cells):
+def check_results(results_df: pd.DataFrame, output_path):
+    """
+    Write the final results table and check for failing test cases.
+
+    Parameters
+    ----------
+    results_df : pd.DataFrame
+        Final results table.
+    output_path : str
+        Path string to the location of the output results of the run.
+
+    Returns
+    -------
+    bool
+        If all regression passed, it returns true. If any of the cells failed it returns false.
+    """
+    logging.info("Final results table: \n" + str(results_df))
+
+    # Generate error if there are any missing info or fails.
+    results_df.to_csv(
+        os.path.join(output_path, "all_test_cases_results.csv"), index=False
+    )
+
+    # Check if there any cell that generated failure
+    failing_results = results_df[~results_df["cell_status"].isin(["Passed"])]
+    logging.info("Failing test cases: \n" + str(failing_results))
+
+    if len(failing_results) > 0:
+        logging.error("Some test cases failed .....")
+        return False
+    else:
+        logging.info("All testcases passed.")
+        return True
+
+
+def run_regression(
+    lvs_dir,
+    cells_dir,
+    output_path,
+    target_cell,
+    cpu_count,
+    cells,
+    shard=None,
+    timing_db=None,
+    changed_only=False,
+    memory_budget=None,
+):
     """
     Runs the full regression for std cells.
 
@@ -313,6 +379,14 @@ def run_regression(lvs_dir, cells_dir, output_path, target_cell, cpu_count, cell
         Number of cpu cores to be used in running testcases.
     cells : list
         List that holds all available cells will be tested.
+    shard : str or None
+        Shard i/N to run. If None, run all test cases.
+    timing_db : str or None
+        Path of the timing database. If None, the local cache is used.
+    changed_only : bool
+        Run only test cases affected by changes since their last passing run.
+    memory_budget : float or None
+        Memory budget in GB for all running test cases. If None, a part of the available memory is used.
     Returns
     -------
     bool
@@ -322,27 +396,62 @@ def run_regression(lvs_dir, cells_dir, output_path, target_cell, cpu_count, cell
     # Get all test cases available in the repo.
     tc_df = build_tests_dataframe(cells_dir, target_cell, cells)
 
+    # Shards are selected by test name, before any state of previous runs is used
+    if shard:
+        tc_df = select_shard(tc_df, "test_id", shard, output_path)
+
+    # Skip test cases whose inputs and rule decks didn't change since they passed
+    fingerprints = get_test_fingerprints(lvs_dir, output_path, tc_df)
+    selection_state = load_selection_state("cells")
+    skipped_df = tc_df.iloc[0:0]
+    if changed_only:
+        tc_df, skipped_df = select_changed_tests(tc_df, "test_id", fingerprints, selection_state)
+
+    # Longest test cases first, based on previous runs with the same rule decks
+    timing_db_path = get_timing_db_path(timing_db)
+    timings = load_timings(timing_db_path)
+    deck_hash = get_lvs_deck_hash()
+    tc_df = schedule_tests(tc_df, "test_id", timings, deck_hash)
+
     # Run all test cases.
-    results_df = run_all_test_cases(tc_df, lvs_dir, output_path, cpu_count)
+    results_df = run_all_test_cases(tc_df, output_path, cpu_count, memory_budget)
+
+    update_timings(timings, results_df, "test_id", "cell_status", deck_hash)
+    save_timings(timing_db_path, timings)
+    update_selection_state(selection_state, results_df, "test_id", "cell_status", fingerprints)
+    save_selection_state("cells", selection_state)
+
+    # Skipped test cases keep the status of their last passing run
+    if len(skipped_df) > 0:
+        skipped_df = skipped_df.assign(cell_status="Passed")
+        results_df = pd.concat([results_df, skipped_df], ignore_index=True)
+
     results_df.drop_duplicates(inplace=True)
     results_df.drop("run_id", inplace=True, axis=1)
-    logging.info("Final results table: \n" + str(results_df))
 
-    # Generate error if there are any missing info or fails.
-    results_df.to_csv(
-        os.path.join(output_path, "all_test_cases_results.csv"), index=False
-    )
+    return check_results(results_df, output_path)
 
-    # Check if there any cell that generated failure
-    failing_results = results_df[~results_df["cell_status"].isin(["Passed"])]
-    logging.info("Failing test cases: \n" + str(failing_results))
 
-    if len(failing_results) > 0:
-        logging.error("Some test cases failed .....")
-        return False
-    else:
-        logging.info("All testcases passed.")
-        return True
+def merge_shards(shard_dirs, output_path):
+    """
+    Merge the results of shard runs into the results of the full regression.
+
+    Parameters
+    ----------
+    shard_dirs : list of str
+        Run directories of the shard runs.
+    output_path : str
+        Path string to the location of the merged results.
+
+    Returns
+    -------
+    bool
+        If all regression passed, it returns true. If any of the cells failed it returns false.
+    """
+    results_df = read_shard_results(shard_dirs, "all_test_cases_results.csv")
+    complete = check_shard_results(shard_dirs, results_df, "test_id")
+
+    return check_results(results_df, output_path) and complete
 
 
 def main(lvs_dir, cells_dir, output_path, target_cell, cells):
@@ -378,9 +487,15 @@ def main(lvs_dir, cells_dir, output_path, target_cell, cells):
     t0 = time.time()
 
     # Calling regression function
-    run_status = run_regression(
-        lvs_dir, cells_dir, output_path, target_cell, cpu_count, cells
-    )
+    if args["--merge"]:
+        shard_dirs = [os.path.abspath(d) for d in args["--merge"].split(",") if d]
+        run_status = merge_shards(shard_dirs, output_path)
+    else:
+        run_status = run_regression(
+            lvs_dir, cells_dir, output_path, target_cell, cpu_count, cells,
+            args["--shard"], args["--timing_db"], args["--changed_only"],
+            args["--memory_budget"],
+        )
 
     #  End of execution time
     logging.info("Total execution time {}s".format(time.time() - t0))
@@ -452,5 +567,13 @@ if __name__ == "__main__":
         logging.info(f"Allowed cells are {cells}")
         exit(1)
 
+    # selected shard
+    if args["--shard"]:
+        try:
+            parse_shard(args["--shard"])
+        except ValueError as e:
+            logging.error(e)
+            exit(1)
+
     # Calling main function
     main(lvs_dir, cells_dir, output_path, target_cell, cells)
@@ -0,0 +1,279 @@
+# Copyright 2023 IHP PDK Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Extract objects on *all* IHP layers in GDSII file
+# Write result to polygon list for OpenEMS in Python or Matlab/Octave syntax,
+# or as binary polygon data (numpy npz or HDF5)
+# Usage: gds2poly [-f python|matlab|npz|hdf5] [-j jobs] [-o outdir] <input.gds> [<input2.gds> ...]
+
+# The top level cell is flattened once and all layer-purpose-pairs are collected in one sweep,
+# vertex coordinates are formatted per polygon with numpy instead of one format call per value.
+# Multiple input files are processed in parallel.
+
+import gdspy
+import numpy as np
+import argparse
+import os
+import sys
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# ============= utilities ==========
+
+def float2string (value):
+  return "{:.3f}".format(value)    # fixed 3 decimal digits
+
+def array2string (values, separator):
+  # vectorized version of float2string for one coordinate array
+  return separator.join(np.char.mod('%.3f', values))
+
+
+# ============= technology specific stuff ===============
+# list of layers to evaluate
+layerlist = [
+8,
+10,
+30,
+50,
+67,
+126,
+134,
+19,
+29,
+49,
+66,
+125,
+133
+]
+
+# list of purpose to evaluate
+purposelist = [
+0
+]
+
+# list of materialnames for each GDSII layer number
+layermapping = {
+"8":"Metal1",
+"10":"Metal2",
+"30":"Metal3",
+"50":"Metal4",
+"67":"Metal5",
+"126":"TopMetal1",
+"134":"TopMetal2",
+"19":"Via1",
+"29":"Via2",
+"49":"Via3",
+"66":"Via4",
+"125":"TopVia1",
+"133":"TopVia2"
+}
+
+# get layername/materialname from GDSII layer number
+def layernum2layername (num):
+  layername = layermapping.get(str(num),"unknown")
+  return layername
+
+# output file suffix for each format
+output_suffix = {
+"python":"_polygons.py",
+"matlab":"_polygons.m",
+"npz":"_polygons.npz",
+"hdf5":"_polygons.h5"
+}
+
+
+# ============= extraction ===============
+
+def extract_polygons (input_name):
+  # read GDSII file and return top cell name, list of (layer, purpose, polygons) in layerlist order and bounding box
+  input_library = gdspy.GdsLibrary(infile=input_name)
+
+  # evaluate only first top level cell
+  toplevel_cell_list = input_library.top_level()
+  cell = toplevel_cell_list[0]
+  cellname = str(cell)
+
+  # flatten hierarchy below this cell, only once for all layers
+  cell.flatten(single_layer=None, single_datatype=None, single_texttype=None)
+
+  # all layer-purpose-pairs in one sweep (by_spec=true), no cell references left after flatten (depth=0)
+  LPPpolylist = cell.get_polygons(by_spec=True, depth=0)
+
+  # bucket polygons by IHP technology layer, in order of layerlist
+  layerdata = []
+  for layer in layerlist:
+    for purpose in purposelist:
+      layerpolygons = LPPpolylist.get((layer, purpose), [])
+      if len(layerpolygons) > 0:
+        layerdata.append((layer, purpose, layerpolygons))
+
+  # bounding box information
+  if len(layerdata) > 0:
+    allpoints = np.concatenate([np.concatenate(polygons) for (layer, purpose, polygons) in layerdata])
+    xmin, ymin = np.min(allpoints, axis=0)
+    xmax, ymax = np.max(allpoints, axis=0)
+  else:
+    xmin = ymin = xmax = ymax = 0.0
+
+  return cellname, layerdata, (xmin, xmax, ymin, ymax)
+
+
+# ============= output formats ===============
+
+def write_python (output_name, cellname, layerdata, bbox):
+  xmin, xmax, ymin, ymax = bbox
+  lines = ["# " + cellname + '\n\n']
+  txt = "{layername}.AddLinPoly(priority=200, points=pts, norm_dir ='z', elevation={layername}_zmin, length={layername}_thick)\n\n"
+  for (layer, purpose, polygons) in layerdata:
+    layername = layernum2layername(layer)
+    polytxt = txt.format(layername=layername)
+    for polypoints in polygons:
+      lines.append('pts_x = np.array([' + array2string(polypoints[:,0], ', ') + '])\n')
+      lines.append('pts_y = np.array([' + array2string(polypoints[:,1], ', ') + '])\n')
+      lines.append('pts = np.array([pts_x, pts_y])\n')
+      lines.append(polytxt)
+
+  # write bounding box information
+  lines.append('# Bounding box of geometry\n')
+  lines.append('geometry_xmin= ' + float2string(xmin) + '\n')
+  lines.append('geometry_xmax= ' + float2string(xmax) + '\n')
+  lines.append('geometry_ymin= ' + float2string(ymin) + '\n')
+  lines.append('geometry_ymax= ' + float2string(ymax) + '\n\n')
+
+  with open(output_name, 'w') as output_file:
+    output_file.write(''.join(lines))
+
+
+def write_matlab (output_name, cellname, layerdata, bbox):
+  xmin, xmax, ymin, ymax = bbox
+  lines = ["% " + cellname + '\n\n']
+  txt = "CSX = AddLinPoly( CSX, '{layername}', 200, 'z', {layername}.zmin, p, {layername}.thick); \n"
+  for (layer, purpose, polygons) in layerdata:
+    layername = layernum2layername(layer)
+    polytxt = txt.format(layername=layername)
+    for polypoints in polygons:
+      # polygon points as 2xN matrix, first row x, second row y
+      lines.append('p = [' + array2string(polypoints[:,0], ' ') + '; ' + array2string(polypoints[:,1], ' ') + '];\n')
+      lines.append(polytxt)
+
+  # write bounding box information
+  lines.append('\n% Bounding box of geometry\n')
+  lines.append('geometry.xmin= ' + float2string(xmin) + ';\n')
+  lines.append('geometry.xmax= ' + float2string(xmax) + ';\n')
+  lines.append('geometry.ymin= ' + float2string(ymin) + ';\n')
+  lines.append('geometry.ymax= ' + float2string(ymax) + ';\n\n')
+
+  with open(output_name, 'w') as output_file:
+    output_file.write(''.join(lines))
+
+
+def get_layer_arrays (polygons):
+  # all polygons of one layer as one Nx2 vertex array, plus start index of each polygon (with final end index)
+  vertices = np.concatenate(polygons)
+  offsets = np.zeros(len(polygons)+1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(polypoints) for polypoints in polygons])
+  return vertices, offsets
+
+
+def write_npz (output_name, cellname, layerdata, bbox):
+  # arrays <layername>_vertices (Nx2) and <layername>_offsets, polygon i is vertices[offsets[i]:offsets[i+1]]
+  arrays = {'cellname': np.array(cellname), 'bbox': np.array(bbox)}
+  for (layer, purpose, polygons) in layerdata:
+    layername = layernum2layername(layer)
+    vertices, offsets = get_layer_arrays(polygons)
+    arrays[layername + '_vertices'] = vertices
+    arrays[layername + '_offsets'] = offsets
+  np.savez_compressed(output_name, **arrays)
+
+
+def write_hdf5 (output_name, cellname, layerdata, bbox):
+  # one group per layer with datasets vertices (Nx2) and offsets, same layout as npz output
+  try:
+    import h5py
+  except ImportError:
+    print('HDF5 output requires the h5py module, please install h5py or use npz format')
+    sys.exit(1)
+  with h5py.File(output_name, 'w') as output_file:
+    output_file.attrs['cellname'] = cellname
+    output_file.attrs['bbox'] = np.array(bbox)
+    for (layer, purpose, polygons) in layerdata:
+      vertices, offsets = get_layer_arrays(polygons)
+      group = output_file.create_group(layernum2layername(layer))
+      group.attrs['layer'] = layer
+      group.attrs['purpose'] = purpose
+      group.create_dataset('vertices', data=vertices, compression='gzip')
+      group.create_dataset('offsets', data=offsets)
+
+
+writers = {
+"python":write_python,
+"matlab":write_matlab,
+"npz":write_npz,
+"hdf5":write_hdf5
+}
+
+
+# ============= main ===============
+
+def export_file (input_name, output_format='python', output_dir=None):
+  # convert one GDSII file, return output filename
+  print ("Input file: ", input_name)
+
+  # get basename of input file, append suffix to identify output polygons
+  output_name = Path(input_name).stem + output_suffix[output_format]
+  if output_dir != None:
+    output_name = os.path.join(output_dir, output_name)
+
+  cellname, layerdata, bbox = extract_polygons(input_name)
+  for (layer, purpose, polygons) in layerdata:
+    numvertices = sum([len(polypoints) for polypoints in polygons])
+    print ('  Layer ' + str(layer) + ' (' + layernum2layername(layer) + '): ' + str(len(polygons)) + ' polygons, ' + str(numvertices) + ' vertices')
+
+  writers[output_format](output_name, cellname, layerdata, bbox)
+  print ("Output file: ", output_name)
+  return output_name
+
+
+def export_files (input_names, output_format='python', output_dir=None, jobs=None):
+  # convert list of GDSII files, in parallel if more than one file
+  if jobs == None:
+    jobs = os.cpu_count() or 1
+  jobs = max(1, min(jobs, len(input_names)))
+
+  if jobs == 1:
+    return [export_file(input_name, output_format, output_dir) for input_name in input_names]
+
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(export_file, input_name, output_format, output_dir) for input_name in input_names]
+    return [future.result() for future in futures]
+
+
+def main ():
+  parser = argparse.ArgumentParser(description='Convert IHP SG13G2 GDSII layout to openEMS polygon code or binary polygon data')
+  parser.add_argument('input', nargs='+', help='GDSII input file(s)')
+  parser.add_argument('-f', '--format', choices=list(writers.keys()), default='python', help='output format, default python')
+  parser.add_argument('-o', '--outdir', default=None, help='output directory, default is current directory')
+  parser.add_argument('-j', '--jobs', type=int, default=None, help='number of files processed in parallel, default is number of CPUs')
+  args = parser.parse_args()
+
+  for input_name in args.input:
+    if not os.path.isfile(input_name):
+      print ("GDSII input file not found: ", input_name)
+      sys.exit(1)
+
+  export_files(args.input, args.format, args.outdir, args.jobs)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,397 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'modules')))
+
+# modules are imported by their own names, as they import each other, so that each module
+# and the profiler they record stages to are loaded only once
+import util_stackup_reader as stackup_reader
+import util_gds_reader as gds_reader
+import util_simulation_setup as simulation_setup
+import util_meshlines
+from util_profiler import profiler, get_peak_rss_MB
+
+from openEMS import openEMS
+import numpy as np
+import gdspy
+
+import argparse, json, math, platform, shutil, subprocess, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+
+# Benchmark for the pre-processing part of the workflow: GDSII reading, via array merging,
+# meshing and CSX model construction. FDTD is not started, so this runs without solver time.
+# Stage times are taken from the workflow profiler (util_profiler), results are appended as
+# one JSON line per case to a results file, together with the git commit. This allows to
+# compare pre-processing performance across commits and detect regressions.
+#
+# Usage examples:
+#   python benchmark_preprocessing.py                          run all cases, append results
+#   python benchmark_preprocessing.py --cases via_field        run only cases matching this name
+#   python benchmark_preprocessing.py --compare previous       run, then compare against previous commit
+#   python benchmark_preprocessing.py --no_run --compare 1a2b3c  only compare stored results
+
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+default_results = os.path.join(script_path, 'benchmark_results.jsonl')
+
+# stage names from profiler that are reported, in workflow order
+report_stages = ['read_substrate', 'read_gds', 'gdspy_parse', 'merge_via_array', 'setupSimulation',
+                 'addGeometry_to_CSX', 'addDielectrics_to_CSX', 'addPorts_to_CSX', 'addMesh_to_CSX',
+                 'z_mesh', 'xy_mesh', 'write_xml']
+
+# stages that are recorded in every run, merge_via_array depends on the layout and write_xml is optional
+required_stages = ['read_substrate', 'read_gds', 'gdspy_parse', 'setupSimulation', 'addGeometry_to_CSX',
+                   'addDielectrics_to_CSX', 'addPorts_to_CSX', 'addMesh_to_CSX', 'z_mesh', 'xy_mesh']
+
+
+# ======================== benchmark cases ================================
+
+# bundled layouts, settings are taken from the corresponding run_*.py model files
+# ports are given as keyword arguments for simulation_setup.simulation_port
+bundled_cases = [
+    {'name': 'L_2n0_simplified', 'gds': 'L_2n0_simplified.gds', 'xml': 'SG13G2.xml',
+     'preprocess': False, 'merge_polygon_size': 1.0, 'refined_cellsize': 1.0, 'margin': 200, 'fstop': 30e9,
+     'ports': [dict(portnumber=1, voltage=1, port_Z0=50, source_layernum=201, target_layername='TopMetal1', direction='x')]},
+    {'name': 'gsg_through_50ohm', 'gds': 'gsg_through_50ohm.gds', 'xml': 'SG13G2.xml',
+     'preprocess': True, 'merge_polygon_size': 0, 'refined_cellsize': 1.5, 'margin': 100, 'fstop': 350e9,
+     'ports': [dict(portnumber=1, voltage=1, port_Z0=100, source_layernum=201, target_layername='TopMetal2', direction='y'),
+               dict(portnumber=2, voltage=1, port_Z0=100, source_layernum=202, target_layername='TopMetal2', direction='-y'),
+               dict(portnumber=3, voltage=1, port_Z0=100, source_layernum=203, target_layername='TopMetal2', direction='y'),
+               dict(portnumber=4, voltage=1, port_Z0=100, source_layernum=204, target_layername='TopMetal2', direction='-y')]},
+    {'name': 'rfcmim_30x15x10_full', 'gds': 'rfcmim_30x15x10_full.gds', 'xml': 'SG13G2.xml',
+     'preprocess': True, 'merge_polygon_size': 1.0, 'refined_cellsize': 0.5, 'margin': 100, 'fstop': 100e9,
+     'ports': [dict(portnumber=1, voltage=1, port_Z0=50, source_layernum=201, from_layername='Metal1', to_layername='TopMetal1', direction='z'),
+               dict(portnumber=2, voltage=1, port_Z0=50, source_layernum=202, from_layername='Metal1', to_layername='Metal5', direction='z')]},
+    {'name': 'line_simple_viaport', 'gds': 'line_simple_viaport.gds', 'xml': 'SG13G2_nosub.xml',
+     'preprocess': False, 'merge_polygon_size': 0, 'refined_cellsize': 1, 'margin': 50, 'fstop': 110e9,
+     'ports': [dict(portnumber=1, voltage=1, port_Z0=50, source_layernum=201, from_layername='Metal1', to_layername='TopMetal2', direction='z'),
+               dict(portnumber=2, voltage=1, port_Z0=50, source_layernum=202, from_layername='Metal1', to_layername='TopMetal2', direction='z')]},
+]
+
+# procedural layouts are scaled to these vertex counts (approximately)
+default_scales = [1e4, 1e5, 1e6]
+
+# GDSII layer numbers from SG13G2.xml
+LAYER_METAL5 = 67
+LAYER_TOPVIA1 = 125
+LAYER_TOPMETAL1 = 126
+LAYER_TOPMETAL2 = 134
+LAYER_PORT1 = 201
+
+
+def write_via_field (filename, target_vertices):
+    # Tiled via field: TopVia1 array between Metal5 and TopMetal1 plates, with via port at the left side.
+    # Each via has 4 vertices, so the number of vias is chosen from the target vertex count.
+    via_size = 0.9
+    via_pitch = 1.8
+    numvias = max(1, int(target_vertices/4))
+    columns = int(math.ceil(math.sqrt(numvias)))
+    rows = int(math.ceil(numvias/columns))
+    width = columns*via_pitch
+    height = rows*via_pitch
+
+    lib = gdspy.GdsLibrary(unit=1e-6, precision=1e-9)
+    via_cell = lib.new_cell('VIA')
+    via_cell.add(gdspy.Rectangle((0, 0), (via_size, via_size), layer=LAYER_TOPVIA1, datatype=0))
+    top_cell = lib.new_cell('TOP')
+    top_cell.add(gdspy.CellArray(via_cell, columns, rows, (via_pitch, via_pitch), origin=(via_pitch/2, via_pitch/2)))
+    top_cell.add(gdspy.Rectangle((0, 0), (width+via_pitch, height+via_pitch), layer=LAYER_METAL5, datatype=0))
+    top_cell.add(gdspy.Rectangle((0, 0), (width+via_pitch, height+via_pitch), layer=LAYER_TOPMETAL1, datatype=0))
+    top_cell.add(gdspy.Rectangle((-10, 0), (-5, 5), layer=LAYER_PORT1, datatype=0))
+    top_cell.add(gdspy.Rectangle((-10, 0), (0, 5), layer=LAYER_METAL5, datatype=0))
+    lib.write_gds(filename)
+    return columns*rows*4
+
+
+def octagon_spiral_points (turns, radius, pitch):
+    # center line of multi-turn octagon spiral, radius decreases continuously from outer to inner turn
+    points = []
+    for k in range(int(turns*8)+1):
+        angle = math.radians(22.5 + 45*k)
+        r = (radius - pitch*k/8) / math.cos(math.radians(22.5))
+        points.append((r*math.cos(angle), r*math.sin(angle)))
+    return points
+
+
+def write_octagon_array (filename, target_vertices):
+    # Multi-turn octagon inductors on TopMetal2, tiled as array to reach the target vertex count,
+    # with an in-plane port at the outer end of the first inductor
+    turns = 5
+    radius = 60
+    width = 6
+    spacing = 3
+    tile = 2*radius + 40
+
+    lib = gdspy.GdsLibrary(unit=1e-6, precision=1e-9)
+    spiral_cell = lib.new_cell('SPIRAL')
+    spiral = gdspy.FlexPath(octagon_spiral_points(turns, radius, width+spacing), width, layer=LAYER_TOPMETAL2, datatype=0)
+    spiral_cell.add(spiral)
+    vertices_per_spiral = sum([len(poly) for poly in spiral_cell.get_polygons()])
+
+    numspirals = max(1, int(math.ceil(target_vertices/vertices_per_spiral)))
+    columns = int(math.ceil(math.sqrt(numspirals)))
+    rows = int(math.ceil(numspirals/columns))
+
+    top_cell = lib.new_cell('TOP')
+    top_cell.add(gdspy.CellArray(spiral_cell, columns, rows, (tile, tile)))
+    x0, y0 = octagon_spiral_points(turns, radius, width+spacing)[0]
+    top_cell.add(gdspy.Rectangle((x0-width/2, y0-width-2), (x0+width/2, y0-width/2), layer=LAYER_PORT1, datatype=0))
+    lib.write_gds(filename)
+    return columns*rows*vertices_per_spiral
+
+
+def get_procedural_cases (tempdir, scales, max_vertices):
+    # create procedural layouts in tempdir, return list of cases
+    cases = []
+    for scale in scales:
+        if scale > max_vertices:
+            continue
+        label = format(scale, '.0e').replace('+0', '').replace('+', '')
+
+        gds = os.path.join(tempdir, 'via_field_' + label + '.gds')
+        vertices = write_via_field(gds, scale)
+        cases.append({'name': 'via_field_' + label, 'gds': gds, 'xml': 'SG13G2.xml', 'vertices_generated': vertices,
+                      'preprocess': False, 'merge_polygon_size': 1.0, 'refined_cellsize': 1.0, 'margin': 50, 'fstop': 100e9,
+                      'ports': [dict(portnumber=1, voltage=1, port_Z0=50, source_layernum=LAYER_PORT1, from_layername='GND', to_layername='Metal5', direction='z')]})
+
+        gds = os.path.join(tempdir, 'octagon_' + label + '.gds')
+        vertices = write_octagon_array(gds, scale)
+        cases.append({'name': 'octagon_' + label, 'gds': gds, 'xml': 'SG13G2.xml', 'vertices_generated': vertices,
+                      'preprocess': False, 'merge_polygon_size': 0, 'refined_cellsize': 1.0, 'margin': 100, 'fstop': 30e9,
+                      'ports': [dict(portnumber=1, voltage=1, port_Z0=50, source_layernum=LAYER_PORT1, target_layername='TopMetal2', direction='y')]})
+    return cases
+
+
+# ======================== run one case ================================
+
+def run_case_once (case, write_xml, tempdir):
+    # run pre-processing for one case and return profiler summary and counts
+    profiler.enabled = True
+    profiler.stages = []
+    profiler.active = []
+
+    unit = 1e-6
+    cells_per_wavelength = 20
+
+    simulation_ports = simulation_setup.all_simulation_ports()
+    for port_args in case['ports']:
+        simulation_ports.add_port(simulation_setup.simulation_port(**port_args))
+
+    XML_filename = os.path.join(script_path, case['xml'])
+    gds_filename = os.path.join(script_path, case['gds'])
+
+    with profiler.stage('read_substrate'):
+        materials_list, dielectrics_list, metals_list = stackup_reader.read_substrate(XML_filename)
+    layernumbers = metals_list.getlayernumbers()
+    layernumbers.extend(simulation_ports.portlayers)
+
+    allpolygons = gds_reader.read_gds(gds_filename, layernumbers, purposelist=[0], metals_list=metals_list,
+                                      preprocess=case['preprocess'], merge_polygon_size=case['merge_polygon_size'])
+
+    wavelength_air = 3e8/case['fstop'] / unit
+    max_cellsize = (wavelength_air)/(np.sqrt(materials_list.eps_max)*cells_per_wavelength)
+
+    FDTD = openEMS()
+    FDTD = simulation_setup.setupSimulation([1], simulation_ports, FDTD, materials_list, dielectrics_list, metals_list,
+                                            allpolygons, max_cellsize, case['refined_cellsize'], case['margin'], unit,
+                                            xy_mesh_function=util_meshlines.create_xy_mesh_from_polygons)
+
+    if write_xml:
+        CSX_file = os.path.join(tempdir, case['name'] + '.xml')
+        with profiler.stage('write_xml'):
+            FDTD.GetCSX().Write2XML(CSX_file)
+        os.remove(CSX_file)
+
+    # check that the workflow stages were recorded by this profiler
+    summary = profiler.get_summary()
+    expected = required_stages + (['write_xml'] if write_xml else [])
+    missing = [name for name in expected if name not in summary]
+    if len(missing) > 0:
+        raise RuntimeError('Benchmark case ' + case['name'] + ': stages not recorded by profiler: ' + ', '.join(missing))
+
+    # collect counts from all stages
+    counts = {}
+    for stage in profiler.stages:
+        counts.update(stage.counts)
+    return summary, counts
+
+
+def run_case (case, repeat, write_xml, tempdir):
+    # run case repeatedly, keep best time per stage
+    best = {}
+    counts = {}
+    for i in range(repeat):
+        summary, counts = run_case_once(case, write_xml, tempdir)
+        for name, entry in summary.items():
+            if (name not in best) or (entry['wall_time_s'] < best[name]):
+                best[name] = entry['wall_time_s']
+    stages = {}
+    for name in report_stages + sorted(best.keys()):
+        if (name in best) and (name not in stages):
+            stages[name] = best[name]
+    return {'case': case['name'], 'repeat': repeat, 'stages': stages, 'counts': counts, 'peak_rss_MB': round(get_peak_rss_MB() or 0, 1)}
+
+
+def run_case_isolated (case, repeat, write_xml, tempdir):
+    # run case in a separate process, so that peak memory is measured per case
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_case, case, repeat, write_xml, tempdir).result()
+
+
+# ======================== results storage and comparison ================================
+
+def get_git_info ():
+    # commit hash and dirty flag for the workflow directory, None if not in a git repository
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=script_path, stderr=subprocess.DEVNULL).decode().strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--', '.'], cwd=script_path, stderr=subprocess.DEVNULL).decode().strip()
+        return commit, len(status) > 0
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def append_results (results_file, records):
+    with open(results_file, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def read_results (results_file):
+    records = []
+    if os.path.isfile(results_file):
+        with open(results_file, 'r') as f:
+            for line in f:
+                if line.strip() != '':
+                    records.append(json.loads(line))
+    return records
+
+
+def latest_by_case (records):
+    # most recent record for each case name
+    latest = {}
+    for record in records:
+        latest[record['case']] = record
+    return latest
+
+
+def compare_results (records, current, reference, threshold):
+    # compare current results against reference commit, return number of regressions
+    # current: list of records from this run, or None to use records of the latest commit in results file
+    # reference: commit hash (prefix) or 'previous' for the last commit before the current one
+    if len(records) == 0:
+        print('No stored benchmark results')
+        return 0
+
+    if current == None:
+        current_commit = records[-1]['commit']
+        current = [record for record in records if record['commit'] == current_commit]
+    else:
+        current_commit = current[0]['commit'] if len(current) > 0 else None
+
+    if reference == 'previous':
+        commits = []
+        for record in records:
+            if (record['commit'] != current_commit) and (record['commit'] not in commits):
+                commits.append(record['commit'])
+        if len(commits) == 0:
+            print('No results from a previous commit found for comparison')
+            return 0
+        reference = commits[-1]
+
+    reference_records = [record for record in records if (record['commit'] != None) and record['commit'].startswith(reference)]
+    if len(reference_records) == 0:
+        print('No stored results for commit ', reference)
+        return 0
+    reference_by_case = latest_by_case(reference_records)
+
+    print('\nComparison ', str(current_commit), ' against ', reference_records[-1]['commit'], ' (threshold ', threshold, ')')
+    regressions = 0
+    for name, record in latest_by_case(current).items():
+        if name not in reference_by_case:
+            continue
+        ref_stages = reference_by_case[name]['stages']
+        for stage, wall_time in record['stages'].items():
+            if stage not in ref_stages:
+                continue
+            ref_time = ref_stages[stage]
+            ratio = wall_time/ref_time if ref_time > 0 else 1.0
+            # ignore tiny stages where timer noise dominates
+            flag = ''
+            if (ratio > threshold) and (wall_time - ref_time > 0.05):
+                flag = '  <-- REGRESSION'
+                regressions = regressions + 1
+            print('  {:<28} {:<22} {:10.3f} s {:10.3f} s {:7.2f}x{}'.format(name, stage, ref_time, wall_time, ratio, flag))
+    return regressions
+
+
+# ======================== main ================================
+
+def main ():
+    parser = argparse.ArgumentParser(description='Benchmark GDSII reading, meshing and CSX construction of the openEMS workflow')
+    parser.add_argument('--cases', nargs='*', default=None, help='run only cases with name containing one of these strings')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per case, best time per stage is reported')
+    parser.add_argument('--scales', type=float, nargs='*', default=default_scales, help='vertex counts for procedural layouts')
+    parser.add_argument('--max_vertices', type=float, default=1e6, help='skip procedural layouts above this vertex count')
+    parser.add_argument('--no_procedural', action='store_true', help='run bundled GDSII files only')
+    parser.add_argument('--write_xml', action='store_true', help='include writing the CSX XML file')
+    parser.add_argument('--in_process', action='store_true', help='run all cases in this process, peak memory is then cumulative')
+    parser.add_argument('--results', default=default_results, help='JSON lines file where results are appended')
+    parser.add_argument('--no_save', action='store_true', help='do not append results to results file')
+    parser.add_argument('--no_run', action='store_true', help='do not run benchmarks, only compare stored results')
+    parser.add_argument('--compare', nargs='?', const='previous', default=None, help="compare against results of this commit, default 'previous'")
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio that is reported as regression')
+    parser.add_argument('--keep', action='store_true', help='keep generated GDSII files')
+    args = parser.parse_args()
+
+    # old results are read before this run is appended
+    stored_records = read_results(args.results)
+    current = None
+
+    if not args.no_run:
+        tempdir = tempfile.mkdtemp(prefix='openems_benchmark_')
+        cases = list(bundled_cases)
+        if not args.no_procedural:
+            print('Creating procedural layouts in ', tempdir)
+            cases.extend(get_procedural_cases(tempdir, args.scales, args.max_vertices))
+        if args.cases != None:
+            cases = [case for case in cases if any([pattern in case['name'] for pattern in args.cases])]
+
+        commit, dirty = get_git_info()
+        current = []
+        for case in cases:
+            print('\n===== Benchmark case ', case['name'], ' =====')
+            if args.in_process:
+                result = run_case(case, args.repeat, args.write_xml, tempdir)
+            else:
+                result = run_case_isolated(case, args.repeat, args.write_xml, tempdir)
+
+            record = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'dirty': dirty,
+                      'host': platform.node(), 'python': platform.python_version(), 'gdspy': gdspy.__version__}
+            record.update(result)
+            current.append(record)
+
+        if args.keep:
+            print('Generated GDSII files kept in ', tempdir)
+        else:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+        # summary table
+        print('\n{:<28} {:<22} {:>12}'.format('case', 'stage', 'time'))
+        for record in current:
+            for stage, wall_time in record['stages'].items():
+                print('{:<28} {:<22} {:10.3f} s'.format(record['case'], stage, wall_time))
+            print('{:<28} {:<22} {}'.format(record['case'], 'counts', record['counts']))
+
+        if not args.no_save:
+            append_results(args.results, current)
+            print('\nResults appended to ', args.results)
+
+    if args.compare != None:
+        records = stored_records + (current if current != None else [])
+        regressions = compare_results(records, current, args.compare, args.threshold)
+        if regressions > 0:
+            print(regressions, ' regression(s) found')
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
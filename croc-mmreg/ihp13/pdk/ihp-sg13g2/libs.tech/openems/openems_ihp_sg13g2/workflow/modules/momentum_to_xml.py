@@ -3,9 +3,14 @@
 
 # Version: 18 Dec 2024
 
+# Can be used as command line tool for one or more *.subst files, or imported as module:
+#   stackup = momentum_to_xml.compile_stackup("SG13G2.subst")
+#   materials_list, dielectrics_list, metals_list = stackup.read_substrate()
 
-import os, sys
+
+import os, sys, hashlib
 import xml.etree.ElementTree 
+import util_stackup_reader as stackup_reader
 
 # --------------------- file names --------------------------
 
@@ -181,6 +186,23 @@ def find_by_name (myList, name):
     if a.name == name:
       return a
 
+
+class ADS_material_list (list):
+  """
+    list of materials with name index, replaces linear search with find_by_name()
+  """
+
+  def __init__ (self):
+    self.by_name = {}
+
+  def append (self, material):
+    super().append (material)
+    # first definition wins, same as find_by_name()
+    self.by_name.setdefault (material.name, material)
+
+  def find_by_name (self, name):
+    return self.by_name.get(name)
+
 def print_all (myList):
   for a in myList:
     print (a)
@@ -433,22 +455,50 @@ class ADS_metal_layer:
 class ADS_metal_layers_list:
   def __init__ (self):
     self.layers = []
+    self.zpos_index = {}  # rounded zpos1 -> list of layer indices, see testequal()
     
   def append (self, what):
     self.layers.append (what)
+    self.zpos_index.setdefault(self.zpos_key(what.zpos1), []).append(len(self.layers)-1)
   
   def getlayer_by_index (self, index):
     return self.layers[index]
   
   def count (self):
     return len(self.layers)
+
+  def zpos_key (self, zpos):
+    return int(round(zpos*1e4))
+
+  def build_zpos_index (self):
+    # must be called after z positions of layers are modified
+    self.zpos_index = {}
+    for index, l in enumerate(self.layers):
+      self.zpos_index.setdefault(self.zpos_key(l.zpos1), []).append(index)
+
+  def find_next_from_zpos (self, zpos, after_index):
+    # index of first layer after after_index with zpos1 equal to zpos, None if not found
+    key = self.zpos_key(zpos)
+    found = None
+    for k in (key-1, key, key+1):   # neighbour keys because testequal uses tolerance
+      for index in self.zpos_index.get(k, []):
+        if (index > after_index) and testequal(self.layers[index].zpos1, zpos):
+          if (found == None) or (index < found):
+            found = index
+    return found
     
   def find_from_zpos(self, zpos):
+    # last layer with zpos1 equal to zpos
+    key = self.zpos_key(zpos)
     found = None
-    for l in self.layers:
-      if testequal(l.zpos1, zpos):
-        found=l
-    return found  
+    for k in (key-1, key, key+1):
+      for index in self.zpos_index.get(k, []):
+        if testequal(self.layers[index].zpos1, zpos):
+          if (found == None) or (index > found):
+            found = index
+    if found == None:
+      return None
+    return self.layers[found]
     
 
   def __str__ (self): 
@@ -515,311 +565,392 @@ class ADS_via_layers_list:
 
 
 
-# ---------------- Get ADS substrate filename -----------------------------
+# -------------------- stackup compiler ---------------------------
 
-mydir  = os.getcwd()             #    Base directory
-print (mydir)
-
-if len(sys.argv) < 2:
-    print('Usage: momentum_to_xml <name.subst>')
-else: 
-  ADS_substrate_filename = sys.argv[1]
-  print('Input filename: ', ADS_substrate_filename)
-  if os.path.isfile(ADS_substrate_filename):
-
-    # check if the name is IHP substrate name, for IHP special features 
-    is_IHP_substrate = 'SG13' in ADS_substrate_filename.upper()
-
-    # ----------- parse material file, store name and empire material string into lists -----------
+# Materials file and substrate file are hashed, compiled stackups are cached in memory with these hashes
+# and the processing settings as key. The parsed materials file is also cached, so that batch conversion
+# of many substrate variants against the same materials.matdb parses that file only once.
 
+material_definitions_cache = {}   # materials file hash -> list of (type, attributes) tuples
+stackup_cache = {}                # (substrate hash, materials hash, settings) -> compiled_stackup
 
-    material_list = []      # holds instances of ADS_conductor, ADS_dielectric, ADS_semiconductor
 
-
-    print ("Reading shared materials file ", ADS_materials_filename)
-    materials_tree = xml.etree.ElementTree.parse(ADS_materials_filename)
-    materials_root = materials_tree.getroot()
+def read_file_with_hash (filename):
+  # return file content as bytes and its SHA256 hash
+  with open(filename, "rb") as f:
+    data = f.read()
+  return data, hashlib.sha256(data).hexdigest()
 
 
+def get_material_definitions (materials_data, materials_hash):
+  # parse materials file once per content hash, return material definitions as plain tuples
+  definitions = material_definitions_cache.get(materials_hash)
+  if definitions == None:
+    materials_root = xml.etree.ElementTree.fromstring(materials_data)
+    definitions = []
     for conductor in materials_root.iter("Conductor"):
-      material_list.append (ADS_conductor_material(conductor.get("name"), conductor.get("real")))
-
+      definitions.append (("conductor", conductor.get("name"), conductor.get("real")))
     for dielectric in materials_root.iter("Dielectric"):
-      material_list.append (ADS_dielectric_material(dielectric.get("name"), dielectric.get("er_real"), dielectric.get("er_loss")))
-
+      definitions.append (("dielectric", dielectric.get("name"), dielectric.get("er_real"), dielectric.get("er_loss")))
     for semiconductor in materials_root.iter("Semiconductor"):
-      material_list.append (ADS_semiconductor_material(semiconductor.get("name"), semiconductor.get("er_real"), semiconductor.get("resistivity")))
+      definitions.append (("semiconductor", semiconductor.get("name"), semiconductor.get("er_real"), semiconductor.get("resistivity")))
+    material_definitions_cache[materials_hash] = definitions
+  return definitions
+
+
+def create_material_list (definitions):
+  # create new material objects for each compile run, because compiling modifies them (used, priority, color)
+  material_list = ADS_material_list()  # holds instances of ADS_conductor, ADS_dielectric, ADS_semiconductor
+  for definition in definitions:
+    if definition[0] == "conductor":
+      material_list.append (ADS_conductor_material(definition[1], definition[2]))
+    elif definition[0] == "dielectric":
+      material_list.append (ADS_dielectric_material(definition[1], definition[2], definition[3]))
+    else:
+      material_list.append (ADS_semiconductor_material(definition[1], definition[2], definition[3]))
+
+  # Add ADS predefined materials
+  material_list.append (ADS_dielectric_material("AIR", "1.0", "0.0"))
+  return material_list
+
+
+class compiled_stackup:
+  """
+    result of stackup compilation: openEMS XML stackup as string, 
+    can be written to file or used directly with util_stackup_reader
+  """
+
+  def __init__ (self, substrate_filename, xml_string, key):
+    self.substrate_filename = substrate_filename
+    self.xml_string = xml_string
+    self.key = key
+    self.root = None
+
+  def write (self, XML_filename):
+    print('Writing output file: ', XML_filename)
+    with open(XML_filename, "w") as file:
+      file.write(self.xml_string)
+
+  def read_substrate (self):
+    # return materials_list, dielectrics_list, metals_list as util_stackup_reader.read_substrate() does,
+    # parsed XML is kept, new list objects are created on each call because the workflow modifies them
+    if self.root == None:
+      self.root = xml.etree.ElementTree.fromstring(self.xml_string)
+    return stackup_reader.read_substrate_from_root(self.root)
+
+
+def compile_stackup (ADS_substrate_filename, materials_filename=None):
+  """
+  Compile ADS *.subst file with materials.matdb to openEMS XML stackup.
+  Returns compiled_stackup object, results are cached by input file hashes.
+  """
+  if materials_filename == None:
+    materials_filename = ADS_materials_filename
+
+  if not os.path.isfile(ADS_substrate_filename):
+    print('Input file ' + ADS_substrate_filename + ' not found')
+    sys.exit(1)
+  if not os.path.isfile(materials_filename):
+    print('Materials file ' + materials_filename + ' not found')
+    sys.exit(1)
 
-    # Add ADS predefined materials
-    material_list.append (ADS_dielectric_material("AIR", "1.0", "0.0"))
+  # check if the name is IHP substrate name, for IHP special features 
+  is_IHP_substrate = 'SG13' in os.path.basename(ADS_substrate_filename).upper()
 
-    
-    # ----------- parse substrate file, get materials from list created before -----------
+  substrate_data, substrate_hash = read_file_with_hash(ADS_substrate_filename)
+  materials_data, materials_hash = read_file_with_hash(materials_filename)
+  key = (substrate_hash, materials_hash, is_IHP_substrate, tuple(exclude_dielectrics), air_above, merge_dielectrics)
 
+  stackup = stackup_cache.get(key)
+  if stackup != None:
+    print ("Using cached stackup for ", ADS_substrate_filename)
+    return stackup
 
-    print ("Reading substrate file ", ADS_substrate_filename, "\n")
+  print ("Reading shared materials file ", materials_filename)
+  material_list = create_material_list(get_material_definitions(materials_data, materials_hash))
 
-    # data source is *.subst XML file
-    substrate_tree = xml.etree.ElementTree.parse(ADS_substrate_filename)
-    substrate_root = substrate_tree.getroot()
+  print ("Reading substrate file ", ADS_substrate_filename, "\n")
+  substrate_root = xml.etree.ElementTree.fromstring(substrate_data)
+  xml_string = build_stackup_xml(substrate_root, material_list, is_IHP_substrate, materials_filename)
 
+  stackup = compiled_stackup(ADS_substrate_filename, xml_string, key)
+  stackup_cache[key] = stackup
+  return stackup
 
-    # get dielectric layers from *.subst XML
 
-    ADS_dielectric_layers = ADS_dielectric_layer_list () # initialize empty list
-    for substrate in  substrate_root.iter("material"):
+def build_stackup_xml (substrate_root, material_list, is_IHP_substrate, materials_filename):
+  # create XML stackup string from parsed *.subst file and material list
 
-      thickness_string = substrate.get("thick")
-      thickunit_string = substrate.get("thickunit")
-      materialname = substrate.get("materialname")
-      material = find_by_name (material_list, materialname)
-      if material != None:
-        if not materialname in exclude_dielectrics:
-          dielectric_layer = ADS_dielectric_layer(materialname, material, thickness_string, thickunit_string)
-          ADS_dielectric_layers.append (dielectric_layer)
-        else:  
-          print ("Skipped ", materialname, ", is listed in list of dielectrics to be excluded from model")
-      else:
-        print ("Material ", materialname, " not found in ", ADS_materials_filename)
+  # get dielectric layers from *.subst XML
 
+  ADS_dielectric_layers = ADS_dielectric_layer_list () # initialize empty list
+  for substrate in  substrate_root.iter("material"):
 
-    # add an air layer above
-    material = find_by_name (material_list, "AIR")
+    thickness_string = substrate.get("thick")
+    thickunit_string = substrate.get("thickunit")
+    materialname = substrate.get("materialname")
+    material = material_list.find_by_name (materialname)
     if material != None:
-      ADS_dielectric_layers.append (ADS_dielectric_layer("AIR", material,str(air_above), "micron"))
+      if not materialname in exclude_dielectrics:
+        dielectric_layer = ADS_dielectric_layer(materialname, material, thickness_string, thickunit_string)
+        ADS_dielectric_layers.append (dielectric_layer)
+      else:  
+        print ("Skipped ", materialname, ", is listed in list of dielectrics to be excluded from model")
+    else:
+      print ("Material ", materialname, " not found in ", materials_filename)
 
 
-    # check what metals expand dielectric layer thickness
+  # add an air layer above
+  material = material_list.find_by_name ("AIR")
+  if material != None:
+    ADS_dielectric_layers.append (ADS_dielectric_layer("AIR", material,str(air_above), "micron"))
 
-    # process dielectric, set interface position where metal goes
-    # do this before actually creating the metal list
 
-    for layer in substrate_root.iter("layer"):
-      metal_thickness = get_thickness_micron(layer.get("thick"), layer.get("thickunit"))
-      layerindex = int(layer.get("index"))
+  # check what metals expand dielectric layer thickness
 
-      if metal_thickness > 0:
-        # expand dielectric above
-        dielectric = ADS_dielectric_layers.getlayer_by_index(layerindex+1)
-      else:
-        # expand dielectric below
-        dielectric = ADS_dielectric_layers.getlayer_by_index(layerindex)
-        
-      expand = layer.get("expand")
-      # special case expand where dielectric above or below must grow:
-      if expand=="1":
+  # process dielectric, set interface position where metal goes
+  # do this before actually creating the metal list
 
-        dielectric.thickness = dielectric.thickness + fabs(metal_thickness) # abs value because grow down comes as negative thickness
-        print ("expand ", dielectric.layername, " t=", dielectric.thickness, " + " , metal_thickness )
+  for layer in substrate_root.iter("layer"):
+    metal_thickness = get_thickness_micron(layer.get("thick"), layer.get("thickunit"))
+    layerindex = int(layer.get("index"))
 
-    # now we have preliminary dielectric thickness and know metal layer positions
-    ADS_dielectric_layers.assign_interface_positions() 
-    
+    if metal_thickness > 0:
+      # expand dielectric above
+      dielectric = ADS_dielectric_layers.getlayer_by_index(layerindex+1)
+    else:
+      # expand dielectric below
+      dielectric = ADS_dielectric_layers.getlayer_by_index(layerindex)
+      
+    expand = layer.get("expand")
+    # special case expand where dielectric above or below must grow:
+    if expand=="1":
 
-    # ---------------------------- prepare for substrate height parameter  ----------------------
-    
+      dielectric.thickness = dielectric.thickness + abs(metal_thickness) # abs value because grow down comes as negative thickness
+      print ("expand ", dielectric.layername, " t=", dielectric.thickness, " + " , metal_thickness )
 
-    # get metal layers from *.subst XML
+  # now we have preliminary dielectric thickness and know metal layer positions
+  ADS_dielectric_layers.assign_interface_positions() 
+  
 
-    ADS_metal_layers = ADS_metal_layers_list ()# initialize empty list
-    for layer in substrate_root.iter("layer"):
+  # get metal layers from *.subst XML
 
-      thickness_string = layer.get("thick")
-      thickunit_string = layer.get("thickunit")
+  ADS_metal_layers = ADS_metal_layers_list ()# initialize empty list
+  for layer in substrate_root.iter("layer"):
 
-      # get z position from previously processed dielectrics
-      layerindex = int(layer.get("index"))
-      zpos = ADS_dielectric_layers.get_zpos_by_index(layerindex)
+    thickness_string = layer.get("thick")
+    thickunit_string = layer.get("thickunit")
 
-      gdslayer = layer.get ("layer")
-      sheet = layer.get("sheet")
+    # get z position from previously processed dielectrics
+    layerindex = int(layer.get("index"))
+    zpos = ADS_dielectric_layers.get_zpos_by_index(layerindex)
 
-      materialname = layer.get("materialname")
-      material = find_by_name (material_list, materialname)
-      if material != None:
-        name_upstr = materialname.upper()
-        no_MIM = (name_upstr.find('MIM') <0)
-        
-        # skip layers with "MIM" in the layer name, e.g. VMIM or MIM
-        if no_MIM:
-          metal_layer = ADS_metal_layer(materialname, material, gdslayer, zpos, thickness_string, thickunit_string)
-          material.used = True
-        
-          # special case thin metal simulation:
-          if sheet=="1":
-            print ("Layer " + materialname + " is flat metal model (SHEET), converted to thick metal model.")
-            metal_layer.material.thinsheet=1
-            metal_layer.material.ohmspersquare = 1 / (metal_layer.material.sigma*get_thickness_micron (thickness_string, thickunit_string)*1e-6)
-        
-          # append to list
-          ADS_metal_layers.append (metal_layer) 
-      else:
-        print ("Could not find material definition for ", materialname)
+    gdslayer = layer.get ("layer")
+    sheet = layer.get("sheet")
 
-        
+    materialname = layer.get("materialname")
+    material = material_list.find_by_name (materialname)
+    if material != None:
+      name_upstr = materialname.upper()
+      no_MIM = (name_upstr.find('MIM') <0)
+      
+      # skip layers with "MIM" in the layer name, e.g. VMIM or MIM
+      if no_MIM:
+        metal_layer = ADS_metal_layer(materialname, material, gdslayer, zpos, thickness_string, thickunit_string)
+        material.used = True
+      
+        # special case thin metal simulation:
+        if sheet=="1":
+          print ("Layer " + materialname + " is flat metal model (SHEET), converted to thick metal model.")
+          metal_layer.material.thinsheet=1
+          metal_layer.material.ohmspersquare = 1 / (metal_layer.material.sigma*get_thickness_micron (thickness_string, thickunit_string)*1e-6)
+      
+        # append to list
+        ADS_metal_layers.append (metal_layer) 
+    else:
+      print ("Could not find material definition for ", materialname)
+
+      
 
-    # get via layers from *.subst XML
+  # get via layers from *.subst XML
 
-    ADS_via_layers = ADS_via_layers_list ()# initialize empty list
-    for via in substrate_root.iter("via"):
+  ADS_via_layers = ADS_via_layers_list ()# initialize empty list
+  for via in substrate_root.iter("via"):
 
-      thickness_string = layer.get("thick")
-      thickunit_string = layer.get("thickunit")
+    # get z position from previously processed dielectrics
+    layerindex1 = int(via.get("index1"))
+    layerindex2 = int(via.get("index2"))
+    zpos1 = ADS_dielectric_layers.get_zpos_by_index(layerindex1)
+    zpos2 = ADS_dielectric_layers.get_zpos_by_index(layerindex2)
+    
+    gdslayer = via.get ("layer")
+
+    materialname = via.get("materialname")
+    material = material_list.find_by_name (materialname)
 
-      # get z position from previously processed dielectrics
-      layerindex1 = int(via.get("index1"))
-      layerindex2 = int(via.get("index2"))
-      zpos1 = ADS_dielectric_layers.get_zpos_by_index(layerindex1)
-      zpos2 = ADS_dielectric_layers.get_zpos_by_index(layerindex2)
+    if material != None:
+        
+      if material.materialtype == "conductor":
+        material.priority = 190 # priority smaller than metal layers
+      else: 
+        material.priority = 120 # priority higher than normal dieletric layers
+
+      
+      name_upstr = materialname.upper()
+      no_MIM = (name_upstr.find('MIM') <0)
       
-      gdslayer = via.get ("layer")
+      # skip layers with "MIM" in the layer name, e.g. VMIM or MIM
+      if no_MIM:
+        via_layer = ADS_via_layer(materialname, material, gdslayer, zpos1, zpos2)
+        material.used = True
+        ADS_via_layers.append (via_layer) 
+    else:
+      print ("Could not find material definition for ", materialname)
 
-      materialname = via.get("materialname")
-      material = find_by_name (material_list, materialname)
 
-      if material != None:
-          
-        if material.materialtype == "conductor":
-          material.priority = 190 # priority smaller than metal layers
-        else: 
-          material.priority = 120 # priority higher than normal dieletric layers
+  # process dielectric, set layer positions and names
+  # We do this now, after metals, because some metals can expand the dielectric thickness
+  ADS_dielectric_layers.process_dielectric_layers ()
 
-        
-        name_upstr = materialname.upper()
-        no_MIM = (name_upstr.find('MIM') <0)
-        
-        # skip layers with "MIM" in the layer name, e.g. VMIM or MIM
-        if no_MIM:
-          via_layer = ADS_via_layer(materialname, material, gdslayer, zpos1, zpos2)
-          material.used = True
-          ADS_via_layers.append (via_layer) 
-      else:
-        print ("Could not find material definition for ", materialname)
 
+  # get total stackup height 
+  total_height_subst = ADS_dielectric_layers.get_total_stackup_height()
+  print ("\ntotal_height_subst = ", str (total_height_subst-air_above), ' + ' , air_above, ' AIR ')
+  
+  # get height of semiconductors (for LBE)
+  semi_height = ADS_dielectric_layers.get_semiconductor_height()
+  print ("semiconductor height = " + str (semi_height))
+  
+  if is_IHP_substrate:
+    if semi_height > 0:
+      # add LBE on layer 157
+      material = material_list.find_by_name ('AIR')
+      zpos1 = ADS_dielectric_layers.get_semiconductor_zmin()
+      zpos2 = zpos1 + semi_height
 
-    # process dielectric, set layer positions and names
-    # We do this now, after metals, because some metals can expand the dielectric thickness
-    ADS_dielectric_layers.process_dielectric_layers ()
+      LBE_layer = ADS_via_layer('LBE', material, '157', zpos1, zpos2)
+      ADS_via_layers.append (LBE_layer) 
 
+  
+  # ---------------------------- assign IHP colors if layer name matches list ----------------------
+  
+  if is_IHP_substrate:
 
-    # get total stackup height 
-    total_height_subst = ADS_dielectric_layers.get_total_stackup_height()
-    print ("\ntotal_height_subst = ", str (total_height_subst-air_above), ' + ' , air_above, ' AIR ')
-    
-    # get height of semiconductors (for LBE)
-    semi_height = ADS_dielectric_layers.get_semiconductor_height()
-    print ("semiconductor height = " + str (semi_height))
+    for metal in ADS_metal_layers.layers:
+      IHP_color = color_from_layername(metal.layername, metal.material.display_color)
+      if (IHP_color!=metal.material.display_color):
+        metal.material.display_color=IHP_color
+      
+    for via in ADS_via_layers.layers:
+      IHP_color = color_from_layername(via.layername, via.material.display_color)
+      if (IHP_color!=via.material.display_color):
+        via.material.display_color=IHP_color
     
-    if is_IHP_substrate:
-      if semi_height > 0:
-        # add LBE on layer 157
-        material = find_by_name (material_list, 'AIR')
-        zpos1 = ADS_dielectric_layers.get_semiconductor_zmin()
-        zpos2 = zpos1 + semi_height
+    for dielectric in ADS_dielectric_layers.layers:
+      IHP_color = color_from_layername(dielectric.layername, dielectric.material.display_color)
+      if (IHP_color!=dielectric.material.display_color):
+        dielectric.material.display_color=IHP_color
+
+  
+  # --------------- create XML stackup ---------------
+  
+  # This is created as strings, not using the XML writer, so that we can create the EXACT format
+  lines = []
+  
+  lines.append ('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
+  lines.append ('  <Stackup schemaVersion="2.0">\n')
 
-        LBE_layer = ADS_via_layer('LBE', material, '157', zpos1, zpos2)
-        ADS_via_layers.append (LBE_layer) 
+  # ---------- materials -----------
 
+  lines.append ('    <Materials>\n')
+  
+  # iterate over materials list
     
-    # ---------------------------- assign IHP colors if layer name matches list ----------------------
+  for material in material_list:
+    if material.used:  # only material definitions that are actually in use in final file
+      lines.append (str(material))
+  
+  lines.append ('    </Materials>\n')
+  lines.append ('    <ELayers LengthUnit="um">\n')
+
+  # ---------- Dielectrics -----------
+  
+  # We need a list of dielectric layers, from top to bottom. That is reverse order than *.subst, so reverse the lsit
+  # But for internal processing, we need to go from bottom to top
+  
     
-    if is_IHP_substrate:
+  dielectrics_stringlist = []   # To revert the output order later, we have an intermediate list to hold the strings
 
-      for metal in ADS_metal_layers.layers:
-        IHP_color = color_from_layername(metal.layername, metal.material.display_color)
-        if (IHP_color!=metal.material.display_color):
-          metal.material.display_color=IHP_color
-        
-      for via in ADS_via_layers.layers:
-        IHP_color = color_from_layername(via.layername, via.material.display_color)
-        if (IHP_color!=via.material.display_color):
-          via.material.display_color=IHP_color
-      
-      for dielectric in ADS_dielectric_layers.layers:
-        IHP_color = color_from_layername(dielectric.layername, dielectric.material.display_color)
-        if (IHP_color!=dielectric.material.display_color):
-          dielectric.material.display_color=IHP_color
+  for dielectric in ADS_dielectric_layers.layers:
+    dielectrics_stringlist.append (str(dielectric))
+  
 
-    
-    # --------------- write out XML stackup file ---------------
-    
-    # This is created as strings, not using the XML writer, so that we can create the EXACT format
-    XML_layer_file = ADS_substrate_filename.replace(".subst",".xml")
-    print('\nWriting output file: ', XML_layer_file)
-    
-    file = open(XML_layer_file, "w")
-    
-    file.write ('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
-    file.write ('  <Stackup schemaVersion="2.0">\n')
+  lines.append ('      <Dielectrics>\n')
+  
+  dielectrics_stringlist.reverse()
+  lines.extend(dielectrics_stringlist)
 
-    # ---------- materials -----------
+  lines.append ('      </Dielectrics>\n')
+  
+  # ---------- Metals and Vias -----------
+  
+  
+  for metal in ADS_metal_layers.layers:
+    metal.zpos1 = metal.zpos1 - semi_height
+    metal.zpos2 = metal.zpos2 - semi_height
 
-    file.write ('    <Materials>\n')
-    
-    # iterate over materials list
-      
-    for material in material_list:
-      if material.used:  # only material definitions that are actually in use in final file
-        file.write (str(material))
-    
-    file.write ('    </Materials>\n')
-    file.write ('    <ELayers LengthUnit="um">\n')
+  for via in ADS_via_layers.layers:
+    via.zpos1 = via.zpos1 - semi_height
+    via.zpos2 = via.zpos2 - semi_height
+  
+  # metal z positions have changed, rebuild lookup index
+  ADS_metal_layers.build_zpos_index()
+  
+  # change via start position, so that it starts at top of metal and not at bottom
+  for via in ADS_via_layers.layers:
+    index = ADS_metal_layers.find_next_from_zpos(via.zpos1, -1)
+    while index != None:
+      via.zpos1 = via.zpos1 + ADS_metal_layers.getlayer_by_index(index).thickness
+      index = ADS_metal_layers.find_next_from_zpos(via.zpos1, index)
+  
+  
+  lines.append ('      <Layers>\n')
+  lines.append ('        <Substrate Offset="' + str(semi_height) + '"/>\n')
+  
+  for metal in ADS_metal_layers.layers:
+    lines.append(str(metal))
 
-    # ---------- Dielectrics -----------
-    
-    # We need a list of dielectric layers, from top to bottom. That is reverse order than *.subst, so reverse the lsit
-    # But for internal processing, we need to go from bottom to top
-    
-      
-    dielectrics_stringlist = []   # To revert the output order later, we have an intermediate list to hold the strings
+  for via in ADS_via_layers.layers:
+    lines.append(str(via))
 
-    for dielectric in ADS_dielectric_layers.layers:
-      dielectrics_stringlist.append (str(dielectric))
-    
 
-    file.write ('      <Dielectrics>\n')
-    
-    dielectrics_stringlist.reverse()
-    for line in dielectrics_stringlist:
-      file.write(line)
+  lines.append ('      </Layers>\n')
+  lines.append ('    </ELayers>\n')
+  lines.append ('  </Stackup>\n\n')
+  
+  return ''.join(lines)
 
-    file.write ('      </Dielectrics>\n')
-    
-    # ---------- Metals and Vias -----------
-    
-    
-    for metal in ADS_metal_layers.layers:
-      metal.zpos1 = metal.zpos1 - semi_height
-      metal.zpos2 = metal.zpos2 - semi_height
 
-    for via in ADS_via_layers.layers:
-      via.zpos1 = via.zpos1 - semi_height
-      via.zpos2 = via.zpos2 - semi_height
-      
-    
-    # change via start position, so that it starts at top of metal and not at bottom
-    for via in ADS_via_layers.layers:
-      for metal in ADS_metal_layers.layers:
-        if testequal(via.zpos1, metal.zpos1):
-          via.zpos1 = via.zpos1 + metal.thickness
-    
-    
-    file.write ('      <Layers>\n')
-    file.write ('        <Substrate Offset="' + str(semi_height) + '"/>\n')
-    
-    for metal in ADS_metal_layers.layers:
-      file.write(str(metal))
+def convert_file (ADS_substrate_filename, materials_filename=None):
+  # compile one *.subst file and write XML stackup next to it, returns compiled_stackup
+  print('Input filename: ', ADS_substrate_filename)
+  stackup = compile_stackup(ADS_substrate_filename, materials_filename)
+  XML_layer_file = ADS_substrate_filename.replace(".subst",".xml")
+  stackup.write(XML_layer_file)
+  return stackup
 
-    for via in ADS_via_layers.layers:
-      file.write(str(via))
 
+# ---------------- Get ADS substrate filename(s) -----------------------------
 
-    file.write ('      </Layers>\n')
-    file.write ('    </ELayers>\n')
-    file.write ('  </Stackup>\n\n')
-    
-    file.close()
+if __name__ == "__main__":
 
-  else:
-    print('Input file ' + ADS_substrate_filename + ' not found')
+  mydir  = os.getcwd()             #    Base directory
+  print (mydir)
 
+  if len(sys.argv) < 2:
+    print('Usage: momentum_to_xml <name.subst> [<name2.subst> ...]')
+  else: 
+    # batch conversion, materials file is parsed only once
+    for ADS_substrate_filename in sys.argv[1:]:
+      convert_file(ADS_substrate_filename)
+      print()
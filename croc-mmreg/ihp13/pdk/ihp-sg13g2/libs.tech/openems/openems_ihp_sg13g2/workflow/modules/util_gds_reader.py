@@ -4,6 +4,7 @@ import gdspy
 import numpy as np
 import os
 import util_stackup_reader as stackup_reader
+from util_profiler import profiler, profiled
 
 
 # ============= technology specific stuff ===============
@@ -110,6 +111,7 @@ class all_polygons_list:
 
 
 
+@profiled('merge_via_array')
 def merge_via_array (polygons, maxspacing):
   # Via array merging consists of 3 steps: oversize, merge, undersize
   # Value for oversize depends on via layer
@@ -127,6 +129,7 @@ def merge_via_array (polygons, maxspacing):
 
 # ----------- read GDSII file, return openEMS polygon list object -----------
 
+@profiled('read_gds')
 def read_gds(filename, layerlist, purposelist, metals_list, preprocess=False, merge_polygon_size=0 ):
 
   """
@@ -136,7 +139,8 @@ def read_gds(filename, layerlist, purposelist, metals_list, preprocess=False, me
   if os.path.isfile(filename):
     print('Reading GDSII input file:', filename)
   
-    input_library = gdspy.GdsLibrary(infile=filename)
+    with profiler.stage('gdspy_parse'):
+      input_library = gdspy.GdsLibrary(infile=filename)
 
     if preprocess: 
       print('Pre-processing GDSII to handle cutouts and self-intersecting polygons')
@@ -268,6 +272,12 @@ def read_gds(filename, layerlist, purposelist, metals_list, preprocess=False, me
               all_polygons.append(new_poly)
 
     all_polygons.set_bounding_box (xmin,xmax,ymin,ymax)
+
+    # model size information for workflow profile
+    numvertices_total = 0
+    for poly in all_polygons.polygons:
+      numvertices_total = numvertices_total + len(poly.pts_x)
+    profiler.add_counts(polygons=len(all_polygons.polygons), vertices=numvertices_total)
     
           
       
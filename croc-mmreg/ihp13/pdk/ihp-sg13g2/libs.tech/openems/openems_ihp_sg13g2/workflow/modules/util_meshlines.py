@@ -3,8 +3,11 @@
 # create mesh lines for metals and dielectrics
 
 import math
+import sys
 from util_stackup_reader import *
 from util_gds_reader import *
+from util_profiler import profiler
+from CSXCAD import ContinuousStructure
 
 def create_z_mesh(mesh, dielectrics_list, metals_list, target_cellsize, max_cellsize, antenna_margin, exclude_list):
     
@@ -37,33 +40,9 @@ def create_z_mesh(mesh, dielectrics_list, metals_list, target_cellsize, max_cell
            
 
     # check for possible gaps
-    def add_missing_lines (direction):
-        lines = mesh.GetLines(direction, do_sort=True)
-       
-        added_something = False
-        for index in range(1, len(lines)-1):
-            previous_line = lines[index-1]
-            this_line = lines[index]
-            next_line = lines[index+1]
-            previous_dist = this_line-previous_line
-            this_dist = next_line-this_line
-
-            ratio = this_dist/previous_dist
-            if ratio > 3:
-                point = (this_line + this_dist/2)
-                mesh.AddLine(direction, point)
-                added_something = True
-            elif ratio < 1/3:
-                point = (this_line - previous_dist/2)
-                mesh.AddLine(direction, point)
-                added_something = True
-
-        return added_something
-
-
     check_z = True
     while check_z:
-        check_z = add_missing_lines('z')
+        check_z = add_missing_meshlines(mesh, 'z', 3)
 
     # add mesh line at bottom of stackup at z=0
     mesh.AddLine('z', 0.0)
@@ -324,44 +303,244 @@ def create_xy_mesh_from_polygons (mesh, allpolygons, margin, antenna_margin, tar
     mesh.SmoothMeshLines('y', max_cellsize, 1.3)
     
     # step 5: check for possible gaps
-    def add_missing_lines (direction):
-        lines = mesh.GetLines(direction, do_sort=True)
-       
-        added_something = False
-        for index in range(1, len(lines)-1):
-            previous_line = lines[index-1]
-            this_line = lines[index]
-            next_line = lines[index+1]
-            previous_dist = this_line-previous_line
-            this_dist = next_line-this_line
-
-            ratio = this_dist/previous_dist
-            if ratio > 2.5:
-                point = (this_line + this_dist/2)
-                mesh.AddLine(direction, point)
-                added_something = True
-            elif ratio < 1/2.5:
-                point = (this_line - previous_dist/2)
-                mesh.AddLine(direction, point)
-                added_something = True
-
+    fill_xy_gaps(mesh, max_cellsize)
+    
+    # done
+    return mesh
 
-        return added_something
 
+def fill_xy_gaps (mesh, max_cellsize):
+    # add lines where adjacent cells differ too much in size, then smooth, until nothing changes
     run_check = True
     while run_check:
-        check_x = add_missing_lines('x')
-        check_y = add_missing_lines('y')
+        check_x = add_missing_meshlines(mesh, 'x', 2.5)
+        check_y = add_missing_meshlines(mesh, 'y', 2.5)
         run_check = check_x or check_y
         mesh.SmoothMeshLines('x', max_cellsize, 1.3)
         mesh.SmoothMeshLines('y', max_cellsize, 1.3)
-    
-    # done
-    return mesh
+
+
+class incremental_xy_mesher:
+    """
+    xy mesh function with cache of the previous result, for parameter sweeps with small geometry changes.
+    Create one instance outside of the sweep loop and use it as xy_mesh_function in setupSimulation().
+    The polygon set is compared with the previous call: unchanged polygons reuse the cached mesh lines,
+    for changed polygons the mesh is recomputed only in their x/y interval plus a halo, and spliced 
+    into the cached mesh lines. If mesh settings or bounding box change, a full rebuild is done.
+    With verify=True, each incremental result is compared with a full rebuild, 
+    the full rebuild is then used if they differ.
+    """
+
+    def __init__ (self, halo=None, verify=False, max_changed_fraction=0.5):
+        self.halo = halo              # distance around changed intervals that is recomputed, default 2*max_cellsize
+        self.verify = verify
+        self.max_changed_fraction = max_changed_fraction  # full rebuild if more polygons are affected
+        self.settings = None          # mesh settings and bounding box of cached result
+        self.polygon_keys = None      # multiset of polygon keys in cached result
+        self.lines_x = None
+        self.lines_y = None
+        self.last_mode = None         # 'full', 'cached' or 'incremental', for information
+        self.verify_failures = 0
+
+    def polygon_key (self, poly):
+        # polygon identity for diff, includes flags that change meshing
+        return (poly.layernum, poly.is_port, poly.is_via, np.asarray(poly.pts_x).tobytes(), np.asarray(poly.pts_y).tobytes())
+
+    def get_polygon_keys (self, allpolygons):
+        keys = {}
+        for poly in allpolygons.polygons:
+            key = self.polygon_key(poly)
+            keys[key] = keys.get(key, 0) + 1
+        return keys
+
+    def new_grid (self):
+        return ContinuousStructure().GetGrid()
+
+    def full_rebuild (self, allpolygons, margin, antenna_margin, target_cellsize, max_cellsize):
+        grid = self.new_grid()
+        create_xy_mesh_from_polygons(grid, allpolygons, margin, antenna_margin, target_cellsize, max_cellsize)
+        return np.array(grid.GetLines('x', do_sort=True)), np.array(grid.GetLines('y', do_sort=True))
+
+    def get_windows (self, intervals, distance):
+        # grow intervals by distance and merge overlapping ones
+        windows = []
+        for (start, stop) in sorted(intervals):
+            start = start - distance
+            stop = stop + distance
+            if (len(windows) > 0) and (start <= windows[-1][1]):
+                windows[-1][1] = max(windows[-1][1], stop)
+            else:
+                windows.append([start, stop])
+        return windows
+
+    def in_windows (self, values, windows):
+        inside = np.zeros(len(values), dtype=bool)
+        for (start, stop) in windows:
+            inside = inside | ((values >= start) & (values <= stop))
+        return inside
+
+    def touches_windows (self, coords, other_coords, windows):
+        # True if polygon creates mesh lines in windows along this axis:
+        # vertex inside window, or diagonal segment that overlaps window
+        coords = np.asarray(coords)
+        other_coords = np.asarray(other_coords)
+        previous = np.roll(coords, 1)
+        diagonal = (coords != previous) & (other_coords != np.roll(other_coords, 1))
+        segment_min = np.minimum(coords, previous)
+        segment_max = np.maximum(coords, previous)
+        for (start, stop) in windows:
+            if np.any((coords >= start) & (coords <= stop)):
+                return True
+            if np.any(diagonal & (segment_max >= start) & (segment_min <= stop)):
+                return True
+        return False
+
+    def splice (self, cached_lines, new_lines, windows, min_distance):
+        # keep cached lines outside windows, new lines inside windows
+        cached_lines = cached_lines[~self.in_windows(cached_lines, windows)]
+        new_lines = new_lines[self.in_windows(new_lines, windows)]
+        lines = np.concatenate((cached_lines, new_lines))
+        is_new = np.concatenate((np.zeros(len(cached_lines), dtype=bool), np.ones(len(new_lines), dtype=bool)))
+        order = np.argsort(lines, kind='stable')
+        lines = lines[order]
+        is_new = is_new[order]
+        # at the window boundaries, drop new lines that are too close to a cached line
+        keep = np.ones(len(lines), dtype=bool)
+        for index in range(len(lines)-1):
+            if (is_new[index] != is_new[index+1]) and (lines[index+1] - lines[index] < min_distance):
+                if is_new[index]:
+                    keep[index] = False
+                else:
+                    keep[index+1] = False
+        return lines[keep]
+
+    def incremental_update (self, allpolygons, changed_polygons, margin, antenna_margin, target_cellsize, max_cellsize):
+        # recompute mesh lines in windows around changed polygons, return spliced lines or None if full rebuild is better
+        halo = self.halo if self.halo != None else 2*max_cellsize
+
+        intervals_x = [(np.min(poly.pts_x), np.max(poly.pts_x)) for poly in changed_polygons]
+        intervals_y = [(np.min(poly.pts_y), np.max(poly.pts_y)) for poly in changed_polygons]
+        # inner windows: mesh lines are replaced here, outer windows: polygons that can influence inner windows
+        windows_x = self.get_windows(intervals_x, halo)
+        windows_y = self.get_windows(intervals_y, halo)
+        outer_x = self.get_windows(intervals_x, 2*halo)
+        outer_y = self.get_windows(intervals_y, 2*halo)
+
+        # polygons for local mesh calculation, separate for each axis, bounding box is kept from full layout
+        subset_x = all_polygons_list()
+        subset_y = all_polygons_list()
+        for poly in allpolygons.polygons:
+            if self.touches_windows(poly.pts_x, poly.pts_y, outer_x):
+                subset_x.polygons.append(poly)
+            if self.touches_windows(poly.pts_y, poly.pts_x, outer_y):
+                subset_y.polygons.append(poly)
+        max_count = self.max_changed_fraction*len(allpolygons.polygons)
+        if (len(subset_x.polygons) > max_count) or (len(subset_y.polygons) > max_count):
+            return None
+        subset_x.set_bounding_box(*allpolygons.get_bounding_box())
+        subset_y.set_bounding_box(*allpolygons.get_bounding_box())
+
+        local_x, unused = self.full_rebuild(subset_x, margin, antenna_margin, target_cellsize, max_cellsize)
+        unused, local_y = self.full_rebuild(subset_y, margin, antenna_margin, target_cellsize, max_cellsize)
+        lines_x = self.splice(self.lines_x, local_x, windows_x, 0.5*target_cellsize)
+        lines_y = self.splice(self.lines_y, local_y, windows_y, 0.5*target_cellsize)
+
+        # fix cell size ratio at the seams
+        grid = self.new_grid()
+        grid.AddLine('x', lines_x)
+        grid.AddLine('y', lines_y)
+        fill_xy_gaps(grid, max_cellsize)
+        return np.array(grid.GetLines('x', do_sort=True)), np.array(grid.GetLines('y', do_sort=True))
+
+    def __call__ (self, mesh, allpolygons, margin, antenna_margin, target_cellsize, max_cellsize):
+        settings = (margin, antenna_margin, target_cellsize, max_cellsize, allpolygons.get_bounding_box())
+        polygon_keys = self.get_polygon_keys(allpolygons)
+        result = None
+
+        if (self.settings == settings) and (self.polygon_keys != None):
+            # diff polygon multisets, changed = added or removed
+            changed_keys = set()
+            for key, count in polygon_keys.items():
+                if self.polygon_keys.get(key, 0) != count:
+                    changed_keys.add(key)
+            for key, count in self.polygon_keys.items():
+                if polygon_keys.get(key, 0) != count:
+                    changed_keys.add(key)
+
+            if len(changed_keys) == 0:
+                self.last_mode = 'cached'
+                result = (self.lines_x, self.lines_y)
+            else:
+                changed_polygons = [poly for poly in allpolygons.polygons if self.polygon_key(poly) in changed_keys]
+                # removed polygons only exist as keys, rebuild their coordinates
+                current_keys = set(polygon_keys.keys())
+                for key in changed_keys - current_keys:
+                    removed = gds_polygon(key[0])
+                    removed.pts_x = np.frombuffer(key[3])
+                    removed.pts_y = np.frombuffer(key[4])
+                    changed_polygons.append(removed)
+                result = self.incremental_update(allpolygons, changed_polygons, margin, antenna_margin, target_cellsize, max_cellsize)
+                if result != None:
+                    self.last_mode = 'incremental'
+
+        if result == None:
+            self.last_mode = 'full'
+            result = self.full_rebuild(allpolygons, margin, antenna_margin, target_cellsize, max_cellsize)
+        elif self.verify and (self.last_mode == 'incremental'):
+            full_x, full_y = self.full_rebuild(allpolygons, margin, antenna_margin, target_cellsize, max_cellsize)
+            if not (self.lines_equal(result[0], full_x) and self.lines_equal(result[1], full_y)):
+                print('[WARNING] Incremental xy mesh differs from full rebuild, using full rebuild')
+                print('  x lines: ', len(result[0]), ' incremental, ', len(full_x), ' full rebuild')
+                print('  y lines: ', len(result[1]), ' incremental, ', len(full_y), ' full rebuild')
+                self.verify_failures = self.verify_failures + 1
+                self.last_mode = 'full'
+                result = (full_x, full_y)
+
+        print('xy mesh mode: ', self.last_mode)
+        profiler.add_counts(xy_mesh_mode=self.last_mode)
+        self.settings = settings
+        self.polygon_keys = polygon_keys
+        self.lines_x, self.lines_y = result
+
+        mesh.AddLine('x', self.lines_x)
+        mesh.AddLine('y', self.lines_y)
+        return mesh
+
+    def lines_equal (self, lines1, lines2, tolerance=1e-6):
+        return (len(lines1) == len(lines2)) and np.allclose(lines1, lines2, rtol=0, atol=tolerance)
+
 
 # ------------------- internal utilities -------------------------
 
 
+def add_missing_meshlines (mesh, direction, max_ratio):
+    """
+    Adds a mesh line where adjacent mesh cells differ more than max_ratio in size.
+    Returns True if lines were added, so that this can be repeated until nothing changes.
+    """
+    lines = mesh.GetLines(direction, do_sort=True)
+   
+    added_something = False
+    for index in range(1, len(lines)-1):
+        previous_line = lines[index-1]
+        this_line = lines[index]
+        next_line = lines[index+1]
+        previous_dist = this_line-previous_line
+        this_dist = next_line-this_line
+
+        ratio = this_dist/previous_dist
+        if ratio > max_ratio:
+            point = (this_line + this_dist/2)
+            mesh.AddLine(direction, point)
+            added_something = True
+        elif ratio < 1/max_ratio:
+            point = (this_line - previous_dist/2)
+            mesh.AddLine(direction, point)
+            added_something = True
+
+    return added_something
+
+
 
 def add_equal_meshlines(mesh, axis, start, stop, target_cellsize):
     """
@@ -426,3 +605,51 @@ def get_mesh_information (mesh):
     meshinfo = meshinfo + 'Smallest cell size:\n dx = ' + format(x_smallest,'.4f') + '\n dy = ' + format(y_smallest,'.4f') + '\n dz = ' + format(z_smallest,'.4f') + '\n________________________\n'
     return meshinfo
 
+
+
+
+# =======================================================================================
+# Test code when running as standalone script
+# =======================================================================================
+
+if __name__ == "__main__":
+
+    # incremental meshing self check: sweep the width of a port in a grid of lines,
+    # each result is compared with a full rebuild, without verify so that a wrong splice is not replaced
+    mesher = incremental_xy_mesher(verify=False)
+    failures = 0
+    previous_width = None
+    for width in [10, 10, 12, 14, 20]:
+        allpolygons = all_polygons_list()
+        for n in range(60):
+            allpolygons.add_rectangle(n*50, 0, n*50+10, 3000, 134)
+            allpolygons.add_rectangle(0, n*50, 3000, n*50+7, 126)
+        allpolygons.add_rectangle(1500, 1500, 1500+width, 1520, 201, is_port=True)
+
+        mesh = ContinuousStructure().GetGrid()
+        mesher(mesh, allpolygons, 50, 0, 1, 40)
+        print('Port width ', width, ' mode = ', mesher.last_mode, ' x lines = ', mesh.GetQtyLines('x'), ' y lines = ', mesh.GetQtyLines('y'))
+
+        if previous_width == None:
+            expected_mode = 'full'
+        elif width == previous_width:
+            expected_mode = 'cached'
+        else:
+            expected_mode = 'incremental'
+        previous_width = width
+        if mesher.last_mode != expected_mode:
+            print('[ERROR] Port width ', width, ': expected mode ', expected_mode, ', got ', mesher.last_mode)
+            failures = failures + 1
+
+        full_x, full_y = mesher.full_rebuild(allpolygons, 50, 0, 1, 40)
+        lines_x = np.array(mesh.GetLines('x', do_sort=True))
+        lines_y = np.array(mesh.GetLines('y', do_sort=True))
+        if not (mesher.lines_equal(lines_x, full_x) and mesher.lines_equal(lines_y, full_y)):
+            print('[ERROR] Port width ', width, ': mesh differs from full rebuild')
+            print('  x lines: ', len(lines_x), ' ', mesher.last_mode, ', ', len(full_x), ' full rebuild')
+            print('  y lines: ', len(lines_y), ' ', mesher.last_mode, ', ', len(full_y), ' full rebuild')
+            failures = failures + 1
+
+    print('Incremental meshing self check failures: ', failures)
+    if failures > 0:
+        sys.exit(1)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# Stage-level profiling for the openEMS workflow
+# Each workflow stage (GDSII reading, CSX setup, meshing, XML writing, solver, S-parameter evaluation)
+# records wall time, resident memory and model size counts like polygons, mesh lines and cells.
+# When the model script ends, the trace is written as JSON file to the simulation data directory,
+# optionally also as Chrome trace file that can be viewed in chrome://tracing or https://ui.perfetto.dev
+
+# Environment variables:
+# OPENEMS_CHROME_TRACE  if set, write Chrome trace file in addition to the JSON trace
+# OPENEMS_NO_PROFILE    if set, disable profiling and trace output
+
+import os, sys, time, json, atexit, functools
+from contextlib import contextmanager
+
+try:
+    import resource   # not available on Windows
+except ImportError:
+    resource = None
+
+
+def get_peak_rss_MB ():
+    # peak resident set size (high water mark) of this process in MB, None if not available
+    if resource != None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return peak / (1024*1024)   # macOS reports bytes
+        return peak / 1024              # Linux reports kilobytes
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024*1024)
+    except Exception:
+        return None
+
+
+def get_current_rss_MB ():
+    # current resident set size of this process in MB, None if not available
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024*1024)
+    except Exception:
+        return None
+
+
+class profile_stage:
+    """
+      one stage in the workflow profile
+    """
+
+    def __init__ (self, name, parent, start):
+        self.name = name
+        self.parent = parent     # name of enclosing stage, None for top level stages
+        self.start = start       # seconds since profiler start
+        self.stop = start
+        self.rss_start_MB = get_current_rss_MB()
+        self.rss_end_MB = None
+        self.max_rss_so_far_MB = None   # high water mark of the process at the end of the stage
+        self.counts = {}
+
+    def wall_time (self):
+        return self.stop - self.start
+
+    def to_dict (self):
+        return {'name': self.name,
+                'parent': self.parent,
+                'start_s': round(self.start, 6),
+                'wall_time_s': round(self.wall_time(), 6),
+                'rss_start_MB': workflow_profiler.round_or_none(self.rss_start_MB, 1),
+                'rss_end_MB': workflow_profiler.round_or_none(self.rss_end_MB, 1),
+                'max_rss_so_far_MB': workflow_profiler.round_or_none(self.max_rss_so_far_MB, 1),
+                'counts': self.counts}
+
+    def __str__ (self):
+        # string representation
+        mystr = self.name + ': ' + format(self.wall_time(), '.3f') + ' s'
+        if (self.rss_start_MB != None) and (self.rss_end_MB != None):
+            mystr = mystr + ', RSS ' + format(self.rss_start_MB, '.0f') + ' -> ' + format(self.rss_end_MB, '.0f') + ' MB'
+        if self.max_rss_so_far_MB != None:
+            mystr = mystr + ', max RSS so far ' + format(self.max_rss_so_far_MB, '.0f') + ' MB'
+        for key, value in self.counts.items():
+            mystr = mystr + ', ' + key + ' = ' + str(value)
+        return mystr
+
+
+class workflow_profiler:
+    """
+      collects profile stages of one model script run
+    """
+
+    def __init__ (self):
+        self.stages = []          # finished and running stages, in order of start
+        self.active = []          # stack of currently running stages
+        self.t0 = time.perf_counter()
+        self.output_path = None   # trace is only written if this is set
+        self.model_basename = 'model'
+        self.chrome_trace = os.getenv('OPENEMS_CHROME_TRACE') is not None
+        self.enabled = os.getenv('OPENEMS_NO_PROFILE') is None
+
+    @staticmethod
+    def round_or_none (value, digits):
+        return None if value == None else round(value, digits)
+
+    def now (self):
+        return time.perf_counter() - self.t0
+
+    @contextmanager
+    def stage (self, name, **counts):
+        # usage: with profiler.stage('name', polygons=123): ...
+        if not self.enabled:
+            yield None
+            return
+        parent = self.active[-1].name if len(self.active) > 0 else None
+        new_stage = profile_stage(name, parent, self.now())
+        new_stage.counts.update(counts)
+        self.stages.append(new_stage)
+        self.active.append(new_stage)
+        try:
+            yield new_stage
+        finally:
+            new_stage.stop = self.now()
+            new_stage.rss_end_MB = get_current_rss_MB()
+            new_stage.max_rss_so_far_MB = get_peak_rss_MB()
+            self.active.remove(new_stage)
+
+    def add_counts (self, **counts):
+        # add counts to innermost running stage
+        if self.enabled and len(self.active) > 0:
+            self.active[-1].counts.update(counts)
+
+    def set_output_path (self, sim_path, model_basename):
+        self.output_path = sim_path
+        self.model_basename = model_basename
+
+    def get_summary (self):
+        # total time and number of calls per stage name
+        summary = {}
+        for stage in self.stages:
+            entry = summary.setdefault(stage.name, {'calls': 0, 'wall_time_s': 0.0})
+            entry['calls'] = entry['calls'] + 1
+            entry['wall_time_s'] = round(entry['wall_time_s'] + stage.wall_time(), 6)
+        return summary
+
+    def write_trace (self, path=None):
+        # write JSON trace, and Chrome trace if requested, returns filename of JSON trace
+        if path == None:
+            path = self.output_path
+        if (path == None) or (len(self.stages) == 0):
+            return None
+
+        trace_file = os.path.join(path, self.model_basename + '_profile.json')
+        trace = {'model': self.model_basename,
+                 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'total_time_s': round(self.now(), 6),
+                 'max_rss_MB': self.round_or_none(get_peak_rss_MB(), 1),
+                 'summary': self.get_summary(),
+                 'stages': [stage.to_dict() for stage in self.stages]}
+        with open(trace_file, 'w') as f:
+            json.dump(trace, f, indent=2)
+
+        if self.chrome_trace:
+            # complete events ('X') in microseconds, nesting is derived from timestamps
+            events = []
+            for stage in self.stages:
+                events.append({'name': stage.name, 'cat': 'openems', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                               'ts': stage.start*1e6, 'dur': stage.wall_time()*1e6, 'args': stage.counts})
+            chrome_file = os.path.join(path, self.model_basename + '_trace.json')
+            with open(chrome_file, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        return trace_file
+
+    def write_trace_at_exit (self):
+        try:
+            trace_file = self.write_trace()
+            if trace_file != None:
+                print('Workflow profile written to ', trace_file)
+        except OSError as e:
+            print('[WARNING] Could not write workflow profile: ', e)
+
+
+# one profiler for the whole model script, shared by all modules
+profiler = workflow_profiler()
+atexit.register(profiler.write_trace_at_exit)
+
+
+def profiled (stagename):
+    # decorator to record a function call as one profile stage
+    def decorator (func):
+        @functools.wraps(func)
+        def wrapper (*args, **kwargs):
+            with profiler.stage(stagename):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -6,6 +6,7 @@ import util_stackup_reader as stackup_reader
 import util_gds_reader as gds_reader
 import util_utilities as utilities
 import util_meshlines
+from util_profiler import profiler, profiled
 
 from pylab import *
 from CSXCAD import ContinuousStructure
@@ -71,6 +72,7 @@ class all_simulation_ports:
       return self.ports[portnum-1] 
 
 
+@profiled('addGeometry_to_CSX')
 def addGeometry_to_CSX (CSX, excite_portnumbers,simulation_ports,FDTD, materials_list, dielectrics_list, metals_list, allpolygons):
 # Add polygons   
 
@@ -108,6 +110,7 @@ def addGeometry_to_CSX (CSX, excite_portnumbers,simulation_ports,FDTD, materials
     return CSX, CSX_materials_list                    
 
 
+@profiled('addDielectrics_to_CSX')
 def addDielectrics_to_CSX (CSX, CSX_materials_list,  materials_list, dielectrics_list, allpolygons, margin, addPEC):
 # Add dielectric layers (these extend through simulation area and have no polygons in GDSII)
 
@@ -140,6 +143,7 @@ def addDielectrics_to_CSX (CSX, CSX_materials_list,  materials_list, dielectrics
     return CSX, CSX_materials_list  
 
 
+@profiled('addPorts_to_CSX')
 def addPorts_to_CSX (CSX, excite_portnumbers,simulation_ports,FDTD, materials_list, dielectrics_list, metals_list, allpolygons):
 # Add polygons   
 
@@ -230,6 +234,7 @@ def addPorts_to_CSX (CSX, excite_portnumbers,simulation_ports,FDTD, materials_li
 
 
 
+@profiled('addMesh_to_CSX')
 def addMesh_to_CSX (CSX, allpolygons, dielectrics_list, metals_list, refined_cellsize, max_cellsize, margin, air_around, unit, z_mesh_function, xy_mesh_function):
 # Add mesh using default method
     mesh = CSX.GetGrid()
@@ -237,13 +242,22 @@ def addMesh_to_CSX (CSX, allpolygons, dielectrics_list, metals_list, refined_cel
 
     # meshing of dielectrics and metals
     no_z_mesh_list = ['SiO2','LBE'] # exclude SiO2 from meshing because we only mesh metal layers in that region, exclude LBE because we mesh substrate
-    mesh = z_mesh_function (mesh, dielectrics_list, metals_list, refined_cellsize, max_cellsize, air_around, no_z_mesh_list)
-    mesh = xy_mesh_function (mesh, allpolygons, margin, air_around, refined_cellsize, max_cellsize)
+    with profiler.stage('z_mesh'):
+        mesh = z_mesh_function (mesh, dielectrics_list, metals_list, refined_cellsize, max_cellsize, air_around, no_z_mesh_list)
+    with profiler.stage('xy_mesh'):
+        mesh = xy_mesh_function (mesh, allpolygons, margin, air_around, refined_cellsize, max_cellsize)
+
+    # model size information for workflow profile
+    x_count = mesh.GetQtyLines('x')
+    y_count = mesh.GetQtyLines('y')
+    z_count = mesh.GetQtyLines('z')
+    profiler.add_counts(mesh_lines_x=x_count, mesh_lines_y=y_count, mesh_lines_z=z_count, mesh_cells=x_count*y_count*z_count)
 
     return mesh
 
 
 
+@profiled('setupSimulation')
 def setupSimulation (excite_portnumbers,simulation_ports, FDTD, materials_list, dielectrics_list, metals_list, allpolygons, max_cellsize, refined_cellsize, margin, unit, z_mesh_function=util_meshlines.create_z_mesh, xy_mesh_function=util_meshlines.create_standard_xy_mesh, air_around=0):
 # Define function for model creation because we need to create and run separate CSX
 # for each excitation. For S11,S21 we only need to excite port 1, but for S22,S12
@@ -251,6 +265,7 @@ def setupSimulation (excite_portnumbers,simulation_ports, FDTD, materials_list,
 
     CSX = ContinuousStructure()
     FDTD.SetCSX(CSX)
+    profiler.add_counts(excitation=str(excite_portnumbers), polygons=len(allpolygons.polygons))
 
     # add geometries and return list of used materials
     CSX, CSX_materials_list = addGeometry_to_CSX (CSX, excite_portnumbers,simulation_ports,FDTD, materials_list, dielectrics_list, metals_list, allpolygons)
@@ -280,6 +295,7 @@ def setupSimulation (excite_portnumbers,simulation_ports, FDTD, materials_list,
     return FDTD
 
 
+@profiled('runSimulation')
 def runSimulation (excite_portnumbers, FDTD, sim_path, model_basename, preview_only, postprocess_only, force_simulation=False):
  
     excitation_path = utilities.get_excitation_path (sim_path, excite_portnumbers)
@@ -288,13 +304,16 @@ def runSimulation (excite_portnumbers, FDTD, sim_path, model_basename, preview_o
         # write CSX file 
         CSX_file = os.path.join(excitation_path, model_basename + '.xml')
         CSX = FDTD.GetCSX()
-        CSX.Write2XML(CSX_file)
+        with profiler.stage('write_xml'):
+            CSX.Write2XML(CSX_file)
+        profiler.add_counts(xml_size_MB=round(os.path.getsize(CSX_file)/(1024*1024), 3))
 
         # preview model
         if 1 in excite_portnumbers:  # only for first port excitation
             print('Starting AppCSXCAD 3D viewer with file: \n', CSX_file)
             print('Close AppCSXCAD to continue or press <Ctrl>-C to abort')
-            ret = os.system(AppCSXCAD_BIN + ' "{}"'.format(CSX_file))
+            with profiler.stage('preview'):
+                ret = os.system(AppCSXCAD_BIN + ' "{}"'.format(CSX_file))
             if ret != 0:
                 print('[ERROR] AppCSXCAD failed to launch. Exit code: ', ret)
                 sys.exit(1)
@@ -312,7 +331,8 @@ def runSimulation (excite_portnumbers, FDTD, sim_path, model_basename, preview_o
             print('Starting FDTD simulation for excitation ', str(excite_portnumbers))
             try:
 
-                FDTD.Run(excitation_path)  # DO NOT SPECIFY COMMAND LINE OPTIONS HERE! That will fail for repeated runs with multiple excitations.
+                with profiler.stage('fdtd_solver', excitation=str(excite_portnumbers)):
+                    FDTD.Run(excitation_path)  # DO NOT SPECIFY COMMAND LINE OPTIONS HERE! That will fail for repeated runs with multiple excitations.
                 print('FDTD simulation completed successfully for excitation ', str(excite_portnumbers))
                 # Now that simulation created output data, write the hash of the underlying XML model. This will help to identify existing data for this model.
                 write_hash_to_data_folder(excitation_path, XML_hash)
@@ -204,40 +204,63 @@ def read_substrate (XML_filename):
     substrate_tree = xml.etree.ElementTree.parse(XML_filename)
     substrate_root = substrate_tree.getroot()
 
-    # get materials  from  XML
-    materials_list = stackup_materials_list() # initialize empty list
-    for data in  substrate_root.iter("Material"):
-        materials_list.append (stackup_material(data))
-
-    # get dielectric layers from  XML
-    dielectrics_list = dielectric_layers_list() # initialize empty list
-    for data in  substrate_root.iter("Dielectric"):
-        dielectrics_list.append (dielectric_layer(data), materials_list)
-    # mark top and bottom, order from XML is top material first
-    dielectrics_list.dielectrics[0].is_top = True
-    dielectrics_list.dielectrics[len(dielectrics_list.dielectrics)-1].is_bottom = True
-
-    # calculate z positions in dielectric layers, after reading all of them
-    dielectrics_list.calculate_zpositions()
-
-    # get metal layers (metals + vias) from XML
-    metals_list = metal_layers_list() # initialize empty list
-    for data in  substrate_root.iter("Layer"):
-        metals_list.append (metal_layer(data))
-
-    # get substrate offset, required for v2 stackup file version
-    offset = 0
-    for data in substrate_root.iter("Substrate"):
-        assert data!=None
-        offset = float(data.get("Offset"))      
-    if offset > 0:
-      metals_list.add_offset(offset)
-
-    return materials_list, dielectrics_list, metals_list
+    return read_substrate_from_root (substrate_root)
   
   else:
     print('XML stackup file not found: ', XML_filename)
     exit(1)
+
+
+def read_substrate_from_string (XML_string):
+
+  """
+  Read XML substrate from string and return materials_list, dielectrics_list, metals_list.
+  This is used for stackups created in memory, e.g. by momentum_to_xml.compile_stackup()
+  input value: XML string
+  """
+
+  substrate_root = xml.etree.ElementTree.fromstring(XML_string)
+  return read_substrate_from_root (substrate_root)
+
+
+def read_substrate_from_root (substrate_root):
+
+  """
+  Create materials_list, dielectrics_list, metals_list from parsed XML stackup.
+  input value: root element of XML stackup
+  """
+
+  # get materials  from  XML
+  materials_list = stackup_materials_list() # initialize empty list
+  for data in  substrate_root.iter("Material"):
+      materials_list.append (stackup_material(data))
+
+  # get dielectric layers from  XML
+  dielectrics_list = dielectric_layers_list() # initialize empty list
+  for data in  substrate_root.iter("Dielectric"):
+      dielectrics_list.append (dielectric_layer(data), materials_list)
+  # mark top and bottom, order from XML is top material first
+  dielectrics_list.dielectrics[0].is_top = True
+  dielectrics_list.dielectrics[len(dielectrics_list.dielectrics)-1].is_bottom = True
+
+  # calculate z positions in dielectric layers, after reading all of them
+  dielectrics_list.calculate_zpositions()
+
+  # get metal layers (metals + vias) from XML
+  metals_list = metal_layers_list() # initialize empty list
+  for data in  substrate_root.iter("Layer"):
+      metals_list.append (metal_layer(data))
+
+  # get substrate offset, required for v2 stackup file version
+  offset = 0
+  for data in substrate_root.iter("Substrate"):
+      assert data!=None
+      offset = float(data.get("Offset"))      
+  if offset > 0:
+    metals_list.add_offset(offset)
+
+  return materials_list, dielectrics_list, metals_list
+
   # =========================== utilities ===========================
 
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os, tempfile, platform, sys
+from util_profiler import profiler, profiled
 
 
 # ============================== filename and path  =================================
@@ -36,6 +37,9 @@ def create_sim_path (script_path, model_basename):
         base_path =  os.path.join(tempfile.gettempdir(), 'openEMS')
         sim_path = os.path.join(base_path, model_basename + '_data')
 
+    # workflow profile is written to simulation data directory when the model script ends
+    profiler.set_output_path(sim_path, model_basename)
+
     return sim_path
 
 
@@ -49,6 +53,7 @@ def get_excitation_path (sim_path, ports):
 
 # ========================= S-parameter calculations  =============================
 
+@profiled('calculate_Sij')
 def calculate_Sij (i, j, f, sim_path, simulation_ports):
     # S-parameter calculation for one element of the S matrix
     try:
@@ -74,6 +79,7 @@ def calculate_Sij (i, j, f, sim_path, simulation_ports):
         sys.exit(1)
 
 
+@profiled('calculate_Yij_2port')
 def calculate_Yij_2port (i, j, f, sim_path, simulation_ports, symmetry=False):
     # Y parameter calculation for 2-port data, returns  one element of the Y matrix, 
     # requires all ports excitations to be simulated because we need full S matrix
@@ -119,6 +125,7 @@ def calculate_Yij_2port (i, j, f, sim_path, simulation_ports, symmetry=False):
 
 
         
+@profiled('calculate_Zij_2port')
 def calculate_Zij_2port (i, j, f, sim_path, simulation_ports, symmetry=False):
     # Z parameter calculation for 2-port data, returns  one element of the Z matrix, 
     # requires all ports excitations to be simulated because we need full S matrix
@@ -167,6 +174,7 @@ def calculate_Zij_2port (i, j, f, sim_path, simulation_ports, symmetry=False):
 
 # =========================== S-parameter output  =================================
 
+@profiled('write_snp')
 def write_snp (Smatrix,f, filename):
     # Smatrix input must np.array[s11] or np.array[[s11,s21],[s12,s22]], more ports are also supported
 
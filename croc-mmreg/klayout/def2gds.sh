@@ -13,6 +13,10 @@ cd $klayout_dir
 ################
 topcell="croc_chip"
 defpath="$root_dir/openroad/out/croc.def"
+# output format follows the extension (.gds or .oas)
+outfile=${OUT_FILE:-${topcell}.gds}
+# per phase timings, memory and layout sizes as JSON
+reportfile=${REPORT_FILE:-${topcell}_def2stream.json}
 
 
 ################
@@ -76,7 +80,9 @@ klayout_cmd="$KLAYOUT -zz \
           -rd design_name=\"$topcell\" \
           -rd in_def=\"$defpath\" \
           -rd gds_flist=\"$KLAYOUT_HOME/tech/tech_gds.f\" \
-          -rd out_file=\"${topcell}.gds\" \
+          -rd lib_cache_dir=\"$KLAYOUT_HOME/libcache\" \
+          -rd out_file=\"$outfile\" \
+          -rd report_file=\"$reportfile\" \
           -rd tech_file=\"$KLAYOUT_HOME/tech/sg13g2.lyt\" \
           -rd layer_map=\"$KLAYOUT_HOME/tech/sg13g2.map\" \
           -rm def2stream.py"
@@ -4,8 +4,162 @@ import json
 import copy
 import sys
 import os
+import time
+import hashlib
+import resource
+from concurrent.futures import ThreadPoolExecutor
 
 errors = 0
+start_time = time.time()
+phase_time = start_time
+phases = []
+
+def max_rss_mb():
+  # High water mark of the process, ru_maxrss is in kB on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def current_rss_mb():
+  # Current resident set size (VmRSS), None where /proc is not available
+  try:
+    with open('/proc/self/status', 'r') as f:
+      for line in f:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1]) / 1024
+  except OSError:
+    pass
+  return None
+
+def round_mb(value):
+  return None if value is None else round(value, 1)
+
+phase_rss = current_rss_mb()
+
+def layout_stats(layout):
+  # Hierarchical counts, instances and shapes are counted once per cell
+  stats = {'cells': layout.cells(), 'instances': 0, 'shapes': 0}
+  layers = layout.layer_indexes()
+  for cell in layout.each_cell():
+    stats['instances'] += cell.child_instances()
+    for layer in layers:
+      stats['shapes'] += cell.shapes(layer).size()
+  return stats
+
+def report_step(step, layout=None, **details):
+  # Record the time since the previous step, the resident memory at its start and
+  # end, the high water mark of the process so far and the layout size
+  global phase_time, phase_rss
+  now = time.time()
+  rss = current_rss_mb()
+  phase = {'phase': step, 'time': round(now - phase_time, 3), 'elapsed': round(now - start_time, 3),
+           'rss_start_mb': round_mb(phase_rss), 'rss_end_mb': round_mb(rss),
+           'max_rss_so_far_mb': round_mb(max_rss_mb())}
+  if layout is not None:
+    phase.update(layout_stats(layout))
+  phase.update(details)
+  phases.append(phase)
+  phase_time = now
+  phase_rss = rss
+  print("[INFO] {0} done after {1:.2f}s ({2:.2f}s total), RSS {3} -> {4} MB, max so far {5:.0f} MB".format(
+    step, phase['time'], phase['elapsed'], phase['rss_start_mb'], phase['rss_end_mb'],
+    phase['max_rss_so_far_mb']))
+
+def write_report(file_name):
+  report = {'design': design_name, 'def': in_def, 'output': out_file, 'errors': errors,
+            'time': round(time.time() - start_time, 3), 'max_rss_mb': round_mb(max_rss_mb()),
+            'phases': phases}
+  with open(file_name + ".tmp", 'w') as f:
+    json.dump(report, f, indent=1)
+  os.replace(file_name + ".tmp", file_name)
+  print("[INFO] Wrote stage report '{0}'".format(file_name))
+
+def library_cell_names(file_name):
+  # Cell names of a GDS/OAS file: reading without layers skips all geometry
+  options = pya.LoadLayoutOptions()
+  options.layer_map = pya.LayerMap()
+  options.create_other_layers = False
+  library = pya.Layout()
+  library.read(file_name, options)
+  return set(i.name for i in library.each_cell())
+
+def read_library(file_name):
+  read_start = time.time()
+  library = pya.Layout()
+  library.read(file_name)
+  return library, time.time() - read_start
+
+def merge_library(layout, library, cell_names, filled_cells):
+  # Copy the referenced cells and their subcells of a library into the layout.
+  # Cells are merged by name like reading all libraries into one layout: subcells
+  # shared by several libraries (e.g. SRAM bit cells) are filled by the first one only.
+  names = [n for n in cell_names if library.has_cell(n) and n not in filled_cells]
+  if len(names) == 0:
+    return 0
+  layer_mapping = pya.LayerMapping()
+  layer_mapping.create_full(layout, library)
+
+  source_cells = set()
+  for n in names:
+    source_cells.add(library.cell(n).cell_index())
+    source_cells.update(library.cell(n).called_cells())
+  target_cells = {}
+  for i in source_cells:
+    name = library.cell_name(i)
+    target_cells[i] = layout.cell(name).cell_index() if layout.has_cell(name) else layout.add_cell(name)
+
+  for i in source_cells:
+    name = library.cell_name(i)
+    if name in filled_cells:
+      continue
+    filled_cells.add(name)
+    source = library.cell(i)
+    target = layout.cell(target_cells[i])
+    target.copy_shapes(source, layer_mapping)
+    for inst in source.each_inst():
+      cell_inst = inst.cell_inst.dup()
+      cell_inst.cell_index = target_cells[inst.cell_index]
+      target.insert(cell_inst)
+  return len(names)
+
+def library_cache(cache_dir, file_names):
+  # Merged OASIS of all library files and its cell names, keyed by the
+  # content hashes of the files. It is built on the first use.
+  digest = hashlib.sha256()
+  for fil in file_names:
+    with open(fil, 'rb') as f:
+      digest.update(hashlib.sha256(f.read()).digest())
+  prefix = "lib_{0}".format(digest.hexdigest()[:16])
+  blob = os.path.join(cache_dir, prefix + ".oas")
+  index = os.path.join(cache_dir, prefix + ".json")
+
+  if os.path.isfile(blob) and os.path.isfile(index):
+    print("[INFO] Using library cache '{0}'".format(blob))
+    with open(index, 'r') as f:
+      return blob, set(json.load(f))
+
+  print("[INFO] Building library cache '{0}'".format(blob))
+  os.makedirs(cache_dir, exist_ok=True)
+  library = pya.Layout()
+  for fil in file_names:
+    print("\t{0}".format(fil))
+    library.read(fil)
+  cell_names = sorted(i.name for i in library.each_cell())
+
+  save_options = pya.SaveLayoutOptions()
+  save_options.format = "OASIS"
+  save_options.oasis_write_cblocks = True
+  save_options.oasis_strict_mode = True
+  library.write(blob + ".tmp", save_options)
+  library._destroy()
+  with open(index + ".tmp", 'w') as f:
+    json.dump(cell_names, f)
+
+  # Remove caches of older library versions, the index is written last
+  for fil in os.listdir(cache_dir):
+    if fil.startswith("lib_") and not fil.startswith(prefix):
+      os.remove(os.path.join(cache_dir, fil))
+  os.replace(blob + ".tmp", blob)
+  os.replace(index + ".tmp", index)
+  return blob, set(cell_names)
 
 # Load technology file
 tech = pya.Technology()
@@ -19,6 +173,8 @@ main_layout = pya.Layout()
 print("[INFO] Reading DEF ...")
 main_layout.read(in_def, layoutOptions)
 
+report_step("Reading DEF", main_layout)
+
 print("[INFO] Reporting cells after loading DEF ...")
 for i in main_layout.each_cell():
  print("[INFO] '{0}'".format(i.name))
@@ -34,20 +190,75 @@ for i in main_layout.each_cell():
     if not i.name.startswith("VIA_"):
       i.clear()
 
+report_step("Clearing cells", main_layout)
+
 # Load in the gds to merge
 print("[INFO] Merging GDS/OAS files...")
 with open(gds_flist, 'rb') as file:
     in_files_list = file.read()
-for fil in in_files_list.split():
-  print("\t{0}".format(fil))
-  main_layout.read(fil)
 
-# Copy the top level only to a new layout
-print("[INFO] Copying toplevel cell '{0}'".format(design_name))
-top_only_layout = pya.Layout()
-top_only_layout.dbu = main_layout.dbu
-top = top_only_layout.create_cell(design_name)
-top.copy_tree(main_layout.cell(design_name))
+merged_files = []
+if 'GDS_FULL_MERGE' in os.environ:
+  # Read all library files completely, e.g. to compare time and memory
+  print("[INFO] Found GDS_FULL_MERGE variable.")
+  for fil in in_files_list.split():
+    print("\t{0}".format(fil))
+    read_start = time.time()
+    main_layout.read(fil)
+    merged_files.append({'file': os.fsdecode(fil), 'read_time': round(time.time() - read_start, 3)})
+else:
+  # Only the cells referenced by the DEF are taken from the libraries
+  cell_names = set(i.name for i in main_layout.each_cell()
+                   if i.cell_index() != top_cell_index and not i.name.startswith("VIA_"))
+  lib_files = []
+  if 'lib_cache_dir' in globals() and len(lib_cache_dir) > 0:
+    # All libraries pre-merged into one file
+    blob, blob_cell_names = library_cache(lib_cache_dir, in_files_list.split())
+    if len(blob_cell_names & cell_names) > 0:
+      lib_files.append(blob)
+  else:
+    for fil in in_files_list.split():
+      if len(library_cell_names(fil) & cell_names) == 0:
+        print("\t{0} (skipped, no referenced cells)".format(fil))
+      else:
+        lib_files.append(fil)
+
+  # Libraries are independent, read them concurrently into separate layouts
+  filled_cells = set()
+  with ThreadPoolExecutor(max_workers=max(1, min(len(lib_files), os.cpu_count() or 1))) as executor:
+    libraries = executor.map(read_library, lib_files)
+    for fil, (library, read_time) in zip(lib_files, libraries):
+      merge_start = time.time()
+      count = merge_library(main_layout, library, cell_names, filled_cells)
+      print("\t{0} ({1} referenced cells)".format(fil, count))
+      merged_files.append({'file': os.fsdecode(fil),
+                           'cells': count, 'read_time': round(read_time, 3),
+                           'merge_time': round(time.time() - merge_start, 3)})
+      library._destroy()
+
+report_step("Merging GDS/OAS files", main_layout, files=merged_files)
+
+if 'GDS_COPY_TOPLEVEL' in os.environ:
+  # Copy the top level only to a new layout
+  print("[INFO] Found GDS_COPY_TOPLEVEL variable.")
+  print("[INFO] Copying toplevel cell '{0}'".format(design_name))
+  top_only_layout = pya.Layout()
+  top_only_layout.dbu = main_layout.dbu
+  top = top_only_layout.create_cell(design_name)
+  top.copy_tree(main_layout.cell(design_name))
+else:
+  # Delete all cells outside of the toplevel tree, the chip is kept only once
+  print("[INFO] Pruning cells outside of toplevel cell '{0}'".format(design_name))
+  top = main_layout.cell(design_name)
+  used_cells = set(top.called_cells())
+  used_cells.add(top.cell_index())
+  unused_cells = [i.cell_index() for i in main_layout.each_cell() if i.cell_index() not in used_cells]
+  if len(unused_cells) > 0:
+    main_layout.delete_cells(unused_cells)
+  print("[INFO] Deleted {0} unreferenced cells".format(len(unused_cells)))
+  top_only_layout = main_layout
+
+report_step("Extracting toplevel cell", top_only_layout)
 
 print("[INFO] Checking for missing cell from GDS/OAS...")
 missing_cell = False
@@ -79,9 +290,22 @@ for i in top_only_layout.each_cell():
 if not orphan_cell:
   print("[INFO] No orphan cells")
 
+report_step("Checking cells", errors=errors)
+
 
 # Write out the GDS
 print("[INFO] Writing out GDS/OAS '{0}'".format(out_file))
-top_only_layout.write(out_file)
+save_options = pya.SaveLayoutOptions()
+save_options.set_format_from_filename(out_file)
+if save_options.format == "OASIS":
+  # CBLOCK compressed, strict mode OASIS (name tables with offsets)
+  save_options.oasis_write_cblocks = True
+  save_options.oasis_strict_mode = True
+  save_options.oasis_compression_level = int(os.getenv('OAS_COMPRESSION_LEVEL', '2'))
+top_only_layout.write(out_file, save_options)
+report_step("Writing GDS/OAS", file_size=os.path.getsize(out_file))
+
+if 'report_file' in globals() and len(report_file) > 0:
+  write_report(report_file)
 
 sys.exit(errors)